@@ -0,0 +1,364 @@
+import asyncio
+import os
+import threading
+import time
+
+from threadingbgworker import ThreadingBgWorker, NS_PER_SEC
+from pacing import PaceMode, NO_WORK
+
+
+class AsyncWorkerLoop(threading.Thread):
+    '''
+    Event loop thread shared by all AsyncBgWorkers.
+    Owned by the mainProcess, all async workers are scheduled on this one loop.
+    Parameters:
+        - `name`: name of the loop thread
+    '''
+    def __init__(self, name = 'async-workers'):
+        super().__init__(name=name, daemon=True)
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    # run a callback in the loop thread (callable from any thread)
+    def call(self, callback, *args):
+        if threading.current_thread() is self:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    # stop the event loop (running workers are abandoned)
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# loop for async workers created without mainProcess
+_default_loop = None
+_default_loop_lock = threading.Lock()
+
+def get_default_loop():
+    global _default_loop
+    with _default_loop_lock:
+        if _default_loop is None:
+            _default_loop = AsyncWorkerLoop()
+            _default_loop.start()
+        return _default_loop
+
+
+class AsyncBgWorker(ThreadingBgWorker):
+    '''
+    Background worker as a coroutine (for many I/O-bound workers).
+    The hooks addToJobRun, taskForIteration, taskForPeriodicJob, taskForTimerEnd
+    and taskForStop are coroutines (async def), specificStatus, checkpointState and
+    restoreState stay normal methods.
+    All async workers share one event loop (AsyncWorkerLoop), there is no thread
+    per worker (and no state of threading.Thread). start(), stop(), join(), is_alive(),
+    set_timer() and get_status() work like for a ThreadingBgWorker, so cliEngine and
+    batch mode can use it unchanged.
+        - stop() cancels the task of the worker
+        - the timer and the periodic job are timer handles of the event loop,
+          set_timer() reschedules them
+        - the status snapshot is rebuilt when it is read and older than
+          statusIntervalSec, an idle worker has no status timer on the loop
+          (only with a history or a checkpoint file)
+        - the instrumentation and the history are off by default (a few KB per
+          worker instead of about 60 KB), set_stats() switches the
+          instrumentation on at runtime
+    Parameters: see ThreadingBgWorker
+    '''
+    # not a thread: the name is a plain attribute, not the property of threading.Thread
+    name = None
+
+    def __init__(self,
+                 name,
+                 event,
+                 timerMin = None,
+                 slowDownSec = None,
+                 periodicJobSec = None,
+                 logging_on = True,
+                 cli_name = None,
+                 log_directory = './logs',
+                 timezone = 'Europe/Paris',
+                 statusIntervalSec = 1,
+                 stats_on = False,
+                 historySize = None,
+                 historyIntervalSec = 5,
+                 paceMode = PaceMode.fixed.value,
+                 rateHz = None,
+                 idleBackoffMaxSec = 1.0):
+
+        super().__init__(name=name,
+                         event=event,
+                         timerMin=timerMin,
+                         slowDownSec=slowDownSec,
+                         periodicJobSec=periodicJobSec,
+                         logging_on=logging_on,
+                         cli_name=cli_name,
+                         log_directory=log_directory,
+                         timezone=timezone,
+                         statusIntervalSec=statusIntervalSec,
+                         stats_on=stats_on,
+                         historySize=historySize,
+                         historyIntervalSec=historyIntervalSec,
+                         paceMode=paceMode,
+                         rateHz=rateHz,
+                         idleBackoffMaxSec=idleBackoffMaxSec)
+        self.asyncLoop = None
+        self.task = None
+        self.started = False
+        self.done = threading.Event()
+
+    # no own thread, the state of threading.Thread is not built
+    def initThread(self):
+        pass
+
+    def __repr__(self):
+        state = 'started' if self.is_alive() else 'stopped' if self.started else 'initial'
+        return f'<{type(self).__name__}({self.name}, {state})>'
+
+    # the worker runs in the thread of the shared loop
+    def profileThreadIdent(self):
+        if self.asyncLoop is None or not self.started:
+            return None
+        return self.asyncLoop.ident
+
+    # only the samples while the loop runs the coroutine of this worker
+    def profileStackFilter(self):
+        mainCode = AsyncBgWorker.main.__code__
+        def runsThisWorker(frame):
+            while frame is not None:
+                if frame.f_code is mainCode and frame.f_locals.get('self') is self:
+                    return True
+                frame = frame.f_back
+            return False
+        return runsThisWorker
+
+    # share the event loop of the main process (call before start)
+    def attach_loop(self, asyncLoop):
+        self.asyncLoop = asyncLoop
+
+    # the event loop has its own timers, a central scheduler is not used
+    def attach_scheduler(self, scheduler):
+        pass
+
+    # ---------------- thread like interface ----------------
+
+    def start(self):
+        if self.started:
+            raise RuntimeError('worker can only be started once')
+        self.started = True
+        if self.asyncLoop is None:
+            self.asyncLoop = get_default_loop()
+        self.asyncLoop.call(self.createTask)
+
+    def join(self, timeout = None):
+        if self.started:
+            self.done.wait(timeout)
+
+    def is_alive(self):
+        return self.started and not self.done.is_set()
+
+    # place request for stop the worker: cancel its task
+    def stop(self):
+        if self.logging_on:
+            self.loggi.info(f'stop request: {self.running_enabled}')
+        if self.stopRequestNs is None:
+            self.stopRequestNs = time.monotonic_ns()
+        self.running_enabled = False
+        self.publishStatus()
+        if self.started:
+            self.asyncLoop.call(self.cancelTask, 'stop')
+
+    # escalation of a missed stop deadline: run the stop task as a new task
+    # (the worker task itself blocks the event loop or ignores the cancellation)
+    def force_stop(self):
+        if self.logging_on:
+            self.loggi.warning('force stop')
+        self.running_enabled = False
+        self.forceStopped = True
+        if self.started:
+            asyncio.run_coroutine_threadsafe(self.taskForStop(), self.asyncLoop.loop)
+        self.no_more_running.set()
+        self.done.set()
+
+    # ---------------- event loop side ----------------
+
+    def createTask(self):
+        self.task = self.asyncLoop.loop.create_task(self.main(), name=self.name)
+
+    def cancelTask(self, reason):
+        # a task that has not started yet sees running_enabled at its first iteration
+        if self.running and self.endReason is None:
+            self.endReason = reason
+            self.task.cancel()
+
+    # (re-)schedule the timer end on the event loop (callable from any thread)
+    def armTimer(self):
+        if self.asyncLoop is not None:
+            self.asyncLoop.call(self.rescheduleTimer)
+
+    def rescheduleTimer(self):
+        if self.timerHandle is not None:
+            self.timerHandle.cancel()
+            self.timerHandle = None
+        if self.timeToStopNs is not None:
+            # loop.time() is the monotonic clock in seconds
+            self.timerHandle = self.asyncLoop.loop.call_at(self.timeToStopNs / NS_PER_SEC, self.cancelTask, 'timer')
+
+    def armPeriodicJob(self):
+        if self.periodicJobSec:
+            self.periodicJobHandle = self.asyncLoop.loop.call_at(self.periodicJobNextNs / NS_PER_SEC, self.periodicJobFired, None)
+
+    # loop timer: periodic job is due, it runs after the current iteration
+    def periodicJobFired(self, handle):
+        self.periodicJobDue = True
+        # next deadline is based on the previous one (no drift)
+        self.periodicJobNextNs = self.periodicJobNextNs + int(self.periodicJobSec * NS_PER_SEC)
+        self.armPeriodicJob()
+
+    # the snapshot is rebuilt when it is read (at most once per status interval),
+    # like the snapshot of a ProcessBgWorker
+    def get_status(self):
+        snapshot = self.statusSnapshot
+        statusNextNs = self.statusNextNs
+        if snapshot is None or (self.running and statusNextNs is not None and time.monotonic_ns() >= statusNextNs):
+            return self.publishStatus()
+        return snapshot
+
+    # loop timer chain to sample the history and save the checkpoints (in the loop thread),
+    # without them an idle worker is not woken up for its status
+    def armStatus(self):
+        if self.history is None and self.checkpointPath is None:
+            return
+        dueNs = self.statusNextNs
+        if dueNs is None:
+            if self.checkpointPath is None:
+                return
+            dueNs = time.monotonic_ns() + int(self.checkpointIntervalSec * NS_PER_SEC)
+        self.statusHandle = self.asyncLoop.loop.call_at(dueNs / NS_PER_SEC, self.statusFired, None)
+
+    def statusFired(self, handle):
+        self.publishStatus()
+        self.checkForCheckpoint()
+        self.armStatus()
+
+    def disarmScheduler(self):
+        for handle in (self.timerHandle, self.periodicJobHandle, self.statusHandle):
+            if handle is not None:
+                handle.cancel()
+        self.timerHandle = None
+        self.periodicJobHandle = None
+        self.statusHandle = None
+
+    # the worker itself (replaces run() and doJob() of the thread worker)
+    async def main(self):
+        self.running = True
+        self.pid = os.getpid()
+        self.thread_id = threading.current_thread().native_id
+        if self.logging_on:
+            self.loggi.info(f'Starting for: {self.timerMin} minutes, will stop at: {self.timeToStop}.')
+        self.rescheduleTimer()
+        self.armPeriodicJob()
+        try:
+            await self.addToJobRun()
+            self.publishStatus()
+            self.armStatus()
+            while not self.askForStop():
+                self.iterations += 1
+                stats = self.stats
+                if stats is None:
+                    result = await self.taskForIteration()
+                else:
+                    # includes the time the iteration waits for its I/O
+                    startNs = time.perf_counter_ns()
+                    result = await self.taskForIteration()
+                    stats.iteration.record(time.perf_counter_ns() - startNs)
+                if self.periodicJobDue:
+                    self.periodicJobDue = False
+                    self.periodicJobs += 1
+                    if stats is None:
+                        await self.taskForPeriodicJob()
+                    else:
+                        startNs = time.perf_counter_ns()
+                        await self.taskForPeriodicJob()
+                        stats.periodicJob.record(time.perf_counter_ns() - startNs)
+                # Slow-Down or pace the Loop (sleep(0) lets the other workers run)
+                await asyncio.sleep(self.paceWaitSec(result is NO_WORK))
+            self.endReason = 'stop'
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            self.endReason = 'error'
+            self.lastException = repr(exc)
+            if self.logging_on:
+                self.loggi.exception(f'Worker {self.name} failed')
+
+        self.disarmScheduler()
+        self.stopNs = time.monotonic_ns()
+        try:
+            if self.endReason == 'timer':
+                if self.logging_on:
+                    self.loggi.info(f'TimerEnd at {self.wallclock(self.stopNs)}')
+                await self.taskForTimerEnd()
+            else:
+                if self.stopRequestNs is not None:
+                    self.stopLatencyNs = self.stopNs - self.stopRequestNs
+                # stop task was already started by force_stop()
+                if not self.forceStopped:
+                    await self.taskForStop()
+            self.log_status()
+        finally:
+            self.finishCheckpoint()
+            self.running = False
+            self.publishStatus()
+            self.no_more_running.set()
+            self.done.set()
+            self.notifyExit()
+
+    # wait before the next iteration (a new pace applies after the current wait)
+    def paceWaitSec(self, idle):
+        pacer = self.pacer
+        if pacer is None:
+            return self.slowDownSec or 0
+        nowNs = time.monotonic_ns()
+        resumeNs = pacer.resume_at(nowNs, idle)
+        return 0 if resumeNs is None else (resumeNs - nowNs) / NS_PER_SEC
+
+    # ---------------- hooks (coroutines) ----------------
+
+    async def addToJobRun(self):
+        '''
+        Method is to programm in child class.
+        Things to do at the beginning of the worker.
+        '''
+        pass
+
+    async def taskForStop(self):
+        '''
+        Method is to programm in child class.
+        Things to do at the end of the worker.
+        '''
+        pass
+
+    async def taskForPeriodicJob(self):
+        '''
+        Method is to programm in child class.
+        Things to do after a defined period of the time (seconds)
+        '''
+        pass
+
+    async def taskForIteration(self):
+        '''
+        Method is to programm in child class.
+        Things to do during a single iteration of the worker (await the I/O here)
+        '''
+        pass
+
+    async def taskForTimerEnd(self):
+        '''
+        Method is to programm in child class.
+        Things to do at the end of the time-periode set for the worker.
+        '''
+        pass
@@ -0,0 +1,130 @@
+'''
+Benchmark of the async worker backend against the thread backend.
+
+Starts N I/O-bound workers (taskForIteration waits 10 ms on I/O) per backend
+and measures:
+    - start latency: start() of all workers until all are running
+    - memory: resident set size of the process before the workers are created
+      and after the start (the workers and their running state)
+    - stop latency: stop() of all workers until all are joined
+Every backend runs in its own interpreter, so the memory values do not mix.
+A backend that does not finish within --timeout seconds is reported as such
+(10,000 threads can take minutes on small machines).
+
+Usage: python bench_async.py [--workers N] [--backend async|thread|both] [--timeout SEC]
+'''
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import threading
+import time
+
+from threadingbgworker import ThreadingBgWorker
+from asyncbgworker import AsyncBgWorker, AsyncWorkerLoop
+
+
+class ThreadIoWorker(ThreadingBgWorker):
+    def __init__(self, name, event):
+        super().__init__(name=name, event=event, slowDownSec=0.5, logging_on=False)
+
+    def taskForIteration(self):
+        time.sleep(0.01)
+
+
+class AsyncIoWorker(AsyncBgWorker):
+    def __init__(self, name, event):
+        super().__init__(name=name, event=event, slowDownSec=0.5, logging_on=False)
+
+    async def taskForIteration(self):
+        await asyncio.sleep(0.01)
+
+
+# resident set size of this process in MiB
+def rss_mib():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def wait_until(condition, timeout = 120):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('workers did not reach the expected state')
+        time.sleep(0.01)
+
+
+def run_backend(backend, count):
+    rss_before = rss_mib()
+    if backend == 'async':
+        loop = AsyncWorkerLoop()
+        loop.start()
+        workers = [AsyncIoWorker(f'a{i}', threading.Event()) for i in range(count)]
+        for worker in workers:
+            worker.attach_loop(loop)
+    else:
+        workers = [ThreadIoWorker(f't{i}', threading.Event()) for i in range(count)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    wait_until(lambda: all(worker.running for worker in workers))
+    start_sec = time.perf_counter() - start
+    rss_after = rss_mib()
+
+    # let the workers iterate for a moment
+    time.sleep(1)
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join()
+    stop_sec = time.perf_counter() - start
+
+    return {
+        'backend': backend,
+        'workers': count,
+        'start-sec': round(start_sec, 4),
+        'stop-sec': round(stop_sec, 4),
+        'rss-mib-per-1000-workers': round((rss_after - rss_before) * 1000 / count, 2),
+        'iterations': sum(worker.iterations for worker in workers),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Async worker backend compared to the thread backend.')
+    parser.add_argument('--workers', type=int, default=10_000, help='Number of workers per backend.')
+    parser.add_argument('--backend', choices=['async', 'thread', 'both'], default='both')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON (one backend only).')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds per backend before it is reported as timed out.')
+    args = parser.parse_args()
+
+    if args.backend != 'both':
+        result = run_backend(args.backend, args.workers)
+        print(json.dumps(result) if args.json else result)
+        return
+
+    # every backend in its own interpreter
+    for backend in ('thread', 'async'):
+        try:
+            output = subprocess.run([sys.executable, __file__, '--backend', backend, '--workers', str(args.workers), '--json'],
+                                    capture_output=True, text=True, check=True, timeout=args.timeout).stdout
+        except subprocess.TimeoutExpired:
+            print(f'{backend:>7}: did not start and stop {args.workers} workers within {args.timeout} s')
+            continue
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{backend:>7}: start {result['start-sec']:8.3f} s, stop {result['stop-sec']:8.3f} s, "
+              f"memory {result['rss-mib-per-1000-workers']:8.2f} MiB/1000 workers, {result['iterations']} iterations")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+'''
+Benchmark suite for the engine overhead (no TTY needed).
+
+Measures with synthetic workers (instead of TestBgWorker):
+    - start latency: start() of a worker until it is running
+    - stop latency: stop() until the worker is joined, with and without slowDownSec
+    - doJob iterations per second with a no-op taskForIteration (stats off and on)
+    - iterations per second of CPU-bound, I/O-bound and sleep-bound workers running together
+    - get_status calls per second and status_all commands per second
+    - batch mode (mainProcess) startup and shutdown for 1, 100 and 1000 workers
+Every metric is the median of --repeat runs. The results are written as JSON,
+so runs can be compared:
+
+Usage: python bench_engine.py run [--output FILE] [--repeat R] [--batch-sizes 1,100,1000]
+       python bench_engine.py compare BASELINE.json CURRENT.json [--threshold PERCENT]
+
+compare flags every metric that got worse by more than the threshold
+(default 10 %) and exits with 1 if there is at least one regression.
+'''
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from functools import partial
+
+from threadingbgworker import ThreadingBgWorker
+from timerscheduler import TimerScheduler
+import cliengine
+
+
+# --------- Synthetic workers ------------
+
+class SleepBoundWorker(ThreadingBgWorker):
+    '''Worker that sleeps in every iteration (waits on something external).'''
+    def __init__(self, name, event, cli_name = None, log_directory = './logs', slowDownSec = 0.1, sleepSec = 0.001, logging_on = False):
+        super().__init__(name=name, event=event, slowDownSec=slowDownSec, cli_name=cli_name, log_directory=log_directory, logging_on=logging_on)
+        self.sleepSec = sleepSec
+
+    def taskForIteration(self):
+        time.sleep(self.sleepSec)
+
+
+class CpuBoundWorker(ThreadingBgWorker):
+    '''Worker that hashes a buffer in every iteration (holds the GIL).'''
+    def __init__(self, name, event, cli_name = None, log_directory = './logs', slowDownSec = None, rounds = 50, logging_on = False):
+        super().__init__(name=name, event=event, slowDownSec=slowDownSec, cli_name=cli_name, log_directory=log_directory, logging_on=logging_on)
+        self.rounds = rounds
+        self.buffer = b'x' * 256
+
+    def taskForIteration(self):
+        digest = self.buffer
+        for _ in range(self.rounds):
+            digest = hashlib.sha256(digest).digest()
+
+
+class IoBoundWorker(ThreadingBgWorker):
+    '''Worker that sends a message over a socket pair and reads it back in every iteration.'''
+    def __init__(self, name, event, cli_name = None, log_directory = './logs', slowDownSec = None, size = 4096, logging_on = False):
+        super().__init__(name=name, event=event, slowDownSec=slowDownSec, cli_name=cli_name, log_directory=log_directory, logging_on=logging_on)
+        self.message = b'x' * size
+        self.sockets = None
+
+    def addToJobRun(self):
+        self.sockets = socket.socketpair()
+
+    def taskForIteration(self):
+        sender, receiver = self.sockets
+        sender.sendall(self.message)
+        received = 0
+        while received < len(self.message):
+            received += len(receiver.recv(len(self.message) - received))
+
+    def taskForStop(self):
+        for sock in self.sockets or ():
+            sock.close()
+
+
+class NoopWorker(ThreadingBgWorker):
+    '''Worker without work, stops itself after `limit` iterations.'''
+    def __init__(self, limit, stats_on = False):
+        super().__init__(name='bench', event=threading.Event(), logging_on=False, stats_on=stats_on)
+        self.limit = limit
+
+    def taskForIteration(self):
+        if self.iterations >= self.limit:
+            self.running_enabled = False
+
+
+# --------- Helpers ------------
+
+# silence the prints of the engine and the workers during a measurement
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def wait_until(condition, timeout = 60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('workers did not reach the expected state')
+        time.sleep(0.0005)
+
+
+def median_of(repeat, measurement):
+    return statistics.median(measurement() for _ in range(repeat))
+
+
+def metric(value, unit, better):
+    return {'value': round(value, 6), 'unit': unit, 'better': better}
+
+
+def progress(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+# --------- Measurements ------------
+
+def start_latency_ms(scheduler, count = 20):
+    latencies = []
+    workers = []
+    with quiet():
+        for i in range(count):
+            worker = SleepBoundWorker(f'start{i}', threading.Event())
+            worker.attach_scheduler(scheduler)
+            startNs = time.perf_counter_ns()
+            worker.start()
+            wait_until(lambda: worker.running)
+            latencies.append((time.perf_counter_ns() - startNs) / 1e6)
+            workers.append(worker)
+        cliengine.shutdown_workers(workers, timeout=10)
+    return statistics.median(latencies)
+
+
+def stop_latency_ms(scheduler, slowDownSec, count = 10):
+    latencies = []
+    with quiet():
+        for i in range(count):
+            worker = SleepBoundWorker(f'stop{i}', threading.Event(), slowDownSec=slowDownSec)
+            worker.attach_scheduler(scheduler)
+            worker.start()
+            wait_until(lambda: worker.iterations > 0)
+            # stop in the middle of the slow-down wait
+            time.sleep(0.005)
+            startNs = time.perf_counter_ns()
+            worker.stop()
+            worker.join()
+            latencies.append((time.perf_counter_ns() - startNs) / 1e6)
+    return statistics.median(latencies)
+
+
+def dojob_iterations_per_sec(stats_on, iterations = 100_000):
+    # the loop runs in the calling thread, only the loop itself is timed
+    worker = NoopWorker(iterations, stats_on=stats_on)
+    worker.running = True
+    startNs = time.perf_counter_ns()
+    worker.doJob()
+    return worker.iterations * 1e9 / (time.perf_counter_ns() - startNs)
+
+
+def workload_iterations_per_sec(worker_class, scheduler, count = 4, durationSec = 1.0):
+    workers = [worker_class(f'{worker_class.__name__}{i}', threading.Event()) for i in range(count)]
+    with quiet():
+        for worker in workers:
+            worker.attach_scheduler(scheduler)
+            worker.start()
+        wait_until(lambda: all(worker.running for worker in workers))
+        startIterations = sum(worker.iterations for worker in workers)
+        startNs = time.perf_counter_ns()
+        time.sleep(durationSec)
+        iterations = sum(worker.iterations for worker in workers) - startIterations
+        elapsedNs = time.perf_counter_ns() - startNs
+        cliengine.shutdown_workers(workers, timeout=10)
+    return iterations * 1e9 / elapsedNs
+
+
+def get_status_per_sec(scheduler, durationSec = 0.5):
+    with quiet():
+        worker = SleepBoundWorker('status', threading.Event())
+        worker.attach_scheduler(scheduler)
+        worker.start()
+        wait_until(lambda: worker.running)
+        calls = 0
+        endNs = time.perf_counter_ns() + int(durationSec * 1e9)
+        startNs = time.perf_counter_ns()
+        while time.perf_counter_ns() < endNs:
+            worker.get_status()
+            calls += 1
+        elapsedNs = time.perf_counter_ns() - startNs
+        cliengine.shutdown_workers([worker], timeout=10)
+    return calls * 1e9 / elapsedNs
+
+
+def status_all_per_sec(scheduler, log_directory, count = 100, durationSec = 0.5):
+    names = tuple(f'sa{i}' for i in range(count))
+    definitions = {name: SleepBoundWorker for name in names}
+    events = {name: threading.Event() for name in names}
+    logger = cliengine.logging.getLogger('bench-engine')
+    with quiet():
+        engine = cliengine.cliEngine(shellname='bench-engine',
+                                     worker_events=events,
+                                     valid_workers=names,
+                                     worker_definitons=definitions,
+                                     logger=logger,
+                                     log_directory=log_directory,
+                                     scheduler=scheduler)
+        for name in names:
+            engine.do_start(name)
+        wait_until(lambda: all(process.running for process in engine.background_processes.values()))
+        calls = 0
+        endNs = time.perf_counter_ns() + int(durationSec * 1e9)
+        startNs = time.perf_counter_ns()
+        while time.perf_counter_ns() < endNs:
+            engine.do_status_all('')
+            calls += 1
+        elapsedNs = time.perf_counter_ns() - startNs
+        engine._stop_all_processes()
+    return calls * 1e9 / elapsedNs
+
+
+def batch_mode_sec(count, log_directory):
+    '''Startup (mainProcess until all workers run) and shutdown of the batch mode.'''
+    names = tuple(f'b{i}' for i in range(count))
+    definitions = {name: SleepBoundWorker for name in names}
+    argv = sys.argv
+    handlers = (signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM))
+    sys.argv = [argv[0], '--mode', 'batch', '--shutdown-timeout', '30']
+    try:
+        with quiet():
+            startNs = time.perf_counter_ns()
+            main = cliengine.mainProcess(shellname=f'bench-batch-{count}',
+                                         valid_workers=names,
+                                         worker_definitons=definitions,
+                                         log_directory=log_directory)
+            wait_until(lambda: all(process.running for process in main.background_processes_for_batch.values()))
+            startupSec = (time.perf_counter_ns() - startNs) / 1e9
+            startNs = time.perf_counter_ns()
+            main.stop_all_processes_in_batch()
+            shutdownSec = (time.perf_counter_ns() - startNs) / 1e9
+    finally:
+        sys.argv = argv
+        signal.signal(signal.SIGINT, handlers[0])
+        signal.signal(signal.SIGTERM, handlers[1])
+    return startupSec, shutdownSec
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(repeat, batch_sizes):
+    results = {}
+    scheduler = TimerScheduler()
+    scheduler.start()
+    with tempfile.TemporaryDirectory() as log_directory:
+        progress('start and stop latency ...')
+        results['start-latency'] = metric(median_of(repeat, partial(start_latency_ms, scheduler)), 'ms', 'lower')
+        results['stop-latency-busy'] = metric(median_of(repeat, partial(stop_latency_ms, scheduler, None)), 'ms', 'lower')
+        results['stop-latency-slowdown-1s'] = metric(median_of(repeat, partial(stop_latency_ms, scheduler, 1)), 'ms', 'lower')
+
+        progress('doJob iterations ...')
+        results['dojob-noop'] = metric(median_of(repeat, partial(dojob_iterations_per_sec, False)), 'iterations/s', 'higher')
+        results['dojob-noop-stats'] = metric(median_of(repeat, partial(dojob_iterations_per_sec, True)), 'iterations/s', 'higher')
+
+        progress('synthetic workloads ...')
+        for label, worker_class in (('cpu', CpuBoundWorker), ('io', IoBoundWorker), ('sleep', SleepBoundWorker)):
+            results[f'workload-{label}'] = metric(median_of(repeat, partial(workload_iterations_per_sec, worker_class, scheduler)), 'iterations/s', 'higher')
+
+        progress('status throughput ...')
+        results['get-status'] = metric(median_of(repeat, partial(get_status_per_sec, scheduler)), 'calls/s', 'higher')
+        results['status-all-100'] = metric(median_of(repeat, partial(status_all_per_sec, scheduler, log_directory)), 'calls/s', 'higher')
+
+        for count in batch_sizes:
+            progress(f'batch mode with {count} workers ...')
+            runs = [batch_mode_sec(count, log_directory) for _ in range(repeat)]
+            results[f'batch-startup-{count}'] = metric(statistics.median(run[0] for run in runs), 's', 'lower')
+            results[f'batch-shutdown-{count}'] = metric(statistics.median(run[1] for run in runs), 's', 'lower')
+    scheduler.stop()
+
+    return {
+        'meta': {
+            'created-at': datetime.now().replace(microsecond=0).isoformat(' '),
+            'git-revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def print_results(report):
+    for name, result in report['results'].items():
+        print(f'{name:>26}: {result["value"]:14.3f} {result["unit"]}')
+
+
+def compare(baseline, current, threshold):
+    '''Prints the change of every metric, returns the names of the regressions.'''
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f'{name:>26}: {result["value"]:14.3f} {result["unit"]} (new)')
+            continue
+        if base['value']:
+            change = (result['value'] - base['value']) / base['value'] * 100
+        else:
+            change = 0.0
+        worse = change > threshold if result['better'] == 'lower' else change < -threshold
+        flag = '  REGRESSION' if worse else ''
+        print(f'{name:>26}: {base["value"]:14.3f} -> {result["value"]:14.3f} {result["unit"]:<13} {change:+7.1f} %{flag}')
+        if worse:
+            regressions.append(name)
+    for name in baseline['results']:
+        if name not in current['results']:
+            print(f'{name:>26}: missing in the current run')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite for the engine overhead.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Run the benchmarks.')
+    run_parser.add_argument('--output', help='Write the results as JSON to this file.')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs per metric, the median is reported.')
+    run_parser.add_argument('--batch-sizes', default='1,100,1000', help='Comma separated worker counts for the batch mode.')
+    compare_parser = commands.add_parser('compare', help='Compare two result files.')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10, help='Allowed change in percent before a metric is flagged.')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        batch_sizes = [int(size) for size in args.batch_sizes.split(',') if size]
+        report = run_suite(args.repeat, batch_sizes)
+        print_results(report)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2)
+            print(f'Results written to {args.output}.')
+    else:
+        with open(args.baseline) as baseline, open(args.current) as current:
+            regressions = compare(json.load(baseline), json.load(current), args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+        print('No regressions.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''
+Benchmark of the housekeeping overhead per iteration of ThreadingBgWorker.doJob.
+
+Both workers run a no-op taskForIteration with a timer and a periodic job
+configured, so the measured time is the pure loop housekeeping:
+    - `legacy`: the former wall-clock loop (datetime.now(ZoneInfo(...)) per check)
+    - `monotonic`: the current loop based on time.monotonic_ns() deadlines
+    - `monotonic+stats`: the current loop with the hot-path instrumentation on
+
+Usage: python bench_housekeeping.py [--iterations N] [--repeat R]
+'''
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from threadingbgworker import ThreadingBgWorker
+
+
+class NoopWorker(ThreadingBgWorker):
+    '''Worker without work, stops itself after `limit` iterations.'''
+    def __init__(self, limit, stats_on = False):
+        super().__init__(name='bench', event=threading.Event(), timerMin=60, periodicJobSec=3600, logging_on=False, stats_on=stats_on)
+        self.limit = limit
+
+    def taskForIteration(self):
+        if self.iterations >= self.limit:
+            self.running_enabled = False
+
+
+class LegacyNoopWorker(NoopWorker):
+    '''Same worker with the housekeeping of the former wall-clock loop.'''
+    def __init__(self, limit):
+        super().__init__(limit)
+        self.legacyStart = datetime.now(ZoneInfo('Europe/Paris'))
+        self.legacyTimeToStop = self.legacyStart + timedelta(minutes=self.timerMin)
+        self.legacyPeriodicNext = self.legacyStart + timedelta(seconds=self.periodicJobSec)
+
+    def doJob(self):
+        # former loop (no status snapshots, no instrumentation)
+        while self.running:
+            self.iterations += 1
+            self.runtime = str((datetime.now(ZoneInfo('Europe/Paris')) - self.legacyStart))
+            if self.askForStop():
+                self.running = False
+                break
+            self.taskForIteration()
+            if self.periodicJobSec:
+                if datetime.now(ZoneInfo('Europe/Paris')) >= self.legacyPeriodicNext:
+                    self.legacyPeriodicNext = datetime.now(ZoneInfo('Europe/Paris')) + timedelta(seconds=self.periodicJobSec)
+                    self.taskForPeriodicJob()
+            if self.timerMin:
+                if datetime.now(ZoneInfo('Europe/Paris')) >= self.legacyTimeToStop:
+                    self.running = False
+                    break
+
+
+class StatsNoopWorker(NoopWorker):
+    '''Same worker with the hot-path instrumentation.'''
+    def __init__(self, limit):
+        super().__init__(limit, stats_on=True)
+
+
+def measure(worker_class, iterations):
+    # run the loop in the calling thread, only the loop itself is timed
+    worker = worker_class(iterations)
+    worker.running = True
+    start = time.perf_counter_ns()
+    worker.doJob()
+    elapsed = time.perf_counter_ns() - start
+    return elapsed / worker.iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Housekeeping overhead per doJob iteration.')
+    parser.add_argument('--iterations', type=int, default=200_000, help='Iterations per run.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per variant, the best run is reported.')
+    args = parser.parse_args()
+
+    results = {}
+    for label, worker_class in (('legacy', LegacyNoopWorker), ('monotonic', NoopWorker), ('monotonic+stats', StatsNoopWorker)):
+        results[label] = min(measure(worker_class, args.iterations) for _ in range(args.repeat))
+        print(f'{label:>15}: {results[label]:8.1f} ns/iteration')
+    print(f'{"speedup":>15}: {results["legacy"] / results["monotonic"]:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
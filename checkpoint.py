@@ -0,0 +1,223 @@
+import atexit
+import math
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+# conversion factor for the (nanosecond) timestamps
+NS_PER_SEC = 1_000_000_000
+
+# file format: header, name of the worker (utf-8), state of the child class (pickle), crc32 of all
+CHECKPOINT_MAGIC = b'BGWC'
+CHECKPOINT_VERSION = 2
+# magic, version, saved-at (ns since the epoch), started-at (ns since the epoch), iterations,
+# periodic jobs, jobs done, timer minutes (NaN: no timer), rest of the timer (ns, -1: no timer),
+# length of the name, length of the state
+_header = struct.Struct('<4sHqqqqqdqHI')
+_crc = struct.Struct('<I')
+
+
+# a checkpoint file that can not be used (truncated, corrupt, other version)
+class CheckpointError(Exception):
+    pass
+
+
+class Checkpoint():
+    '''
+    Saved state of a worker (see ThreadingBgWorker.restore_checkpoint).
+    The binary form has a fixed header of 68 bytes, the name of the worker and
+    the state of the child class (checkpointState, pickled) follow, a crc32 closes the file.
+    Parameters:
+        - `name`: name of the worker instance (checked on resume)
+        - `savedAtNs`: wall-clock time of the checkpoint (ns since the epoch)
+        - `startedAtNs`: wall-clock start of the worker (ns since the epoch)
+        - `iterations`: iteration counter
+        - `periodicJobs`: number of periodic jobs
+        - `jobsDone`: number of jobs from the job queue
+        - `timerMin`: timer in minutes (None: no timer)
+        - `timerRemainingNs`: rest of the timer at the checkpoint (None: no timer)
+        - `state`: state of the child class (None: nothing saved)
+    '''
+    def __init__(self,
+                 name,
+                 savedAtNs,
+                 startedAtNs,
+                 iterations,
+                 periodicJobs = 0,
+                 jobsDone = 0,
+                 timerMin = None,
+                 timerRemainingNs = None,
+                 state = None):
+        self.name = name
+        self.savedAtNs = savedAtNs
+        self.startedAtNs = startedAtNs
+        self.iterations = iterations
+        self.periodicJobs = periodicJobs
+        self.jobsDone = jobsDone
+        self.timerMin = timerMin
+        self.timerRemainingNs = timerRemainingNs
+        self.state = state
+
+    def to_bytes(self):
+        name = self.name.encode()
+        payload = b'' if self.state is None else pickle.dumps(self.state, protocol=pickle.HIGHEST_PROTOCOL)
+        data = _header.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, self.savedAtNs, self.startedAtNs,
+                            self.iterations, self.periodicJobs, self.jobsDone,
+                            math.nan if self.timerMin is None else self.timerMin,
+                            -1 if self.timerRemainingNs is None else self.timerRemainingNs,
+                            len(name), len(payload)) + name + payload
+        return data + _crc.pack(zlib.crc32(data))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < _header.size + _crc.size:
+            raise CheckpointError(f'truncated ({len(data)} bytes)')
+        (magic, version, savedAtNs, startedAtNs, iterations, periodicJobs, jobsDone,
+         timerMin, timerRemainingNs, nameLength, payloadLength) = _header.unpack_from(data)
+        if magic != CHECKPOINT_MAGIC:
+            raise CheckpointError('not a checkpoint file')
+        if version != CHECKPOINT_VERSION:
+            raise CheckpointError(f'unknown version {version}')
+        start = _header.size + nameLength
+        end = start + payloadLength
+        if len(data) != end + _crc.size:
+            raise CheckpointError(f'truncated ({len(data)} bytes)')
+        if _crc.unpack_from(data, end)[0] != zlib.crc32(data[:end]):
+            raise CheckpointError('checksum mismatch')
+        name = data[_header.size:start].decode(errors='replace')
+        try:
+            state = pickle.loads(data[start:end]) if payloadLength else None
+        except Exception as error:
+            raise CheckpointError(f'state can not be loaded: {error!r}') from error
+        return cls(name, savedAtNs, startedAtNs, iterations, periodicJobs, jobsDone,
+                   None if math.isnan(timerMin) else timerMin,
+                   None if timerRemainingNs < 0 else timerRemainingNs,
+                   state)
+
+    def __repr__(self):
+        return (f'Checkpoint({self.name}, {self.iterations} iterations, timer {self.timerMin} min, '
+                f'saved at {self.savedAtNs // NS_PER_SEC})')
+
+
+# checkpoint of a file, None if there is none (raises CheckpointError if it can not be used)
+def read_checkpoint(path):
+    try:
+        with open(path, 'rb') as stream:
+            data = stream.read()
+    except FileNotFoundError:
+        return None
+    except OSError as error:
+        raise CheckpointError(str(error)) from error
+    return Checkpoint.from_bytes(data)
+
+
+# replace a file atomically: a reader sees the old or the new checkpoint, never a part
+def write_atomic(path, data):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as stream:
+        stream.write(data)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(temporary, path)
+
+
+class CheckpointWriter():
+    '''
+    Writes the checkpoints of all workers in one background thread.
+    The workers only hand over the bytes of their checkpoint (put), so the file
+    I/O and the fsync never block a worker loop. Only the latest checkpoint of a
+    file is written, a checkpoint replaced before it was written is counted as coalesced.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        # path -> bytes of the checkpoint (None: remove the file)
+        self.pending = {}
+        self.thread = None
+        self.stopping = False
+        self.written = 0
+        self.removed = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    # hand over a checkpoint (data None: remove the checkpoint file), starts the thread on first use
+    def put(self, path, data):
+        with self.lock:
+            if path in self.pending:
+                self.coalesced += 1
+            self.pending[path] = data
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='checkpoint-writer', daemon=True)
+                self.thread.start()
+            self.changed.notify()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopping:
+                    self.changed.wait()
+                batch = self.pending
+                self.pending = {}
+                if not batch:
+                    return
+            for path, data in batch.items():
+                self.writeFile(path, data)
+
+    def writeFile(self, path, data):
+        try:
+            if data is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                self.removed += 1
+                return
+            write_atomic(path, data)
+            self.written += 1
+        except OSError as error:
+            self.failed += 1
+            print(f'Error: writing checkpoint {path} failed: {error}')
+
+    # write the pending checkpoints and end the thread
+    def stop(self, timeout = 5):
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return
+            self.stopping = True
+            self.changed.notify()
+        thread.join(timeout)
+        with self.lock:
+            self.stopping = False
+            self.thread = None
+
+    def get_status(self):
+        return {
+            'pending': len(self.pending),
+            'written': self.written,
+            'removed': self.removed,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+        }
+
+    # a forked child process has no writer thread, it starts its own on first use
+    def reinitAfterFork(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.pending = {}
+        self.thread = None
+        self.stopping = False
+
+
+_writer = CheckpointWriter()
+
+def get_checkpoint_writer():
+    return _writer
+
+# write the pending checkpoints (called at exit and at the end of a child process)
+def shutdown_checkpoint_writer(timeout = 5):
+    _writer.stop(timeout)
+
+atexit.register(shutdown_checkpoint_writer)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_writer.reinitAfterFork)
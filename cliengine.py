@@ -6,6 +6,12 @@ import signal
 import threading
 import argparse
 import os
+import time
+import queue
+import math
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
 
 # valid workers, must be a tuple (hashable type)
 # For one worker please type: ('worker',) <-- see the , in tuple!!!
@@ -17,9 +23,60 @@ class ValidTimerModes(str, Enum):
    set = 'set'
    clear = 'clear'
 
+# separator between the definition name and the index of a pool instance (tw1#0)
+POOL_SEPARATOR = '#'
+
+# entries per page of list and status_all
+DEFAULT_PAGE_SIZE = 100
+
+# threads that create and start the workers of a bulk start in parallel
+BULK_START_THREADS = 16
+
+# lines shown by the logs command, and its poll interval in seconds with --follow
+DEFAULT_LOG_LINES = 20
+LOG_FOLLOW_INTERVAL = 0.25
+
+# escalation for workers that miss the shutdown deadline
+class ShutdownEscalation(str, Enum):
+   none = 'none'
+   force_stop = 'force-stop'
+   terminate = 'terminate'
+
 # import background worker classes
 # Base class for background worker (ThreadingBgWorker)
 from threadingbgworker import ThreadingBgWorker
+# Central scheduler for the timers and periodic jobs of all workers
+from timerscheduler import TimerScheduler
+# Base class and shared event loop for async background workers (AsyncBgWorker)
+from asyncbgworker import AsyncBgWorker, AsyncWorkerLoop
+# Queued logging: all log files are written by one listener thread
+from queuedlogging import FileQueueHandler, shutdown_log_listener, get_log_listener
+# Control server on a Unix domain socket for the structured operations of the engine
+from controlserver import ControlServer, CommandError
+# Prometheus endpoint with the metrics of the workers
+from metricsexporter import MetricsExporter
+# Sampled status history of the workers (history command)
+from statushistory import parse_duration, resample, write_csv, write_npy
+# Worker definitions imported on demand ("module:Class" references, entry points)
+from workerregistry import WorkerRegistry, WorkerImportError
+# Sampling profiler for the threads of the workers (profile command)
+from sampleprofiler import MAX_RATE_HZ
+# Restart of ended workers (restart policies, backoff, circuit breaker)
+from supervisor import Supervisor, RestartPolicy
+# Pacing of the worker loops (pace command)
+from pacing import PaceMode
+# Running workers with indexes (pools, states, completion queue)
+from workertable import WorkerTable, WorkerState, match_names, has_wildcards
+# Non-interactive script mode (commands from a file or stdin, JSON results)
+from scriptrunner import ScriptRunner, json_output, EXIT_OK, EXIT_INVALID
+# Streaming status with differential rendering (watch command)
+from statuswatch import StatusWatch, DEFAULT_WATCH_FIELDS, key_listener
+# Log viewer on mmap (logs command)
+from logviewer import LogFile, LogFollower, parse_since
+# Checkpoints of the worker state (--checkpoint-interval, --resume)
+from checkpoint import read_checkpoint, shutdown_checkpoint_writer, CheckpointError
+# Shard processes of the coordinator (--shards)
+from shards import Shard, ShardMonitor, broadcast, shard_of, partition_cpus
 
 shellname = 'myshell'
 log_directory = './logs'
@@ -47,14 +104,125 @@ class TestBgWorker(ThreadingBgWorker):
 # For real background workers, the class must be provided
 #  in a separate definition file (e.g. myworker.py)
 #  and imported. The class must be derived from ThreadingBgWorker.
-worker_definitons = {
+# Instead of the class, a reference 'myworker:MyBgWorker' can be given,
+#  the module is then imported on the first start of the worker.
+worker_definitons = WorkerRegistry({
     'tw1': TestBgWorker,
     'tw2': TestBgWorker,
     'tw3': TestBgWorker,
-}
+})
 # --------- Valid Workers - Definitions ------------
 
 
+# create a worker from its definition and attach the shared services of the main process
+# (the instances of a pool share the first job queue registered in `job_queues`)
+def create_worker(worker_definition, name, event, cli_name, log_directory, scheduler = None, async_loop = None, job_queues = None, supervisor = None):
+    process = worker_definition(name=name,
+                                event=event,
+                                cli_name=cli_name,
+                                log_directory=log_directory)
+    if isinstance(process, AsyncBgWorker):
+        if async_loop is not None:
+            process.attach_loop(async_loop)
+    elif scheduler is not None:
+        process.attach_scheduler(scheduler)
+    if job_queues is not None and getattr(process, 'jobQueue', None) is not None:
+        process.attach_queue(job_queues.setdefault(split_instance_name(name)[0], process.jobQueue))
+    if supervisor is not None:
+        process.supervision = supervisor.record(name)
+        process.add_exit_callback(supervisor.worker_exited)
+    return process
+
+
+# name of the instance `index` of a worker pool
+def instance_name(name, index):
+    return f'{name}{POOL_SEPARATOR}{index}'
+
+
+# split an instance name into the definition name and the index (None for a single worker)
+def split_instance_name(name):
+    definition, separator, index = name.partition(POOL_SEPARATOR)
+    if separator and index.isdigit():
+        return definition, int(index)
+    return name, None
+
+
+# status keys that identify one instance and are not aggregated for a pool
+_instance_status_keys = ('worker', 'process-id', 'status-version', 'started-at', 'last-state-at', 'runtime')
+# counters rendered as strings in the status
+_string_counter_keys = ('counter',)
+# status of a queue shared by the pool (not summed)
+_shared_status_prefix = 'queue-'
+
+def aggregate_status(name, statuses):
+    '''
+    Aggregated status of the instances of a worker pool.
+        - counters and rates are summed, booleans are counted
+        - latencies and durations (keys ending with -ms, -us or -sec) are the maximum of the pool
+        - the queue values are shown once (the pool shares its job queue)
+        - other values are only shown if they are the same for all instances
+    '''
+    statuses = list(statuses)
+    message = {'pool': name, 'instances': len(statuses)}
+    keys = []
+    for status in statuses:
+        for key in status:
+            if key not in keys and key not in _instance_status_keys:
+                keys.append(key)
+    for key in keys:
+        values = [status[key] for status in statuses if status.get(key) is not None]
+        if not values:
+            message[key] = None
+        elif key.startswith(_shared_status_prefix):
+            message[key] = max(values)
+        elif all(isinstance(value, bool) for value in values):
+            message[key] = sum(values)
+        elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            message[key] = max(values) if key.endswith(('-ms', '-us', '-sec')) else round(sum(values), 3)
+        elif key in _string_counter_keys and all(str(value).isdigit() for value in values):
+            message[key] = str(sum(int(value) for value in values))
+        elif all(value == values[0] for value in values):
+            message[key] = values[0]
+    return message
+
+
+# stop workers in parallel against one global deadline
+def shutdown_workers(workers, timeout = 5, escalation = ShutdownEscalation.none.value, logger = None):
+    '''
+    Stops all workers against one global deadline.
+    The stop request is sent to every worker first, then all workers are joined
+    with the remaining time until the deadline, so N workers need at most
+    `timeout` seconds and not N * `timeout`.
+    Workers that missed the deadline are escalated:
+        - `none`: they are only reported
+        - `force-stop`: their stop tasks (taskForStop) are called from the calling thread
+        - `terminate`: process workers are terminated, the others are force-stopped
+    Returns the names of the workers that missed the deadline.
+    '''
+    workers = list(workers)
+    for process in workers:
+        process.stop()
+
+    deadline = time.monotonic() + timeout
+    missed = []
+    for process in workers:
+        process.join(timeout=max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            missed.append(process)
+
+    for process in missed:
+        message = f'Process {process.name} missed the shutdown deadline of {timeout} s (escalation: {escalation}).'
+        print(message)
+        if logger:
+            logger.warning(message)
+        if escalation == ShutdownEscalation.terminate.value and hasattr(process, 'terminate'):
+            process.terminate()
+        elif escalation in (ShutdownEscalation.force_stop.value, ShutdownEscalation.terminate.value):
+            process.force_stop()
+
+    return [process.name for process in missed]
+
+
 # Class cliEngine that manages background processes
 class cliEngine(cmd.Cmd):
     """CLI engine for managing background processes.
@@ -65,30 +233,78 @@ class cliEngine(cmd.Cmd):
     Parameters:
         - `shellname`: Name of the shell.
         - `worker_events`: Dictionary of worker events.
-        - `valid_workers`: Tuple of valid workers.
-        - `worker_definitons`: Dictionary of worker definitions.
+        - `valid_workers`: Tuple of valid workers (None: the names of the worker definitions).
+        - `worker_definitons`: Dictionary of worker definitions (or a WorkerRegistry).
         - `logger`: Logger object.
+        - `log_directory`: Directory for the log files of the workers.
+        - `scheduler`: TimerScheduler for the timers and periodic jobs of the workers.
+        - `async_loop`: AsyncWorkerLoop for the async workers.
+        - `shutdown_timeout`: Global deadline in seconds to stop the workers.
+        - `shutdown_escalation`: Escalation for workers that miss the deadline (ShutdownEscalation).
+        - `interactive`: Print the intro (False for an engine without prompt, e.g. in batch mode).
+        - `restart_specs`: Restart policies per worker name (RestartSpec or RestartPolicy value),
+                           workers without one use the `restartSpec` of their class (default: never).
+        - `checkpoint_interval`: Seconds between two checkpoints of a worker (None: no checkpoints).
+        - `state_directory`: Directory for the checkpoint files (None: the log directory).
+        - `resume`: The first start of a worker continues from its checkpoint.
+    Besides the commands (do_*), the engine provides structured operations (op_*)
+    that return plain data and raise CommandError, e.g. for the control server.
+    Commands and operations are serialized by one lock.
     """
 
+    # commands that wait for the user and take the lock only when they need it (see onecmd)
+    UNLOCKED_COMMANDS = frozenset(('watch', 'logs'))
+
     def __init__(self,
                  shellname,
                  worker_events,
                  valid_workers,
                  worker_definitons,
                  logger,
-                 log_directory):
+                 log_directory,
+                 scheduler = None,
+                 async_loop = None,
+                 shutdown_timeout = 5,
+                 shutdown_escalation = ShutdownEscalation.none.value,
+                 interactive = True,
+                 restart_specs = None,
+                 checkpoint_interval = None,
+                 state_directory = None,
+                 resume = False):
 
         super().__init__()
-        self.valid_workers = valid_workers
+        self.valid_workers = valid_workers if valid_workers is not None else tuple(worker_definitons)
+        self.valid_names = frozenset(self.valid_workers)
         self.shellname = shellname
-        self._make_intro()
-        self.background_processes = {}
+        # commands of the prompt and operations of the control server
+        self.lock = threading.RLock()
+        if interactive:
+            self._make_intro()
+        self.background_processes = WorkerTable(definition_of=lambda name: split_instance_name(name)[0])
         self.prompt = f'{self.shellname}> '
         self.events = worker_events
         self.worker_definitons = worker_definitons
         self.logger = logger
         self.logger.info(f'{self.shellname} started.')
         self.log_directory = log_directory
+        self.scheduler = scheduler
+        self.async_loop = async_loop
+        self.shutdown_timeout = shutdown_timeout
+        self.shutdown_escalation = shutdown_escalation
+        # job queues of the pools (kept after stop, a restarted pool continues with the jobs)
+        self.job_queues = {}
+        self.checkpoint_interval = checkpoint_interval
+        self.state_directory = state_directory if state_directory is not None else log_directory
+        if checkpoint_interval and not os.path.exists(self.state_directory):
+            os.makedirs(self.state_directory)
+        # only the first start of an instance resumes (not a later start or restart)
+        self.resume = resume
+        self.resumed = set()
+        # restarts ended workers (notified by the workers themselves)
+        self.supervisor = Supervisor(self.restart_instance,
+                                     specs=restart_specs,
+                                     definition_of=lambda name: split_instance_name(name)[0],
+                                     logger=self.logger)
 
 
     def _make_intro(self):
@@ -98,11 +314,23 @@ class cliEngine(cmd.Cmd):
         intro += '\n'
         intro += '  Type help or ?      to list commands.\n'
         intro += "  Type start <name>   to start a background process.\n"
+        intro += "  Type start <name> --replicas <n> to start a pool of n instances (<name>#0..n-1).\n"
+        intro += "  Type scale <name> <n> to grow or shrink a running pool.\n"
         intro += "  Type stop <name>    to stop a background process.\n"
         intro += "  Type timer <name> <mode> <value> to set a timer for the process.\n"
+        intro += "  Type pace <name> <mode> <value> to change the pacing of a process.\n"
+        intro += "  Type submit <name> <payload> to submit a job to the queue of a process.\n"
+        intro += "  Type submit_file <name> <path> to submit every line of a file as a job.\n"
         intro += "  Type list           to list all working background processes.\n"
         intro += "  Type status <name>  to get the status of a background process.\n"
         intro += "  Type status_all     to get the status of all background processes.\n"
+        intro += "  Type stats <name>   to get the latency statistics of a background process.\n"
+        intro += "  Type stats_all      to get the latency statistics of all background processes.\n"
+        intro += "  Type watch [<pattern>] to stream the status of the background processes.\n"
+        intro += "  Type logs <name>    to show the last lines of the log of a background process.\n"
+        intro += "  Type history <name> to get the sampled history of a background process.\n"
+        intro += "  Type registry       to list the worker definitions and their import times.\n"
+        intro += "  Type profile <name> <seconds> to sample the stacks of a background process.\n"
         intro += "  Type help <command> to get help for a specific command.\n"
         intro += "  Type exit or quit   to leave the shell.\n"
         intro += '\n'
@@ -118,9 +346,10 @@ class cliEngine(cmd.Cmd):
 
 
     def validate_name(self, name):
-        """Checks if the procesname is valid."""
+        """Checks if the procesname is valid (also instances of a pool: <name>#<index>)."""
         check = False
-        if name in self.valid_workers:
+        definition, index = split_instance_name(name)
+        if definition in self.valid_names:
             check = True
 
         # for worker in self.valid_workers:
@@ -137,37 +366,33 @@ class cliEngine(cmd.Cmd):
 
 
     def clear_events_and_processes(self):
-        """Clears all events and processes."""
-
-        # clear processes those events are set
-        for name, event in self.events.items():
-            # stop process if the event is set
-            if event.is_set():
-                if name in self.background_processes:
-                    process = self.background_processes[name]
-                    process.stop()
-                    del self.background_processes[name]
+        """Clears the events and processes of the finished workers."""
 
-        # remove all processes that are not alive
-        for process in self.background_processes:
-            if not self.background_processes[process].is_alive():
-                del self.background_processes[process]
-
-        for event in self.events:
-            if self.events[event].is_set():
-                self.events[event].clear()
+        # the finished workers are on the completion queue of the table,
+        # the cost is O(finished) and not O(workers)
+        # (workers with a pending restart are kept for the supervisor)
+        for name in self.background_processes.reap(keep=self.supervisor.is_pending):
+            event = self.events.get(name)
+            if event is not None:
+                event.clear()
 
 
     def check_name_for_start(self, name):
         """Checks if the procesname is valid and if the process is already running."""
         if not self.validate_name(name):
             return False
+
+        # instances of a pool are started with start --replicas or scale
+        if split_instance_name(name)[1] is not None:
+            print(f'Error: Process {name} is an instance name, please use start <name> --replicas <n> or scale.')
+            self.logger.error(f'Error: Process {name} is an instance name, please use start <name> --replicas <n> or scale.')
+            return False
         
         # clear events and processes
         self.clear_events_and_processes()
 
-        # check if name is already in use
-        if name in self.background_processes:
+        # check if name is already in use (also by the instances of a pool)
+        if self.get_instances(name):
             print(f'Error: Process {name} is already running.')
             self.logger.error(f'Error: Process {name} is already running.')
             return False
@@ -181,7 +406,7 @@ class cliEngine(cmd.Cmd):
             return False
 
         # check if name is already in use
-        if name not in self.background_processes:
+        if not self.get_instances(name):
             print(f'Error: Process {name} is not running.')
             self.logger.error(f'Error: Process {name} is not running.')
             return False
@@ -198,7 +423,7 @@ class cliEngine(cmd.Cmd):
         self.clear_events_and_processes()
 
         # check if name is already in use
-        if name not in self.background_processes:
+        if not self.get_instances(name):
             print(f'Error: Process {name} is not running.')
             self.logger.error(f'Error: Process {name} is not running.')
             return False
@@ -206,51 +431,304 @@ class cliEngine(cmd.Cmd):
         return True
 
 
-    def do_start(self, name):
-        """Starts a background process with the given name."""
+    def get_instances(self, name):
+        """Names of the running instances for a worker name (a pool or one instance)."""
+        definition, index = split_instance_name(name)
+        if index is not None:
+            return [name] if name in self.background_processes else []
+        instances = self.background_processes.instances_of(name)
+        # the single worker <name> counts as index 0 of its pool
+        return sorted(instances, key=lambda instance: split_instance_name(instance)[1] or 0)
+
+
+    def _create_instance(self, definition, instance):
+        process = self._launch_instance(definition, instance)
+        self.background_processes[instance] = process
+        return process
+
+
+    # create and start a worker (without adding it to the table, see _create_instances)
+    def _launch_instance(self, definition, instance):
+        # every instance has its own event (set when the instance ends)
+        if instance not in self.events:
+            self.events[instance] = threading.Event()
+        self.events[instance].clear()
+        process = create_worker(self.worker_definitons[definition],
+                                name=instance,
+                                event=self.events[instance],
+                                cli_name=self.shellname,
+                                log_directory=self.log_directory,
+                                scheduler=self.scheduler,
+                                async_loop=self.async_loop,
+                                job_queues=self.job_queues,
+                                supervisor=self.supervisor)
+        # after the supervisor: a finished worker is reaped after the restart decision
+        process.add_exit_callback(self.background_processes.worker_finished)
+        if self.checkpoint_interval:
+            process.attach_checkpoint(self._checkpoint_path(instance), self.checkpoint_interval)
+        if self.resume and instance not in self.resumed:
+            self.resumed.add(instance)
+            self._resume_instance(process, instance)
+        process.start()
+        return process
+
+
+    # checkpoint file of an instance in the state directory
+    # (the instance name as it is, like the log file: a replaced separator
+    # would map tw1#0 and a worker tw1-0 to the same file)
+    def _checkpoint_path(self, instance):
+        return f'{self.state_directory}/{self.shellname}-{instance}.ckpt'
+
+    # continue a worker from its checkpoint (a worker without one starts from zero)
+    def _resume_instance(self, process, instance):
+        try:
+            checkpoint = read_checkpoint(self._checkpoint_path(instance))
+        except CheckpointError as error:
+            print(f'Warning: Checkpoint of {instance} is not used: {error}')
+            self.logger.warning(f'Warning: Checkpoint of {instance} is not used: {error}')
+            return
+        if checkpoint is None:
+            return
+        if checkpoint.name != instance:
+            print(f'Warning: Checkpoint of {instance} is not used: it belongs to {checkpoint.name}')
+            self.logger.warning(f'Warning: Checkpoint of {instance} is not used: it belongs to {checkpoint.name}')
+            return
+        process.restore_checkpoint(checkpoint)
+        print(f'Resumed process {instance} at {checkpoint.iterations} iterations.')
+        self.logger.info(f'Resumed process {instance} from {checkpoint}.')
+
+
+    # bulk start of (definition, instance) pairs: the workers are created and started
+    # by a thread pool (process workers fork in parallel), the calling thread adds them
+    # to the table in start order (the lock of the engine is held, a worker that ends
+    # right away is reaped or restarted after that)
+    def _create_instances(self, pairs):
+        pairs = list(pairs)
+        if len(pairs) < 2:
+            return [self._create_instance(definition, instance) for definition, instance in pairs]
+        with ThreadPoolExecutor(max_workers=min(BULK_START_THREADS, len(pairs)), thread_name_prefix='bulk-start') as executor:
+            futures = [executor.submit(self._launch_instance, definition, instance) for definition, instance in pairs]
+        processes = []
+        error = None
+        for (definition, instance), future in zip(pairs, futures):
+            # the started workers are kept even if another one failed
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            self.background_processes[instance] = future.result()
+            processes.append(future.result())
+        if error is not None:
+            raise error
+        return processes
+
+
+    def _start_instance(self, definition, instance):
+        self._start_instances([(definition, instance)])
+
+
+    def _start_instances(self, pairs):
+        pairs = list(pairs)
+        # started by hand: a circuit breaker of the instance is closed again
+        for definition, instance in pairs:
+            self.supervisor.reset(instance)
+        for process in self._create_instances(pairs):
+            print(f'Started process: {process.name}')
+            self.logger.info(f'Started process: {process.name}')
+
+
+    # restart of an ended worker by the supervisor (runs in the timer thread of the restart)
+    def restart_instance(self, instance, process):
+        with self.lock:
+            # stopped, removed or started again by hand meanwhile
+            if self.background_processes.get(instance) is not process:
+                return False
+            self._create_instance(split_instance_name(instance)[0], instance)
+            record = self.supervisor.record(instance)
+            print(f'Restarted process: {instance} (restart {record.restarts}, crashes {record.crashes})')
+            self.logger.info(f'Restarted process: {instance} (restart {record.restarts}, crashes {record.crashes})')
+            return True
+
+
+    # import the worker class of a definition (on the first start), False with error message
+    def _load_definition(self, definition):
+        try:
+            self.worker_definitons[definition]
+        except WorkerImportError as error:
+            print(f'Error: {error}')
+            self.logger.error(f'Error: {error}')
+            return False
+        return True
+
+
+    def _parse_replicas(self, value):
+        try:
+            replicas = int(value)
+        except ValueError:
+            replicas = 0
+        if replicas < 1:
+            print(f'Error: Invalid number of replicas {value}.')
+            self.logger.error(f'Error: Invalid number of replicas {value}.')
+            return None
+        return replicas
+
+
+    def do_start(self, arg):
+        """Starts a background process (or a pool of instances) with the given name."""
+        arguments = self._splitline(arg) or ['']
+        name = arguments[0]
+        replicas = None
+        if len(arguments) == 3 and arguments[1] in ('--replicas', '-r'):
+            replicas = self._parse_replicas(arguments[2])
+            if replicas is None:
+                return
+        elif len(arguments) != 1:
+            print('Error: Invalid number of arguments.')
+            self.logger.error('Error: Invalid number of arguments.')
+            self.help_start()
+            return
+
         print(f'Starting process: {name}')
         self.logger.info(f'Starting process: {name}')
 
-        if not self.check_name_for_start(name):
+        if has_wildcards(name):
+            definitions = self._match_definitions(name)
+        elif self.check_name_for_start(name):
+            definitions = [name]
+        else:
             return
+        pairs = []
+        for definition in definitions:
+            if not self._load_definition(definition):
+                return
+            pairs.extend((definition, instance) for instance in self._start_names(definition, replicas))
+        self._start_instances(pairs)
 
-        process = self.worker_definitons[name](name=name,
-                                               event=self.events[name],
-                                               cli_name=self.shellname,
-                                               log_directory=self.log_directory)
-        process.start()
-        self.background_processes[name] = process
-        print(f'Started process: {name}')
-        self.logger.info(f'Started process: {name}')
+
+    # instance names of a start (the worker itself or a pool)
+    def _start_names(self, definition, replicas):
+        if replicas is None:
+            return [definition]
+        return [instance_name(definition, index) for index in range(replicas)]
+
+
+    # worker names matching a glob pattern that are not running (start tw*),
+    # running ones are skipped
+    def _match_definitions(self, pattern):
+        definitions = match_names(self.valid_workers, pattern)
+        if not definitions:
+            print(f'Error: No process matches {pattern}.')
+            self.logger.error(f'Error: No process matches {pattern}.')
+            return []
+        self.clear_events_and_processes()
+        for definition in [definition for definition in definitions if self.get_instances(definition)]:
+            print(f'Process {definition} is already running, skipped.')
+            self.logger.info(f'Process {definition} is already running, skipped.')
+            definitions.remove(definition)
+        return definitions
+
+
+    # running instances of a name or glob pattern (stop tw*, timer tw1#* ...), None with error message
+    def _running_instances(self, name):
+        if not has_wildcards(name):
+            if not self.check_name_for_prozess_update(name):
+                return None
+            return self.get_instances(name)
+        self.clear_events_and_processes()
+        instances = self.background_processes.select(name)
+        if not instances:
+            print(f'Error: No running process matches {name}.')
+            self.logger.error(f'Error: No running process matches {name}.')
+            return None
+        return instances
 
 
     def help_start(self):
         print('Starts a background process with the given name.')
         print('Usage: start <name>')
+        print('   or: start <name> --replicas <n>   (pool of n instances <name>#0..n-1)')
+        print('   or: start <pattern>               (glob pattern, e.g. tw*, running ones are skipped)')
         print('Valid names are:')
         for worker in self.valid_workers:
             print(f'  {worker}')
 
 
+    def do_scale(self, arg):
+        """Grows or shrinks a running pool, the other instances are not touched."""
+        arguments = self._splitline(arg)
+        if not arguments or len(arguments) != 2:
+            print('Error: Invalid number of arguments.')
+            self.logger.error('Error: Invalid number of arguments.')
+            self.help_scale()
+            return
+        name = arguments[0]
+        replicas = self._parse_replicas(arguments[1])
+        if replicas is None:
+            return
+        if split_instance_name(name)[1] is not None:
+            print(f'Error: Process {name} is an instance name, please scale the pool.')
+            self.logger.error(f'Error: Process {name} is an instance name, please scale the pool.')
+            return
+        if not self.check_name_for_prozess_update(name):
+            return
+
+        instances = self.get_instances(name)
+        print(f'Scaling process: {name} from {len(instances)} to {replicas} instances')
+        self.logger.info(f'Scaling process: {name} from {len(instances)} to {replicas} instances')
+        if replicas > len(instances):
+            # new instances take the lowest free indexes
+            used = {split_instance_name(instance)[1] or 0 for instance in instances}
+            index = 0
+            pairs = []
+            for _ in range(replicas - len(instances)):
+                while index in used:
+                    index += 1
+                used.add(index)
+                pairs.append((name, instance_name(name, index)))
+            self._start_instances(pairs)
+        elif replicas < len(instances):
+            # the instances with the highest indexes are stopped
+            self._stop_instances(instances[replicas:])
+
+
+    def help_scale(self):
+        print('Grows or shrinks a running pool of instances.')
+        print('Usage: scale <name> <n>')
+
+
+    def _stop_instances(self, instances):
+        # no restart of instances stopped by hand
+        for instance in instances:
+            self.supervisor.reset(instance)
+        missed = shutdown_workers([self.background_processes[instance] for instance in instances],
+                                  timeout=self.shutdown_timeout,
+                                  escalation=self.shutdown_escalation,
+                                  logger=self.logger)
+        for instance in instances:
+            del self.background_processes[instance]
+            if instance not in missed:
+                self.logger.info(f'Stopped process: {instance}')
+                print(f'Stopped process: {instance}')
+        return missed
+
+
     def do_stop(self, name):
-        """Stops a background process with the given name."""
+        """Stops a background process with the given name (all instances of a pool)."""
         print(f'Stopping process: {name}')
         self.logger.info(f'Stopping process: {name}')
 
-        if not self.check_name_for_stop(name):
+        # all matching instances are stopped together (one deadline)
+        instances = self._running_instances(name)
+        if instances is None:
             return
 
-        process = self.background_processes[name]
-        process.stop()
-        process.join()
-        del self.background_processes[name]
-        self.logger.info(f'Stopped process: {name}')
-        print(f'Stopped process: {name}')
+        self._stop_instances(instances)
 
 
     def help_stop(self):
         print('Stops a background process with the given name.')
-        print('Usage: stop <name>')
+        print('Usage: stop <name>       (all instances of a pool)')
+        print('   or: stop <name>#<index>')
+        print('   or: stop <pattern>    (glob pattern, e.g. tw* or tw1#*)')
 
 
     def do_timer(self, arg):
@@ -280,8 +758,9 @@ class cliEngine(cmd.Cmd):
             self.help_timer()
             return
         
-        # check if worker_name is in self.valid_workers Enum
-        if not self.check_name_for_prozess_update(worker_name):
+        # check if worker_name is in self.valid_workers Enum (or a glob pattern of running ones)
+        instances = self._running_instances(worker_name)
+        if instances is None:
             self.help_timer()
             return
 
@@ -309,9 +788,9 @@ class cliEngine(cmd.Cmd):
             self.logger.error(f'Error: Invalid timer value {timer_value_min}.')
             self.help_timer()
             return
-        # set timer
-        if worker_name in self.background_processes:
-            process = self.background_processes[worker_name]
+        # set timer (for all instances of a pool or matching the pattern)
+        for instance in instances:
+            process = self.background_processes[instance]
             if timer_mode == ValidTimerModes.add.value:
                 process.set_timer(timerMin=timer_value_min, timerMode=timer_mode)
             elif timer_mode == ValidTimerModes.set.value:
@@ -323,13 +802,14 @@ class cliEngine(cmd.Cmd):
                 self.logger.error(f'Error: Invalid timer mode.')
                 self.help_timer()
                 return
-            print(f'Set timer: {worker_name}, timer_mode {timer_mode}, {timer_value_min} minutes.')
-            self.logger.info(f'Set timer: {worker_name}, timer_mode {timer_mode}, {timer_value_min} minutes.')
+            print(f'Set timer: {instance}, timer_mode {timer_mode}, {timer_value_min} minutes.')
+            self.logger.info(f'Set timer: {instance}, timer_mode {timer_mode}, {timer_value_min} minutes.')
 
 
     def help_timer(self):
         print('Usage: timer <worker_name> <timer_mode> <timer_value_min>')
         print('   or: timer <worker_name> clear')
+        print('   (worker_name can be a glob pattern, e.g. tw*)')
 
         line = '   worker_name: ' + str([member for member in self.valid_workers])
         print(line)
@@ -338,9 +818,212 @@ class cliEngine(cmd.Cmd):
         print('   timer_value_min: <int> or <float> in minutes')
 
 
+    # arguments of set_pace for a mode and its value, raises ValueError
+    def _pace_arguments(self, mode, value, burst = 1):
+        if mode == PaceMode.fixed.value:
+            return {'slowDownSec': value}
+        if mode == PaceMode.rate.value:
+            return {'rateHz': value, 'burst': burst}
+        if mode == PaceMode.adaptive.value:
+            if value is None:
+                raise ValueError('missing idle backoff')
+            return {'idleMaxSec': value}
+        raise ValueError(f'invalid pace mode {mode}')
+
+
+    def do_pace(self, arg):
+        """Changes the pacing of a background process (fixed slow-down, target rate, adaptive idle backoff)."""
+        arguments = self._splitline(arg) or []
+        burst = 1
+        if len(arguments) == 5 and arguments[3] == '--burst':
+            if not arguments[4].isdigit():
+                print(f'Error: Invalid burst {arguments[4]}.')
+                self.logger.error(f'Error: Invalid burst {arguments[4]}.')
+                return
+            burst = int(arguments[4])
+            arguments = arguments[:3]
+        if len(arguments) != 3:
+            print('Error: Invalid number of arguments.')
+            self.logger.error('Error: Invalid number of arguments.')
+            self.help_pace()
+            return
+        name, mode, value = arguments
+        try:
+            value = float(value)
+        except ValueError:
+            print(f'Error: Invalid pace value {value}.')
+            self.logger.error(f'Error: Invalid pace value {value}.')
+            return
+        instances = self._running_instances(name)
+        if instances is None:
+            return
+        try:
+            paceArguments = self._pace_arguments(mode, value, burst)
+            for instance in instances:
+                self.background_processes[instance].set_pace(mode, **paceArguments)
+        except ValueError as error:
+            print(f'Error: {str(error).capitalize()}.')
+            self.logger.error(f'Error: {str(error).capitalize()}.')
+            self.help_pace()
+            return
+        print(f'Set pace: {name}, {mode} {value} ({len(instances)} instances).')
+        self.logger.info(f'Set pace: {name}, {mode} {value} ({len(instances)} instances).')
+
+
+    def help_pace(self):
+        print('Changes the pacing of the loop of a background process (or pool, or glob pattern).')
+        print('Usage: pace <name> fixed <seconds>               (wait after every iteration)')
+        print('   or: pace <name> rate <hz> [--burst <n>]       (target iterations per second)')
+        print('   or: pace <name> adaptive <max-seconds>        (idle backoff while taskForIteration returns NO_WORK)')
+
+
+    # job queue of a running process (or pool), None with error message
+    def _get_job_queue(self, name):
+        if not self.check_name_for_prozess_update(name):
+            return None
+        process = self.background_processes[self.get_instances(name)[0]]
+        if getattr(process, 'jobQueue', None) is None:
+            print(f'Error: Process {name} has no job queue.')
+            self.logger.error(f'Error: Process {name} has no job queue.')
+            return None
+        return process.jobQueue
+
+
+    def do_submit(self, arg):
+        """Submits a job (the rest of the line) to the queue of a background process."""
+        arguments = arg.split(None, 1) if arg else []
+        if len(arguments) != 2:
+            print('Error: Invalid number of arguments.')
+            self.logger.error('Error: Invalid number of arguments.')
+            self.help_submit()
+            return
+        name, payload = arguments
+        jobQueue = self._get_job_queue(name)
+        if jobQueue is None:
+            return
+        try:
+            jobQueue.put(payload)
+        except queue.Full:
+            print(f'Error: Job queue of {name} is full, job rejected.')
+            self.logger.error(f'Error: Job queue of {name} is full, job rejected.')
+            return
+        print(f'Submitted 1 job to {name} (queue depth {len(jobQueue)}).')
+        self.logger.info(f'Submitted 1 job to {name}.')
+
+
+    def help_submit(self):
+        print('Submits a job to the queue of a background process (or pool).')
+        print('Usage: submit <name> <payload>')
+
+
+    def do_submit_file(self, arg):
+        """Submits every non-empty line of a file as a job to the queue of a background process."""
+        arguments = self._splitline(arg)
+        if not arguments or len(arguments) != 2:
+            print('Error: Invalid number of arguments.')
+            self.logger.error('Error: Invalid number of arguments.')
+            self.help_submit_file()
+            return
+        name, path = arguments
+        jobQueue = self._get_job_queue(name)
+        if jobQueue is None:
+            return
+        submitted = 0
+        rejected = 0
+        chunk = []
+        try:
+            with open(path, encoding='utf-8') as jobs:
+                for line in jobs:
+                    line = line.rstrip('\n')
+                    if not line:
+                        continue
+                    chunk.append(line)
+                    # bulk load in chunks (one lock per chunk)
+                    if len(chunk) == 1000:
+                        accepted = jobQueue.put_many(chunk)
+                        submitted += accepted
+                        rejected += len(chunk) - accepted
+                        chunk = []
+            if chunk:
+                accepted = jobQueue.put_many(chunk)
+                submitted += accepted
+                rejected += len(chunk) - accepted
+        except OSError as error:
+            print(f'Error: Reading {path} failed: {error}')
+            self.logger.error(f'Error: Reading {path} failed: {error}')
+            return
+        print(f'Submitted {submitted} jobs to {name} (queue depth {len(jobQueue)}).')
+        self.logger.info(f'Submitted {submitted} jobs to {name}.')
+        if rejected:
+            print(f'Error: Job queue of {name} is full, {rejected} jobs rejected.')
+            self.logger.error(f'Error: Job queue of {name} is full, {rejected} jobs rejected.')
+
+
+    def help_submit_file(self):
+        print('Submits every non-empty line of a file as a job to the queue of a background process (or pool).')
+        print('Usage: submit_file <name> <path>')
+
+
+    # filter and page of list and status_all: [<pattern>] [--state <state>] [--page <n>] [--page-size <n>]
+    # (None with error message)
+    def _parse_listing(self, arg):
+        arguments = self._splitline(arg) or []
+        listing = {'pattern': None, 'state': None, 'page': 1, 'page_size': DEFAULT_PAGE_SIZE}
+        states = [member.value for member in WorkerState]
+        while arguments:
+            argument = arguments.pop(0)
+            if argument in ('--state', '--page', '--page-size'):
+                if not arguments:
+                    break
+                value = arguments.pop(0)
+                if argument == '--state':
+                    if value not in states:
+                        print(f'Error: Invalid state {value}, valid are: {", ".join(states)}.')
+                        self.logger.error(f'Error: Invalid state {value}.')
+                        return None
+                    listing['state'] = value
+                    continue
+                if not value.isdigit() or int(value) < 1:
+                    break
+                listing['page' if argument == '--page' else 'page_size'] = int(value)
+            elif listing['pattern'] is None and not argument.startswith('--'):
+                listing['pattern'] = argument
+            else:
+                break
+        else:
+            return listing
+        print('Error: Invalid arguments.')
+        self.logger.error('Error: Invalid arguments.')
+        return None
+
+    # entries of one page and the footer line (None if everything fits on one page)
+    def _page(self, entries, listing, command):
+        pages = max(1, -(-len(entries) // listing['page_size']))
+        page = min(listing['page'], pages)
+        start = (page - 1) * listing['page_size']
+        footer = None
+        if pages > 1:
+            footer = f'Page {page}/{pages} ({len(entries)} entries)'
+            if page < pages:
+                options = [command]
+                if listing['pattern'] is not None:
+                    options.append(listing['pattern'])
+                if listing['state'] is not None:
+                    options.append(f'--state {listing["state"]}')
+                if listing['page_size'] != DEFAULT_PAGE_SIZE:
+                    options.append(f'--page-size {listing["page_size"]}')
+                options.append(f'--page {page + 1}')
+                footer += f', next: {" ".join(options)}'
+        return entries[start:start + listing['page_size']], footer
+
+
     def do_list(self, arg):
-        """Lists all background processes."""
+        """Lists the background processes (filtered by a glob pattern or state, page by page)."""
         self.logger.info('Listing all background processes.')
+        listing = self._parse_listing(arg)
+        if listing is None:
+            self.help_list()
+            return
 
         # clear events and processes
         self.clear_events_and_processes()
@@ -350,45 +1033,94 @@ class cliEngine(cmd.Cmd):
             self.logger.info(' ...no background processes running.')
             return
 
-        for name, process in self.background_processes.items():
-            print(f'{name}: runtime: {process.get_runtime()}')
+        names = self.background_processes.select(listing['pattern'], listing['state'])
+        if not names:
+            print(' ...no matching background processes.')
+            return
+        names, footer = self._page(names, listing, 'list')
+        for name in names:
+            process = self.background_processes[name]
+            if self.background_processes.state_of(name) == WorkerState.restarting.value:
+                print(f'{name}: restarting')
+            else:
+                print(f'{name}: runtime: {process.get_runtime()}')
+        if footer:
+            print(footer)
 
 
     def help_list(self):
-        print('Lists all background processes.')
-        print('Usage: list')
+        print('Lists the background processes.')
+        print('Usage: list [<pattern>] [--state <state>] [--page <n>] [--page-size <n>]')
+        print('   pattern: name or glob pattern, e.g. tw1#* or tw?')
+        print('   state: ' + ', '.join(member.value for member in WorkerState))
+        print(f'   page size: default {DEFAULT_PAGE_SIZE}')
 
 
     # show status of a background process with the given name
     def do_status(self, name):
         """Shows the status of a background process with the given name."""
         self.logger.info(f'Showing status of process: {name}')
-        if name not in self.background_processes:
+        instances = self.get_instances(name)
+        if not instances:
             print('Error: Process does not exist.')
+            self.logger.error(f'Error: Process {name} does not exist.')
+            return
+
+        # pool: aggregated status of all instances
+        if instances != [name]:
+            self._print_pool_status(name)
             return
         
-        process = self.background_processes[name]
-        # stop process if it the event is set
-        if self.events[name].is_set() or not process.is_alive():
+        # clear events and processes (only the finished workers, a pending restart is kept)
+        self.clear_events_and_processes()
+        if name not in self.background_processes:
             print(f'Process {name} has stopped.')
-            process.stop()
-            del self.background_processes[name]
             return
-        
-        print(f'{name}: ')
+
+        process = self.background_processes[name]
+        # the old process has ended, the last snapshot shows the crash and the restarts
+        if self.background_processes.state_of(name) == WorkerState.restarting.value or self.supervisor.is_pending(name):
+            print(f'{name}: restarting')
+        else:
+            print(f'{name}: ')
         for key, value in process.get_status().items():
             print(f'    {key}: {value}')
 
 
     def help_status(self):
         print('Shows the status of a background process with the given name.')
-        print('Usage: status <name>')
+        print('Usage: status <name>           (aggregated status of a pool)')
+        print('   or: status <name>#<index>')
+
+
+    def _print_pool_status(self, name, instances = None):
+        if instances is None:
+            # clear events and processes
+            self.clear_events_and_processes()
+            instances = self.get_instances(name)
+        if not instances:
+            print(f'Process {name} has stopped.')
+            return
+        print(f'{name}: ')
+        statuses = [self.background_processes[instance].get_status() for instance in instances]
+        for key, value in aggregate_status(name, statuses).items():
+            print(f'    {key}: {value}')
+
+
+    # definition names with the names of their running instances
+    # (also called from the threads of the exporters, the table returns copies)
+    def get_pools(self):
+        return self.background_processes.get_pools()
 
 
     # show status of all background processes
     def do_status_all(self, arg):
-        """Shows the status of all background processes."""
+        """Shows the status of all background processes (filtered by a glob pattern or state, page by page)."""
         self.logger.info('Showing status of all background processes.')
+        listing = self._parse_listing(arg)
+        if listing is None:
+            self.help_status_all()
+            return
 
         # clear events and processes
         self.clear_events_and_processes()
@@ -407,16 +1139,467 @@ class cliEngine(cmd.Cmd):
             if not self.background_processes:
                 print('No more active processes.')
                 return
-            for name, process in self.background_processes.items():
+            pools = self._select_pools(listing['pattern'], listing['state'])
+            if not pools:
+                print('No matching processes.')
+                return
+            entries, footer = self._page(list(pools.items()), listing, 'status_all')
+            for name, instances in entries:
                 print('-' * 20)
+                if instances != [name]:
+                    self._print_pool_status(name, instances)
+                    continue
+                process = self.background_processes[name]
                 print(f'{name}: ')
                 print(f'is_alive: {process.is_alive()}')
                 for key, value in process.get_status().items():
                     print(f'    {key}: {value}')
+            if footer:
+                print(footer)
 
     def help_status_all(self):
-        print('Shows the status of all background processes.')
-        print('Usage: status_all')
+        print('Shows the status of all background processes (a pool aggregated).')
+        print('Usage: status_all [<pattern>] [--state <state>] [--page <n>] [--page-size <n>]')
+        print('   pattern: name or glob pattern of the instances, e.g. tw1#* or tw?')
+        print('   state: ' + ', '.join(member.value for member in WorkerState))
+        print(f'   page size: default {DEFAULT_PAGE_SIZE} pools')
+
+    # selected instances grouped by their pool (start order)
+    def _select_pools(self, pattern = None, state = None):
+        if pattern is None and state is None:
+            return self.get_pools()
+        pools = {}
+        for instance in self.background_processes.select(pattern, state):
+            pools.setdefault(split_instance_name(instance)[0], []).append(instance)
+        return pools
+
+    # print the instrumentation summary of a background process
+    def _print_stats(self, name, process):
+        stats = process.get_stats()
+        print(f'{name}: ')
+        if stats is None:
+            print('    statistics are disabled (stats <name> on).')
+            return
+        rates = []
+        for key in ('rate-10s', 'rate-60s'):
+            rates.append(f'{key}: ' + ('-' if stats[key] is None else f'{stats[key]:.2f}/s'))
+        print('    ' + ', '.join(rates))
+        for key, histogram in stats.items():
+            if not isinstance(histogram, dict):
+                continue
+            line = f'    {key:<13} count: {histogram["count"]:>9}'
+            for percentile in ('p50', 'p95', 'p99', 'max'):
+                line += f'  {percentile}: {histogram[percentile] / 1e6:10.3f} ms'
+            print(line)
+
+    # show the latency statistics of a background process with the given name
+    def do_stats(self, arg):
+        """Shows the latency statistics of a background process with the given name
+        (or switches its instrumentation on or off)."""
+        arguments = self._splitline(arg)
+        if not arguments or len(arguments) > 2 or (len(arguments) == 2 and arguments[1] not in ('on', 'off')):
+            self.help_stats()
+            return
+        name = arguments[0]
+        instances = self.get_instances(name)
+        if not instances:
+            print('Error: Process does not exist.')
+            self.logger.error(f'Error: Process {name} does not exist.')
+            return
+        if len(arguments) == 2:
+            for instance in instances:
+                self.background_processes[instance].set_stats(arguments[1] == 'on')
+            print(f'Statistics of {name} are {arguments[1]}.')
+            self.logger.info(f'Statistics of process {name} switched {arguments[1]}.')
+            return
+        self.logger.info(f'Showing statistics of process: {name}')
+        # every instance of a pool (percentiles can not be summed)
+        for instance in instances:
+            self._print_stats(instance, self.background_processes[instance])
+
+    def help_stats(self):
+        print('Shows the latency statistics (p50/p95/p99/max) and the iteration rates')
+        print('of a background process with the given name, or switches the')
+        print('instrumentation on or off (off by default, it costs below 1 us per iteration).')
+        print('Usage: stats <name>')
+        print('   or: stats <name> on|off')
+
+    # show the latency statistics of all background processes
+    def do_stats_all(self, arg):
+        """Shows the latency statistics of all background processes."""
+        self.logger.info('Showing statistics of all background processes.')
+
+        # clear events and processes
+        self.clear_events_and_processes()
+
+        if not self.background_processes:
+            print('No active processes.')
+        for name, process in self.background_processes.items():
+            print('-' * 20)
+            self._print_stats(name, process)
+        # the log records lost by this process (full queue, failed writes)
+        log = get_log_listener().get_status()
+        print('-' * 20)
+        print(f'log: written: {log["written"]}, queued: {log["queued"]}, dropped: {log["dropped"]}, failed: {log["failed"]}')
+
+    def help_stats_all(self):
+        print('Shows the latency statistics of all background processes')
+        print('and the log records written and lost (dropped on a full queue, failed writes).')
+        print('Usage: stats_all')
+
+    # options of watch: [<pattern>] [--interval <duration>] [--fields <f1,f2,...>] [--count <n>]
+    # (None with error message)
+    def _parse_watch(self, arg):
+        arguments = self._splitline(arg) or []
+        options = {'pattern': None, 'interval': 1.0, 'fields': list(DEFAULT_WATCH_FIELDS), 'count': None}
+        while arguments:
+            argument = arguments.pop(0)
+            if argument in ('--interval', '--fields', '--count') and arguments:
+                value = arguments.pop(0)
+                if argument == '--interval':
+                    options['interval'] = parse_duration(value)
+                    if options['interval'] is None or options['interval'] < 0.1:
+                        print(f'Error: Invalid interval {value} (at least 0.1s).')
+                        self.logger.error(f'Error: Invalid interval {value}.')
+                        return None
+                elif argument == '--fields':
+                    options['fields'] = [field for field in value.split(',') if field]
+                elif value.isdigit() and int(value) > 0:
+                    options['count'] = int(value)
+                else:
+                    break
+            elif options['pattern'] is None and not argument.startswith('--'):
+                options['pattern'] = argument
+            else:
+                break
+        else:
+            if options['fields']:
+                return options
+        print('Error: Invalid arguments.')
+        self.logger.error('Error: Invalid arguments.')
+        return None
+
+    # status snapshots of the selected instances in one pass (the snapshots are not rebuilt)
+    def _watch_collect(self, pattern):
+        with self.lock:
+            self.clear_events_and_processes()
+            return {name: self.background_processes[name].get_status()
+                    for name in self.background_processes.select(pattern)}
+
+    # stream the status (runs without the lock of the engine, see onecmd)
+    def do_watch(self, arg):
+        """Streams the status of the background processes, only the changes are drawn."""
+        options = self._parse_watch(arg)
+        if options is None:
+            self.help_watch()
+            return
+        pattern = options['pattern'] or '*'
+        terminal = sys.stdin.isatty() and sys.stdout.isatty()
+        watch = StatusWatch(lambda: self._watch_collect(options['pattern']),
+                            fields=options['fields'],
+                            output=sys.stdout,
+                            terminal=terminal,
+                            title=f'watch {pattern} every {options["interval"]:g}s (press any key to stop)')
+        self.logger.info(f'Watching {pattern} every {options["interval"]} s.')
+        try:
+            with key_listener(sys.stdin, terminal) as wait_for_key:
+                while True:
+                    watch.refresh()
+                    if options['count'] is not None and watch.refreshes >= options['count']:
+                        break
+                    if wait_for_key(options['interval']):
+                        break
+        except KeyboardInterrupt:
+            print()
+        self.logger.info(f'Watch of {pattern} ended after {watch.refreshes} refreshes.')
+
+    def help_watch(self):
+        print('Streams the status of the background processes until a key is pressed (or CTRL+C).')
+        print('Only the changed fields are drawn, iter/s is the delta of the counter per interval.')
+        print('Usage: watch [<pattern>] [--interval <duration>] [--fields <f1,f2,...>] [--count <n>]')
+        print('   pattern: name or glob pattern of the instances, e.g. tw1#* or tw?')
+        print('   interval: default 1s, at least 0.1s (90, 30s, 10m)')
+        print(f'   fields: status keys, default {",".join(DEFAULT_WATCH_FIELDS)}')
+        print('   count: stop after n refreshes (e.g. in scripts)')
+
+    # log file of a worker instance, of the shell (its name) or of a shard (shard<n>)
+    def _log_path(self, name):
+        if name == self.shellname:
+            return f'{self.log_directory}/{self.shellname}.log'
+        return f'{self.log_directory}/{self.shellname}-{name}.log'
+
+    # options of logs: <name> [-n <lines>] [--grep <regex>] [--since <time>] [--follow]
+    # (None with error message)
+    def _parse_logs(self, arg):
+        try:
+            arguments = shlex.split(arg)
+        except ValueError as error:
+            print(f'Error: Invalid arguments: {error}.')
+            self.logger.error(f'Error: Invalid arguments: {error}.')
+            return None
+        if not arguments or arguments[0].startswith('-'):
+            print('Error: Invalid arguments.')
+            self.logger.error('Error: Invalid arguments.')
+            return None
+        options = {'name': arguments.pop(0), 'lines': DEFAULT_LOG_LINES, 'grep': None, 'since': None, 'follow': False}
+        if os.sep in options['name'] or options['name'].startswith('.'):
+            print(f'Error: Invalid name {options["name"]}.')
+            self.logger.error(f'Error: Invalid name {options["name"]}.')
+            return None
+        while arguments:
+            argument = arguments.pop(0)
+            if argument == '--follow':
+                options['follow'] = True
+            elif argument in ('-n', '--grep', '--since') and arguments:
+                value = arguments.pop(0)
+                if argument == '-n':
+                    if not value.isdigit() or int(value) < 1:
+                        break
+                    options['lines'] = int(value)
+                elif argument == '--grep':
+                    try:
+                        # (^ and $ match at every line)
+                        options['grep'] = re.compile(value.encode(), re.MULTILINE)
+                    except re.error as error:
+                        print(f'Error: Invalid regular expression {value}: {error}.')
+                        self.logger.error(f'Error: Invalid regular expression {value}: {error}.')
+                        return None
+                else:
+                    options['since'] = parse_since(value)
+                    if options['since'] is None:
+                        print(f'Error: Invalid time {value}.')
+                        self.logger.error(f'Error: Invalid time {value}.')
+                        return None
+            else:
+                break
+        else:
+            return options
+        print('Error: Invalid arguments.')
+        self.logger.error('Error: Invalid arguments.')
+        return None
+
+    # show the last lines of a log file (runs without the lock of the engine, see onecmd)
+    def do_logs(self, arg):
+        """Shows the last lines of the log of a background process (filtered by a regex or a start time)."""
+        options = self._parse_logs(arg)
+        if options is None:
+            self.help_logs()
+            return
+        path = self._log_path(options['name'])
+        try:
+            with LogFile(path) as logFile:
+                lines = logFile.tail(options['lines'], options['grep'], options['since'])
+                offset = logFile.size
+        except FileNotFoundError:
+            print(f'Error: No log file for {options["name"]} ({path}).')
+            self.logger.error(f'Error: No log file for {options["name"]} ({path}).')
+            return
+        except OSError as error:
+            print(f'Error: Reading {path} failed: {error}')
+            self.logger.error(f'Error: Reading {path} failed: {error}')
+            return
+        if lines:
+            sys.stdout.write(''.join(line + '\n' for line in lines))
+        elif not options['follow']:
+            print(' ...no matching lines.')
+        if options['follow']:
+            self._follow_log(path, offset, options['grep'])
+
+    # stream the new lines of a log file until a key is pressed (or CTRL+C)
+    def _follow_log(self, path, offset, pattern):
+        follower = LogFollower(path, offset, pattern)
+        terminal = sys.stdin.isatty()
+        print(f'--- following {path} ({"press any key" if terminal else "CTRL+C"} to stop)')
+        self.logger.info(f'Following {path}.')
+        try:
+            with key_listener(sys.stdin, terminal) as wait_for_key:
+                while True:
+                    lines = follower.poll()
+                    if lines:
+                        sys.stdout.write(''.join(line + '\n' for line in lines))
+                        sys.stdout.flush()
+                    if wait_for_key(LOG_FOLLOW_INTERVAL):
+                        break
+        except KeyboardInterrupt:
+            print()
+        finally:
+            follower.close()
+
+    def help_logs(self):
+        print('Shows the last lines of the log file of a background process (or of the shell: its name).')
+        print('Usage: logs <name> [-n <lines>] [--grep <regex>] [--since <time>] [--follow]')
+        print(f'   lines: default {DEFAULT_LOG_LINES}, with --grep the last matching lines')
+        print('   time: duration back from now (90, 30s, 10m, 1h) or local time (2024-05-01T12:00, 12:00)')
+        print('   --follow: stream the new lines until a key is pressed')
+
+    # collapsed stacks of a profiling in the log directory
+    def _profile_path(self, instance):
+        timestamp = time.strftime('%Y%m%d-%H%M%S')
+        return f'{self.log_directory}/{self.shellname}-{instance}-profile-{timestamp}.collapsed'
+
+    # start the profiler of the instances, returns the files (raises RuntimeError)
+    def _start_profiles(self, instances, seconds, rate):
+        paths = {}
+        for instance in instances:
+            path = self._profile_path(instance)
+            self.background_processes[instance].start_profile(seconds, rate, path)
+            paths[instance] = path
+            self.logger.info(f'Profiling {instance} for {seconds} s at {rate} Hz into {path}.')
+        return paths
+
+    # sample the stacks of a running background process
+    def do_profile(self, arg):
+        """Samples the stacks of a background process for some seconds (flamegraph input)."""
+        arguments = self._splitline(arg) or []
+        rate = 100
+        if len(arguments) == 4 and arguments[2] == '--rate':
+            try:
+                rate = int(arguments[3])
+            except ValueError:
+                rate = 0
+            arguments = arguments[:2]
+        if len(arguments) != 2 or not 1 <= rate <= MAX_RATE_HZ:
+            print('Error: Invalid arguments.')
+            self.logger.error('Error: Invalid arguments.')
+            self.help_profile()
+            return
+        name = arguments[0]
+        try:
+            seconds = float(arguments[1])
+        except ValueError:
+            seconds = 0
+        if seconds <= 0:
+            print(f'Error: Invalid profiling time {arguments[1]}.')
+            self.logger.error(f'Error: Invalid profiling time {arguments[1]}.')
+            return
+        if not self.check_name_for_prozess_update(name):
+            return
+        try:
+            paths = self._start_profiles(self.get_instances(name), seconds, rate)
+        except RuntimeError as error:
+            print(f'Error: {error}')
+            self.logger.error(f'Error: {error}')
+            return
+        for instance, path in paths.items():
+            print(f'Profiling {instance} for {seconds} s at {rate} Hz, stacks will be written to {path}')
+
+    def help_profile(self):
+        print('Samples the stacks of a background process (every instance of a pool)')
+        print('for some seconds without stopping it. The collapsed stacks are written')
+        print('to the log directory (input of flamegraph.pl or speedscope), the top')
+        print('functions and the sampling overhead to the log of the worker.')
+        print(f'Usage: profile <name> <seconds> [--rate <samples per second, 1..{MAX_RATE_HZ}>]')
+
+    # show the worker definitions with their import state and time
+    def do_registry(self, arg):
+        """Shows the worker definitions, whether they are imported and their import time."""
+        self.logger.info('Showing the worker definitions.')
+        try:
+            report = self.op_registry()
+        except CommandError as error:
+            print(f'Error: {error}')
+            self.logger.error(f'Error: {error}')
+            return
+        for entry in report:
+            state = 'loaded' if entry['loaded'] else 'not loaded'
+            if entry['import-ms'] is not None:
+                state += f', import {entry["import-ms"]:.1f} ms'
+            if entry['entry-point']:
+                state += ', entry point'
+            if 'shard' in entry:
+                state += f', shard {entry["shard"]}'
+            print(f'{entry["name"]}: {entry["reference"]} ({state})')
+
+    def help_registry(self):
+        print('Shows the worker definitions, whether their module is imported')
+        print('and how long the import took (modules are imported on the first start).')
+        print('Usage: registry')
+
+    # options of the history command, None with error message
+    def _parse_history_options(self, arguments):
+        options = {'--since': None, '--resample': None, '--csv': None, '--npy': None}
+        if len(arguments) % 2:
+            return None
+        for option, value in zip(arguments[::2], arguments[1::2]):
+            if option not in options:
+                return None
+            if option in ('--since', '--resample'):
+                seconds = parse_duration(value)
+                if seconds is None:
+                    print(f'Error: Invalid duration {value} (e.g. 90, 30s, 10m, 1h).')
+                    self.logger.error(f'Error: Invalid duration {value}.')
+                    return False
+                value = seconds
+            options[option] = value
+        return options
+
+    # show the sampled history of a background process with the given name
+    def do_history(self, arg):
+        """Shows the history (counter, rate, latency) of a background process with the given name."""
+        arguments = self._splitline(arg) or ['']
+        options = self._parse_history_options(arguments[1:])
+        if options is None:
+            print('Error: Invalid arguments.')
+            self.logger.error('Error: Invalid arguments.')
+            self.help_history()
+            return
+        if options is False:
+            return
+        name = arguments[0]
+        self.logger.info(f'Showing history of process: {name}')
+        instances = self.get_instances(name)
+        if not instances:
+            print('Error: Process does not exist.')
+            self.logger.error(f'Error: Process {name} does not exist.')
+            return
+        if options['--npy'] and len(instances) > 1:
+            print(f'Error: NPY export needs one worker, e.g. {instances[0]}.')
+            self.logger.error(f'Error: NPY export needs one worker, e.g. {instances[0]}.')
+            return
+
+        sinceNs = None
+        if options['--since'] is not None:
+            sinceNs = time.time_ns() - int(options['--since'] * 1_000_000_000)
+        series = []
+        for instance in instances:
+            rows = self.background_processes[instance].get_history(sinceNs)
+            if rows is None:
+                print(f'{instance}: ')
+                print('    history is disabled.')
+                continue
+            if options['--resample'] is not None:
+                rows = resample(rows, options['--resample'])
+            series.append((instance, rows))
+
+        try:
+            if options['--csv']:
+                write_csv(options['--csv'], series)
+                print(f'Wrote {sum(len(rows) for _, rows in series)} samples to {options["--csv"]}.')
+            if options['--npy'] and series:
+                write_npy(options['--npy'], series[0][1])
+                print(f'Wrote {len(series[0][1])} samples to {options["--npy"]}.')
+        except OSError as error:
+            print(f'Error: Writing the history failed: {error}')
+            self.logger.error(f'Error: Writing the history failed: {error}')
+            return
+        if options['--csv'] or options['--npy']:
+            return
+
+        for instance, rows in series:
+            print(f'{instance}: ')
+            print(f'    {"time":<19} {"iterations":>12} {"rate/s":>12} {"latency-ms":>12}')
+            for timeSec, iterations, rate, latency in rows:
+                timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timeSec))
+                print(f'    {timestamp:<19} {iterations:>12} '
+                      f'{"-" if math.isnan(rate) else f"{rate:.2f}":>12} '
+                      f'{"-" if math.isnan(latency) else f"{latency:.3f}":>12}')
+
+    def help_history(self):
+        print('Shows the sampled history (counter, rate, mean iteration latency) of a background process.')
+        print('Usage: history <name> [--since <duration>] [--resample <duration>] [--csv <path>] [--npy <path>]')
+        print('   duration: 90, 30s, 10m, 1h or 1d')
+        print('   --csv and --npy export the samples instead of printing them')
+        print('   (NPY: float64 matrix with the columns time, iterations, rate, latency-ms)')
 
     # split line into arguments
     def _splitline(self, line):
@@ -430,16 +1613,21 @@ class cliEngine(cmd.Cmd):
     def _stop_all_processes(self):
         # print(self.background_processes)
         self.logger.info('Stopping all background processes.')
+        # no restarts during the shutdown
+        self.supervisor.stop()
 
         # clear events and processes
         self.clear_events_and_processes()
 
         if self.background_processes:
-            for process in self.background_processes.values():
-                process.stop()
-                # print('direkt nach stop...')
-                process.join(timeout=5)
-                self.logger.info(f'  Process {process.name} stopped.')
+            missed = shutdown_workers(self.background_processes.values(),
+                                      timeout=self.shutdown_timeout,
+                                      escalation=self.shutdown_escalation,
+                                      logger=self.logger)
+            for name in self.background_processes:
+                if name not in missed:
+                    self.logger.info(f'  Process {name} stopped.')
+            return missed
         else:
             print('no processes to stop ...')
 
@@ -466,6 +1654,460 @@ class cliEngine(cmd.Cmd):
         print("Exits the shell.")
         print("Other possible commands: quit, ^C (EOF)")
 
+    # one command at a time (the control server runs operations from other threads),
+    # watch and logs --follow run until a key is pressed, they take the lock only when needed
+    def onecmd(self, line):
+        if self.parseline(line)[0] in self.UNLOCKED_COMMANDS:
+            return super().onecmd(line)
+        with self.lock:
+            return super().onecmd(line)
+
+    # ---------------- structured operations ----------------
+
+    def _require_running(self, name):
+        if has_wildcards(name):
+            self.clear_events_and_processes()
+            instances = self.background_processes.select(name)
+            if not instances:
+                raise CommandError(f'No running process matches {name}.')
+            return instances
+        definition, index = split_instance_name(name)
+        if definition not in self.valid_names:
+            raise CommandError(f'Process {name} does not exist or is not valid.')
+        self.clear_events_and_processes()
+        instances = self.get_instances(name)
+        if not instances:
+            raise CommandError(f'Process {name} is not running.')
+        return instances
+
+    def op_start(self, name, replicas = None):
+        """Starts a worker (or a pool of `replicas` instances, or every worker matching a
+        glob pattern that is not running), returns the started and the skipped workers."""
+        with self.lock:
+            if has_wildcards(name):
+                definitions = match_names(self.valid_workers, name)
+                if not definitions:
+                    raise CommandError(f'No process matches {name}.')
+            elif name not in self.valid_names:
+                raise CommandError(f'Process {name} does not exist or is not valid.')
+            else:
+                definitions = [name]
+            if replicas is not None and (isinstance(replicas, bool) or not isinstance(replicas, int) or replicas < 1):
+                raise CommandError(f'Invalid number of replicas {replicas}.')
+            self.clear_events_and_processes()
+            skipped = [definition for definition in definitions if self.get_instances(definition)]
+            if skipped and not has_wildcards(name):
+                raise CommandError(f'Process {name} is already running.')
+            pairs = []
+            for definition in definitions:
+                if definition in skipped:
+                    continue
+                try:
+                    self.worker_definitons[definition]
+                except WorkerImportError as error:
+                    self.logger.error(f'Error: {error}')
+                    raise CommandError(str(error)) from error
+                pairs.extend((definition, instance) for instance in self._start_names(definition, replicas))
+            self.logger.info(f'Starting process: {name}')
+            self._start_instances(pairs)
+            return {'started': [instance for _, instance in pairs], 'skipped': skipped}
+
+    def op_stop(self, name):
+        """Stops a worker (all instances of a pool or matching a glob pattern), returns the stopped instances.
+        The lock is not held while the workers are joined, so a slow stop does not block the other operations."""
+        with self.lock:
+            instances = self._require_running(name)
+            self.logger.info(f'Stopping process: {name}')
+            # no restart of instances stopped by hand
+            for instance in instances:
+                self.supervisor.reset(instance)
+            workers = [self.background_processes[instance] for instance in instances]
+        missed = shutdown_workers(workers,
+                                  timeout=self.shutdown_timeout,
+                                  escalation=self.shutdown_escalation,
+                                  logger=self.logger)
+        with self.lock:
+            for instance, process in zip(instances, workers):
+                # (not reaped or started again in the meantime)
+                if self.background_processes.get(instance) is process:
+                    del self.background_processes[instance]
+                if instance not in missed:
+                    self.logger.info(f'Stopped process: {instance}')
+                    print(f'Stopped process: {instance}')
+        return {'stopped': [instance for instance in instances if instance not in missed], 'missed': missed}
+
+    def op_timer(self, name, mode, minutes = None):
+        """Sets the timer of a worker (all instances of a pool or matching a glob pattern)."""
+        with self.lock:
+            if mode not in [member.value for member in ValidTimerModes]:
+                raise CommandError(f'Invalid timer mode {mode}.')
+            if mode != ValidTimerModes.clear.value:
+                if isinstance(minutes, bool) or not isinstance(minutes, (int, float)) or minutes <= 0:
+                    raise CommandError(f'Invalid timer value {minutes}.')
+            instances = self._require_running(name)
+            for instance in instances:
+                if mode == ValidTimerModes.clear.value:
+                    self.background_processes[instance].set_timer(timerMin=None, timerMode=mode)
+                else:
+                    self.background_processes[instance].set_timer(timerMin=minutes, timerMode=mode)
+            self.logger.info(f'Set timer: {name}, timer_mode {mode}, {minutes} minutes.')
+            return {'updated': instances}
+
+    def op_pace(self, name, mode, value = None, burst = 1):
+        """Changes the pacing of a worker (all instances of a pool or matching a glob pattern)."""
+        with self.lock:
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise CommandError(f'Invalid pace value {value}.')
+            instances = self._require_running(name)
+            try:
+                paceArguments = self._pace_arguments(mode, value, burst)
+                for instance in instances:
+                    self.background_processes[instance].set_pace(mode, **paceArguments)
+            except ValueError as error:
+                raise CommandError(f'{str(error).capitalize()}.') from error
+            self.logger.info(f'Set pace: {name}, {mode} {value}.')
+            return {'updated': instances}
+
+    def op_profile(self, name, seconds, rate = 100):
+        """Starts the profiler of a worker (all instances of a pool), returns the files."""
+        with self.lock:
+            if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds <= 0:
+                raise CommandError(f'Invalid profiling time {seconds}.')
+            if isinstance(rate, bool) or not isinstance(rate, int) or not 1 <= rate <= MAX_RATE_HZ:
+                raise CommandError(f'Invalid sampling rate {rate}.')
+            instances = self._require_running(name)
+            try:
+                return {'profiling': self._start_profiles(instances, seconds, rate)}
+            except RuntimeError as error:
+                raise CommandError(str(error)) from error
+
+    def op_registry(self):
+        """Worker definitions with their import state and the import time of their module."""
+        if not isinstance(self.worker_definitons, WorkerRegistry):
+            return [{'name': name, 'reference': f'{definition.__module__}:{definition.__qualname__}',
+                     'entry-point': False, 'loaded': True, 'import-ms': None}
+                    for name, definition in self.worker_definitons.items()]
+        return self.worker_definitons.get_report()
+
+    def _check_listing(self, state):
+        if state is not None and state not in [member.value for member in WorkerState]:
+            raise CommandError(f'Invalid state {state}.')
+
+    def op_list(self, pattern = None, state = None):
+        """Running instances with their runtime (filtered by a glob pattern or state)."""
+        with self.lock:
+            self._check_listing(state)
+            self.clear_events_and_processes()
+            return {name: self.background_processes[name].get_runtime()
+                    for name in self.background_processes.select(pattern, state)}
+
+    def op_status(self, name):
+        """Status of a worker (aggregated for a pool)."""
+        with self.lock:
+            instances = self._require_running(name)
+            if instances == [name]:
+                return dict(self.background_processes[name].get_status())
+            return aggregate_status(name, [self.background_processes[instance].get_status() for instance in instances])
+
+    def op_snapshots(self, pattern = None):
+        """Status of every instance (not aggregated, filtered by a glob pattern)."""
+        return {name: dict(status) for name, status in self._watch_collect(pattern).items()}
+
+    def op_status_all(self, pattern = None, state = None):
+        """Status of all workers (aggregated per pool, filtered by a glob pattern or state)."""
+        with self.lock:
+            self._check_listing(state)
+            self.clear_events_and_processes()
+            message = {}
+            for name, instances in self._select_pools(pattern, state).items():
+                if instances == [name]:
+                    message[name] = dict(self.background_processes[name].get_status())
+                else:
+                    message[name] = aggregate_status(name, [self.background_processes[instance].get_status() for instance in instances])
+            return message
+
+
+class ShardedEngine(cliEngine):
+    """CLI engine of the coordinator with shards (--shards).
+    The workers run in shard processes (each with its own interpreter and GIL, pinned
+    to its own CPUs), every shard has a headless cliEngine with the worker definitions
+    it owns; the coordinator has no workers itself.
+        - the commands with a worker name (start, stop, timer, pace, scale, submit, status, ...)
+          are sent to the shard owning the definition, a glob pattern to every shard
+          owning a matching definition (in parallel), the shard prints the output
+        - list, status_all, stats_all and registry ask all shards in parallel and merge the results
+        - the operations (control server, script mode) are routed the same way
+    A died shard is reported by the ShardMonitor, its workers are gone until the restart
+    of the coordinator; the other shards keep running.
+    Parameters (besides those of cliEngine):
+        - `shards`: list of started Shard
+        - `owner_of`: callable(definition) -> index of the owning shard
+    """
+
+    # commands with a worker name as first argument
+    ROUTED_COMMANDS = frozenset(('start', 'stop', 'scale', 'timer', 'pace', 'submit', 'submit_file',
+                                 'status', 'stats', 'history', 'profile'))
+
+    def __init__(self, *args, shards, owner_of, **kwargs):
+        self.shards = shards
+        self.owner_of = owner_of
+        super().__init__(*args, **kwargs)
+
+    def _make_intro(self):
+        super()._make_intro()
+        print(f'  The workers run in {len(self.shards)} shard processes (type shards for their status).\n')
+
+    # shards owning a worker name or the definitions matching a glob pattern ([]: no match)
+    def _owner_shards(self, name):
+        definition = name.partition(POOL_SEPARATOR)[0]
+        if has_wildcards(definition):
+            definitions = match_names(self.valid_workers, definition)
+        else:
+            definitions = [definition] if definition in self.valid_names else []
+        return [self.shards[index] for index in sorted({self.owner_of(definition) for definition in definitions})]
+
+    def onecmd(self, line):
+        command, arg, _ = self.parseline(line)
+        if command in self.UNLOCKED_COMMANDS:
+            return super().onecmd(line)
+        with self.lock:
+            if command in self.ROUTED_COMMANDS and arg:
+                name = arg.split()[0]
+                shards = self._owner_shards(name)
+                if not shards:
+                    print(f'Error: Process {name} does not exist or is not valid.')
+                    self.logger.error(f'Error: Process {name} does not exist or is not valid.')
+                    return False
+                self._print_responses(shards, broadcast(shards, ('command', line)))
+                return False
+            if command == 'stats_all':
+                self.logger.info('Showing statistics of all background processes.')
+                self._print_responses(self.shards, broadcast(self.shards, ('command', line)))
+                return False
+            return super().onecmd(line)
+
+    # output of a command in the shards; a pattern over several shards has failed
+    # only if it failed in all of them (e.g. the shards without a running match)
+    def _print_responses(self, shards, responses):
+        succeeded = any(ok for ok, _ in responses)
+        for shard, (ok, payload) in zip(shards, responses):
+            if not ok and succeeded:
+                continue
+            # (the shard is down)
+            if isinstance(payload, str):
+                print(f'Error: {payload}')
+                self.logger.error(f'Error: {payload}')
+                continue
+            output, errors = payload
+            print(output, end='')
+            for message in errors:
+                self.logger.error(f'Shard {shard.index}: {message}')
+
+    # operation in the shards owning a worker name or pattern, returns the results
+    # (a pattern: the results of the shards where it succeeded)
+    def _route_op(self, op, name, **kwargs):
+        shards = self._owner_shards(name)
+        if not shards:
+            if has_wildcards(name):
+                raise CommandError(f'No process matches {name}.')
+            raise CommandError(f'Process {name} does not exist or is not valid.')
+        responses = broadcast(shards, ('op', op, dict(name=name, **kwargs)))
+        results = [payload for ok, payload in responses if ok]
+        if not results:
+            raise CommandError(responses[0][1])
+        return results
+
+    # operation in all shards (the shards that are down are left out)
+    def _all_op(self, op, **kwargs):
+        alive = [shard for shard in self.shards if shard.is_alive()]
+        results = []
+        for shard, (ok, payload) in zip(alive, broadcast(alive, ('op', op, kwargs))):
+            if ok:
+                results.append(payload)
+            elif shard.is_alive():
+                raise CommandError(payload)
+        return results
+
+    # lists of the results of several shards joined ({'started': [...], 'skipped': [...]})
+    @staticmethod
+    def _join_results(results):
+        joined = {}
+        for result in results:
+            for key, values in result.items():
+                joined.setdefault(key, []).extend(values)
+        return joined
+
+    def op_start(self, name, replicas = None):
+        with self.lock:
+            return self._join_results(self._route_op('start', name, replicas=replicas))
+
+    def op_stop(self, name):
+        with self.lock:
+            return self._join_results(self._route_op('stop', name))
+
+    def op_timer(self, name, mode, minutes = None):
+        with self.lock:
+            return self._join_results(self._route_op('timer', name, mode=mode, minutes=minutes))
+
+    def op_pace(self, name, mode, value = None, burst = 1):
+        with self.lock:
+            return self._join_results(self._route_op('pace', name, mode=mode, value=value, burst=burst))
+
+    def op_profile(self, name, seconds, rate = 100):
+        with self.lock:
+            return self._join_results(self._route_op('profile', name, seconds=seconds, rate=rate))
+
+    def op_status(self, name):
+        with self.lock:
+            results = self._route_op('status', name)
+            if len(results) == 1:
+                return results[0]
+            return aggregate_status(name, results)
+
+    # the snapshots of all shards, collected in parallel
+    def _watch_collect(self, pattern):
+        return self.op_snapshots(pattern)
+
+    def op_snapshots(self, pattern = None):
+        with self.lock:
+            snapshots = {}
+            for result in self._all_op('snapshots', pattern=pattern):
+                snapshots.update(result)
+            return snapshots
+
+    def op_list(self, pattern = None, state = None):
+        with self.lock:
+            self._check_listing(state)
+            runtimes = {}
+            for result in self._all_op('list', pattern=pattern, state=state):
+                runtimes.update(result)
+            return runtimes
+
+    # the import state of a definition is the one of the shard owning it
+    # (the coordinator imports no worker modules)
+    def op_registry(self):
+        with self.lock:
+            alive = [shard for shard in self.shards if shard.is_alive()]
+            reports = {}
+            for shard, (ok, payload) in zip(alive, broadcast(alive, ('op', 'registry', {}))):
+                if ok:
+                    reports[shard.index] = {entry['name']: entry for entry in payload}
+                elif shard.is_alive():
+                    raise CommandError(payload)
+            report = []
+            for entry in super().op_registry():
+                if entry['name'] in self.valid_workers:
+                    index = self.owner_of(entry['name'])
+                    entry = dict(reports.get(index, {}).get(entry['name'], entry), shard=index)
+                report.append(entry)
+            return report
+
+    def op_status_all(self, pattern = None, state = None):
+        with self.lock:
+            self._check_listing(state)
+            statuses = {}
+            for result in self._all_op('status_all', pattern=pattern, state=state):
+                statuses.update(result)
+            return statuses
+
+    def do_list(self, arg):
+        """Lists the background processes of all shards (filtered by a glob pattern or state, page by page)."""
+        self.logger.info('Listing all background processes.')
+        listing = self._parse_listing(arg)
+        if listing is None:
+            self.help_list()
+            return
+        try:
+            runtimes = self.op_list(listing['pattern'], listing['state'])
+        except CommandError as error:
+            print(f'Error: {error}')
+            self.logger.error(f'Error: {error}')
+            return
+        if not runtimes:
+            print(' ...no matching background processes.')
+            return
+        names, footer = self._page(list(runtimes), listing, 'list')
+        for name in names:
+            print(f'{name}: runtime: {runtimes[name]}')
+        if footer:
+            print(footer)
+
+    def do_status_all(self, arg):
+        """Shows the status of the background processes of all shards (a pool aggregated, page by page)."""
+        self.logger.info('Showing status of all background processes.')
+        listing = self._parse_listing(arg)
+        if listing is None:
+            self.help_status_all()
+            return
+        try:
+            statuses = self.op_status_all(listing['pattern'], listing['state'])
+        except CommandError as error:
+            print(f'Error: {error}')
+            self.logger.error(f'Error: {error}')
+            return
+        if not statuses:
+            print('No matching processes.')
+            return
+        entries, footer = self._page(list(statuses.items()), listing, 'status_all')
+        for name, status in entries:
+            print('-' * 20)
+            print(f'{name}: ')
+            for key, value in status.items():
+                print(f'    {key}: {value}')
+        if footer:
+            print(footer)
+
+    # show the shard processes
+    def do_shards(self, arg):
+        """Shows the shard processes with their CPUs and worker definitions."""
+        for shard in self.shards:
+            print('-' * 20)
+            print(f'shard {shard.index}: ')
+            for key, value in shard.get_status().items():
+                print(f'    {key}: {value}')
+
+    def help_shards(self):
+        print('Shows the shard processes (pid, alive, exit code, CPUs, worker definitions).')
+        print('Usage: shards')
+
+    # batch start: every shard starts its definitions (all shards in parallel),
+    # returns the started instances
+    def start_batch(self, replicas):
+        with self.lock:
+            responses = broadcast(self.shards, lambda shard: ('batch', {definition: replicas.get(definition, 1)
+                                                                        for definition in shard.definitions}))
+            started = []
+            for shard, (ok, payload) in zip(self.shards, responses):
+                if not ok:
+                    print(f'Error: {payload}')
+                    self.logger.error(f'Error: {payload}')
+                    continue
+                for message in payload['errors']:
+                    print(f'Error: {message}')
+                    self.logger.error(f'Error: {message}')
+                started.extend(payload['started'])
+            return started
+
+    # stop all shards (every shard stops its workers with the global deadline, in parallel),
+    # returns the workers that missed the deadline
+    def _stop_all_processes(self):
+        self.logger.info('Stopping all shards.')
+        for shard in self.shards:
+            shard.stopping = True
+        alive = [shard for shard in self.shards if shard.is_alive()]
+        missed = []
+        for shard, (ok, payload) in zip(alive, broadcast(alive, ('stop', None))):
+            if ok:
+                missed.extend(payload)
+            shard.process.join(timeout=self.shutdown_timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+                missed.append(f'shard-{shard.index}')
+                self.logger.error(f'Error: Shard {shard.index} did not end, terminated.')
+                continue
+            self.logger.info(f'  Shard {shard.index} stopped.')
+        return missed
+
 
 # --------------- after main --------------------
 # Class to use after "if __name__ == '__main__':"
@@ -478,48 +2120,176 @@ class mainProcess():
     Pass the name of the shell and the valid workers as arguments.
     Parameters:
         - `shellname`: name of the shell
-        - `valid_workers`: tuple of valid workers
-        - `worker_definitons`: dict of worker definitions
+        - `valid_workers`: tuple of valid workers (None: the names of the worker definitions)
+        - `worker_definitons`: dict of worker definitions (or a WorkerRegistry,
+                               the classes are then imported on the first start)
+        - `worker_replicas`: dict of instance counts per worker for the batch mode
+                             (default 1, a pool is started as <name>#0..n-1)
+        - `restart_policies`: dict of restart policies per worker (RestartPolicy value
+                              or RestartSpec), see Supervisor
+    With --shards N the workers run in N shard processes (see ShardedEngine),
+    a worker definition belongs to the shard of its name hash or of --shard NAME=INDEX.
     '''
 
     def __init__(self,
                  shellname,
                  valid_workers = valid_workers,
                  worker_definitons = worker_definitons,
-                 log_directory = './logs'):
+                 log_directory = './logs',
+                 worker_replicas = None,
+                 restart_policies = None):
 
         self.shellname = shellname
-        self.valid_workers = valid_workers
+        self.valid_workers = valid_workers if valid_workers is not None else tuple(worker_definitons)
         self.background_processes_for_batch = {}
         self.worker_definitons = worker_definitons
         self.worker_events = {}
         self.log_directory = log_directory
+        self.worker_replicas = dict(worker_replicas or {})
+        self.restart_policies = dict(restart_policies or {})
         
         for worker in self.valid_workers:
             self.worker_events[worker] = threading.Event()
 
         # parse command line arguments
         self.parser = argparse.ArgumentParser(description=f'CLI for the {self.shellname}.')
-        self.parser.add_argument('--mode', choices=['batch', 'cli'], default='batch', help='Run the Programm in batch mode or CLI mode.')
+        self.parser.add_argument('--mode', choices=['batch', 'cli', 'script'], default='batch',
+                                 help='Run the Programm in batch mode, CLI mode or script mode (commands from --file).')
+        self.parser.add_argument('--file', metavar='PATH', help='Script with one command per line for the script mode (default: stdin).')
+        self.parser.add_argument('--json', action='store_true', help='Script mode: write the result of every command as a JSON line.')
+        self.parser.add_argument('--shutdown-timeout', type=float, default=5, help='Global deadline in seconds to stop all background processes.')
+        self.parser.add_argument('--shutdown-escalation', choices=[member.value for member in ShutdownEscalation], default=ShutdownEscalation.none.value,
+                                 help='What to do with background processes that miss the shutdown deadline.')
+        self.parser.add_argument('--replicas', action='append', default=[], metavar='NAME=N',
+                                 help='Number of instances of a worker in batch mode (repeatable).')
+        self.parser.add_argument('--restart', action='append', default=[], metavar='NAME=POLICY',
+                                 help='Restart policy of a worker: ' + ', '.join(member.value for member in RestartPolicy) + ' (repeatable).')
+        self.parser.add_argument('--checkpoint-interval', type=float, metavar='SEC',
+                                 help='Save a checkpoint of every worker at most every SEC seconds and at its end (default: no checkpoints).')
+        self.parser.add_argument('--state-directory', metavar='PATH',
+                                 help='Directory of the checkpoint files (default: the log directory).')
+        self.parser.add_argument('--resume', action='store_true',
+                                 help='Continue the workers from their checkpoints (counters, start time, rest of the timer).')
+        self.parser.add_argument('--control-socket', metavar='PATH',
+                                 help='Serve the control operations (JSON lines) on this Unix domain socket.')
+        self.parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                                 help='Serve the worker metrics in Prometheus text format on http://<metrics-host>:PORT/metrics.')
+        self.parser.add_argument('--metrics-host', default='127.0.0.1', help='Address of the metrics endpoint.')
+        self.parser.add_argument('--shards', type=int, default=0, metavar='N',
+                                 help='Run the workers in N shard processes, each pinned to its own CPUs (default: no shards).')
+        self.parser.add_argument('--shard', action='append', default=[], metavar='NAME=INDEX',
+                                 help='Shard of a worker (repeatable, default: by the hash of the name).')
         self.args = self.parser.parse_args()
+        for replicas in self.args.replicas:
+            name, separator, count = replicas.partition('=')
+            if not separator or name not in self.valid_workers or not count.isdigit() or int(count) < 1:
+                self.parser.error(f'invalid replicas {replicas}, expected NAME=N with a valid worker name and N >= 1')
+            self.worker_replicas[name] = int(count)
+        for restart in self.args.restart:
+            name, separator, policy = restart.partition('=')
+            if not separator or name not in self.valid_workers or policy not in [member.value for member in RestartPolicy]:
+                self.parser.error(f'invalid restart policy {restart}, expected NAME=POLICY with a valid worker name and a policy of '
+                                  + ', '.join(member.value for member in RestartPolicy))
+            self.restart_policies[name] = policy
+        if self.args.mode != 'script' and (self.args.file is not None or self.args.json):
+            self.parser.error('--file and --json are only available in script mode')
+        if self.args.checkpoint_interval is not None and self.args.checkpoint_interval <= 0:
+            self.parser.error(f'invalid checkpoint interval {self.args.checkpoint_interval}')
+        if self.args.shards < 0:
+            self.parser.error(f'invalid number of shards {self.args.shards}')
+        if self.args.shard and not self.args.shards:
+            self.parser.error('--shard is only available with --shards')
+        # (the workers and their metrics are in the shard processes)
+        if self.args.shards and self.args.metrics_port is not None:
+            self.parser.error('--metrics-port is not available with --shards')
+        self.shard_assignment = {}
+        for shard in self.args.shard:
+            name, separator, index = shard.partition('=')
+            if not separator or name not in self.valid_workers or not index.isdigit() or int(index) >= self.args.shards:
+                self.parser.error(f'invalid shard {shard}, expected NAME=INDEX with a valid worker name and 0 <= INDEX < {self.args.shards}')
+            self.shard_assignment[name] = int(index)
+        # JSON lines on stdout, everything else is printed to stderr
+        self.output = json_output() if self.args.json else sys.stdout
 
         # configure logging for this module
         self.logger = logging.getLogger(self.shellname)
         self.logger.setLevel(logging.INFO)
 
-        # create a file handler for CLI-log
+        # create a (queued) file handler for CLI-log
         if not os.path.exists(self.log_directory):
             os.makedirs(self.log_directory)
-        self.handler = logging.FileHandler(f'{self.log_directory}/{self.shellname}.log')
+        self.handler = FileQueueHandler(f'{self.log_directory}/{self.shellname}.log')
         self.handler.setLevel(logging.INFO)
 
-        # create a logging format and add it to the handler
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        self.handler.setFormatter(formatter)
-
         # add the handler to the logger
         self.logger.addHandler(self.handler)
 
+        if self.args.mode not in ('batch', 'cli', 'script'):
+            self.logger.error(f'Invalid mode {self.args.mode}.')
+            print('Invalid mode.')
+            sys.exit(1)
+
+        # the shards are forked before any thread of this process is started
+        # (a lock held by a thread at the moment of the fork stays locked in the shard)
+        self.shards = []
+        self.shard_monitor = None
+        if self.args.shards:
+            self.start_shards()
+
+        # one scheduler thread for the timers and periodic jobs of all workers
+        self.scheduler = TimerScheduler(logger=self.logger)
+        self.scheduler.start()
+        # one event loop for all async workers
+        self.async_loop = AsyncWorkerLoop()
+        self.async_loop.start()
+
+        # the engine manages the workers in both modes (the prompt only in CLI mode),
+        # so the control server has the same operations in both modes
+        engine_arguments = dict(shellname=self.shellname,
+                                worker_events=self.worker_events,
+                                valid_workers=self.valid_workers,
+                                worker_definitons=self.worker_definitons,
+                                logger=self.logger,
+                                log_directory=self.log_directory,
+                                scheduler=self.scheduler,
+                                async_loop=self.async_loop,
+                                shutdown_timeout=self.args.shutdown_timeout,
+                                shutdown_escalation=self.args.shutdown_escalation,
+                                interactive=self.args.mode == 'cli',
+                                restart_specs=self.restart_policies,
+                                checkpoint_interval=self.args.checkpoint_interval,
+                                state_directory=self.args.state_directory,
+                                resume=self.args.resume)
+        if self.args.shards:
+            self.cli = ShardedEngine(shards=self.shards, owner_of=self.owner_of, **engine_arguments)
+        else:
+            self.cli = cliEngine(**engine_arguments)
+        self.background_processes_for_batch = self.cli.background_processes
+        self.job_queues = self.cli.job_queues
+
+        self.control_server = None
+        if self.args.control_socket:
+            self.control_server = ControlServer(self.cli, self.args.control_socket, self.async_loop, self.logger)
+            try:
+                self.control_server.start()
+            except (OSError, FileExistsError) as error:
+                print(f'Error: Control server can not listen on {self.args.control_socket}: {error}')
+                self.logger.error(f'Error: Control server can not listen on {self.args.control_socket}: {error}')
+                sys.exit(1)
+            print(f'Control server listening on {self.args.control_socket}.')
+
+        self.metrics_exporter = None
+        if self.args.metrics_port is not None:
+            self.metrics_exporter = MetricsExporter(self.cli, self.args.metrics_port, self.async_loop,
+                                                    host=self.args.metrics_host, logger=self.logger)
+            try:
+                self.metrics_exporter.start()
+            except OSError as error:
+                print(f'Error: Metrics exporter can not listen on {self.args.metrics_host}:{self.args.metrics_port}: {error}')
+                self.logger.error(f'Error: Metrics exporter can not listen on {self.args.metrics_host}:{self.args.metrics_port}: {error}')
+                sys.exit(1)
+            print(f'Metrics exporter listening on http://{self.args.metrics_host}:{self.metrics_exporter.port}/metrics.')
+
         if self.args.mode == 'batch':
             self.logger.info(f'----- Starting {self.shellname} in BATCH mode. -----')
             # Start all valid workers in batch mode
@@ -532,46 +2302,184 @@ class mainProcess():
         elif self.args.mode == 'cli':
             self.logger.info(f'----- Starting {self.shellname} in CLI mode. -------')
             # Start CLI
-            self.cli = cliEngine(shellname=self.shellname,
-                                 worker_events=self.worker_events,
-                                 valid_workers=self.valid_workers,
-                                 worker_definitons=self.worker_definitons,
-                                 logger=self.logger)
             self.cli.cmdloop()
+            self.stop_services()
+
+        elif self.args.mode == 'script':
+            self.logger.info(f'----- Starting {self.shellname} in SCRIPT mode. ----')
+            self.run_script()
+
+
+    # shard of a worker definition
+    def owner_of(self, definition):
+        return shard_of(definition, self.args.shards, self.shard_assignment)
 
+    # fork the shard processes (before any thread is started) and watch them
+    def start_shards(self):
+        # (the first log record starts the log listener thread, it is logged after the forks)
+        threads = [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]
+        self.shard_definitions = [[] for _ in range(self.args.shards)]
+        for worker in self.valid_workers:
+            self.shard_definitions[self.owner_of(worker)].append(worker)
+        messages = []
+        for index, cpus in enumerate(partition_cpus(self.args.shards)):
+            shard = Shard(index, tuple(self.shard_definitions[index]), cpus, self.make_shard_engine)
+            shard.start()
+            self.shards.append(shard)
+            messages.append(f'Started shard {index} (pid {shard.process.pid}, cpus {sorted(cpus) if cpus else "all"}): {", ".join(shard.definitions) or "-"}')
+            print(messages[-1])
+        if threads:
+            self.logger.warning(f'The shards were forked with running threads ({", ".join(threads)}), '
+                                'a lock held by one of them stays locked in the shards.')
+        for message in messages:
+            self.logger.info(message)
+        self.shard_monitor = ShardMonitor(self.shards, self.logger)
+        self.shard_monitor.start()
+
+    # headless engine of a shard with its own scheduler, event loop and log file
+    # (runs in the forked shard process)
+    def make_shard_engine(self, index):
+        logger = logging.getLogger(f'{self.shellname}-shard{index}')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(FileQueueHandler(f'{self.log_directory}/{self.shellname}-shard{index}.log'))
+        scheduler = TimerScheduler(logger=logger)
+        scheduler.start()
+        async_loop = AsyncWorkerLoop()
+        async_loop.start()
+        engine = cliEngine(shellname=self.shellname,
+                           worker_events={},
+                           valid_workers=tuple(self.shard_definitions[index]),
+                           worker_definitons=self.worker_definitons,
+                           logger=logger,
+                           log_directory=self.log_directory,
+                           scheduler=scheduler,
+                           async_loop=async_loop,
+                           shutdown_timeout=self.args.shutdown_timeout,
+                           shutdown_escalation=self.args.shutdown_escalation,
+                           interactive=False,
+                           restart_specs=self.restart_policies,
+                           checkpoint_interval=self.args.checkpoint_interval,
+                           state_directory=self.args.state_directory,
+                           resume=self.args.resume)
+
+        def cleanup():
+            scheduler.stop()
+            async_loop.stop()
+            shutdown_checkpoint_writer()
+            shutdown_log_listener()
+
+        return engine, cleanup
+
+
+    # stop the servers, the scheduler, the event loop, the checkpoint writer and the log listener
+    def stop_services(self):
+        if self.control_server is not None:
+            self.control_server.stop()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        self.scheduler.stop()
+        self.async_loop.stop()
+        shutdown_checkpoint_writer()
+        shutdown_log_listener()
+
+
+    def run_script(self):
+        # run the commands of the script, exit with its exit code;
+        # workers that are still running after the script keep running as in batch mode
+        runner = ScriptRunner(self.cli, output=self.output, jsonOutput=self.args.json, logger=self.logger)
+        try:
+            script = sys.stdin if self.args.file in (None, '-') else open(self.args.file, encoding='utf-8')
+        except OSError as error:
+            print(f'Error: Reading {self.args.file} failed: {error}')
+            self.logger.error(f'Error: Reading {self.args.file} failed: {error}')
+            exitCode = EXIT_INVALID
         else:
-            self.logger.error(f'Invalid mode {self.args.mode}.')
-            print('Invalid mode.')
-            sys.exit(1)
+            with script:
+                exitCode = runner.run(script)
+        self.logger.info(f'Script ended with exit code {exitCode} ({runner.commands} commands).')
+        if exitCode == EXIT_OK and not runner.exited:
+            if self.cli.op_list():
+                print('you can clean stop the script mode with CTRL+C')
+                signal.signal(signal.SIGINT, self.handle_signal)
+                signal.signal(signal.SIGTERM, self.handle_signal)
+                return
+        # a failed script stops the workers it has started
+        if not runner.exited and (self.shards or self.background_processes_for_batch):
+            self.cli._stop_all_processes()
+        self.stop_services()
+        sys.exit(exitCode)
+
 
-        
     def handle_signal(self, signal, frame):
         # Signal handling: React to the received signal
         print("Signal received. Stop all background processes and exit...")
         self.logger.info("Signal received. Stop all background processes and exit...")
-        self.stop_all_processes_in_batch()
+        missed = self.stop_all_processes_in_batch()
+        if missed:
+            # do not wait for the remaining threads beyond the deadline
+            # (the grace period of the container ends soon)
+            shutdown_checkpoint_writer()
+            shutdown_log_listener()
+            os._exit(1)
 
 
     def start_all_processes_for_batch(self):
         # start all background processes
         self.logger.info('Starting all background processes.')
-        for worker in self.valid_workers:
-            name = worker
-            print(f'Starting process {name}...')
-            process = self.worker_definitons[name](name=name,
-                                                   event=self.worker_events[name],
-                                                   cli_name=self.shellname,
-                                                   log_directory=self.log_directory)
-            process.start()
-            self.background_processes_for_batch[name] = process
-            print(f'Started process {name}.')
-            self.logger.info(f'Started process {name}.')
+        if self.shards:
+            # (the shards print the started processes)
+            for name in self.cli.start_batch(self.worker_replicas):
+                self.logger.info(f'Started process {name}.')
+            return
+        # (the control server may already take requests)
+        with self.cli.lock:
+            for worker in self.valid_workers:
+                try:
+                    self.worker_definitons[worker]
+                except WorkerImportError as error:
+                    print(f'Error: {error}')
+                    self.logger.error(f'Error: {error}')
+                    continue
+                replicas = self.worker_replicas.get(worker, 1)
+                if replicas == 1:
+                    instances = [worker]
+                else:
+                    instances = [instance_name(worker, index) for index in range(replicas)]
+                for name in instances:
+                    print(f'Starting process {name}...')
+                # (the instances of a pool are started in parallel)
+                for process in self.cli._create_instances((worker, name) for name in instances):
+                    print(f'Started process {process.name}.')
+                    self.logger.info(f'Started process {process.name}.')
 
     def stop_all_processes_in_batch(self):
         # stop all background processes
         self.logger.info('Stopping all background processes.')
-        for name, process in self.background_processes_for_batch.items():
-            process.stop()
-            process.join(timeout=5)
-            print(f'Stopped process {name}.')
-            self.logger.info(f'Stopped process {name}.')
+        if self.control_server is not None:
+            self.control_server.stop()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        # no restarts during the shutdown
+        self.cli.supervisor.stop()
+        # (waits for a running control operation)
+        with self.cli.lock:
+            if self.shards:
+                missed = self.cli._stop_all_processes()
+                for shard in self.shards:
+                    # (not a died shard)
+                    if shard.process.exitcode == 0:
+                        print(f'Stopped shard {shard.index}.')
+                self.scheduler.stop()
+                self.async_loop.stop()
+                return missed
+            missed = shutdown_workers(self.background_processes_for_batch.values(),
+                                      timeout=self.args.shutdown_timeout,
+                                      escalation=self.args.shutdown_escalation,
+                                      logger=self.logger)
+            for name in self.background_processes_for_batch:
+                if name not in missed:
+                    print(f'Stopped process {name}.')
+                    self.logger.info(f'Stopped process {name}.')
+        self.scheduler.stop()
+        self.async_loop.stop()
+        return missed
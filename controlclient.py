@@ -0,0 +1,120 @@
+'''
+Thin client for the control server (Unix domain socket, JSON lines).
+
+Usage: python controlclient.py --socket PATH start <name> [--replicas N]
+       python controlclient.py --socket PATH stop <name>
+       python controlclient.py --socket PATH timer <name> <mode> [<minutes>]
+       python controlclient.py --socket PATH list | status_all | ping
+       python controlclient.py --socket PATH status <name>
+       python controlclient.py --socket PATH profile <name> <seconds> [--rate HZ]
+       python controlclient.py --socket PATH raw < requests.jsonl
+
+`raw` sends the JSON request lines of stdin pipelined over one connection
+and prints the response lines. The exit code is 1 if a request failed.
+'''
+import argparse
+import json
+import socket
+import sys
+
+
+class ControlClient():
+    '''
+    Connection to a control server.
+    Parameters:
+        - `path`: path of the socket file
+        - `timeout`: socket timeout in seconds
+    '''
+    def __init__(self, path, timeout = 30):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.reader = self.sock.makefile('rb')
+        self.nextId = 0
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # send the requests without waiting for each response and read the
+    # responses (in the same order), in chunks so the socket buffers never fill up
+    def pipeline(self, requests, chunkSize = 100):
+        responses = []
+        requests = list(requests)
+        for start in range(0, len(requests), chunkSize):
+            lines = []
+            for request in requests[start:start + chunkSize]:
+                if 'id' not in request:
+                    self.nextId += 1
+                    request = dict(request, id=self.nextId)
+                lines.append(json.dumps(request) + '\n')
+            self.sock.sendall(''.join(lines).encode())
+            for _ in lines:
+                line = self.reader.readline()
+                if not line:
+                    raise ConnectionError('control server closed the connection')
+                responses.append(json.loads(line))
+        return responses
+
+    def request(self, op, **args):
+        return self.pipeline([{'op': op, 'args': args}])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client for the control server of a shell.')
+    parser.add_argument('--socket', required=True, help='Path of the control socket.')
+    parser.add_argument('--timeout', type=float, default=30, help='Socket timeout in seconds.')
+    commands = parser.add_subparsers(dest='op', required=True)
+    start = commands.add_parser('start')
+    start.add_argument('name')
+    start.add_argument('--replicas', type=int)
+    commands.add_parser('stop').add_argument('name')
+    timer = commands.add_parser('timer')
+    timer.add_argument('name')
+    timer.add_argument('mode')
+    timer.add_argument('minutes', type=float, nargs='?')
+    pace = commands.add_parser('pace')
+    pace.add_argument('name')
+    pace.add_argument('mode')
+    pace.add_argument('value', type=float, nargs='?')
+    pace.add_argument('--burst', type=int)
+    commands.add_parser('status').add_argument('name')
+    profile = commands.add_parser('profile')
+    profile.add_argument('name')
+    profile.add_argument('seconds', type=float)
+    profile.add_argument('--rate', type=int)
+    for op in ('list', 'status_all'):
+        listing = commands.add_parser(op)
+        listing.add_argument('pattern', nargs='?')
+        listing.add_argument('--state')
+    for op in ('ping', 'raw'):
+        commands.add_parser(op)
+    args = parser.parse_args()
+
+    with ControlClient(args.socket, args.timeout) as client:
+        if args.op == 'raw':
+            requests = [json.loads(line) for line in sys.stdin if line.strip()]
+            responses = client.pipeline(requests)
+            for response in responses:
+                print(json.dumps(response))
+        else:
+            opArgs = {key: value for key, value in vars(args).items()
+                      if key not in ('socket', 'timeout', 'op') and value is not None}
+            responses = [client.request(args.op, **opArgs)]
+            response = responses[0]
+            if response['ok']:
+                print(json.dumps(response['result'], indent=2))
+            else:
+                print(f'Error: {response["error"]}', file=sys.stderr)
+    if not all(response['ok'] for response in responses):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import queue
+import socket
+import stat
+import tempfile
+import threading
+
+# longest request line (bytes)
+MAX_LINE = 1024 * 1024
+# threads running the operations (a slow stop does not hold up the other clients)
+OPERATION_THREADS = 4
+
+
+# error of a structured operation (the message is the error shown to the user)
+class CommandError(Exception):
+    pass
+
+
+class ControlServer():
+    '''
+    Local control server on a Unix domain socket (JSON lines).
+    Every request is one line with a JSON object, the response is one line too:
+        request:  {"id": 1, "op": "status", "args": {"name": "tw1"}}
+        response: {"id": 1, "ok": true, "result": {...}}
+                  {"id": 1, "ok": false, "error": "Process tw1 is not running."}
+    The operations are the structured operations of the cliEngine (op_*):
+    start, stop, timer, pace, list, status, status_all, snapshots, profile, and ping.
+    The server runs on an asyncio event loop (the AsyncWorkerLoop of the main process),
+    so many clients and pipelined requests need no thread each. The operations
+    run in a pool of OPERATION_THREADS operation threads, so a stop that waits for
+    workers blocks neither the loop nor the other clients (the operations that change
+    workers still take the lock of the engine one after the other). The threads are
+    started with the server: in batch mode the main thread has ended and no new
+    executor threads can be created. The requests of one connection run one after
+    the other (a pipelined status sees the preceding start), so its responses keep
+    the order of the requests.
+    The socket is bound in a private directory (mode 0700) and linked to `path`
+    when it has mode 0600, so no other user can connect in between.
+    Parameters:
+        - `engine`: cliEngine with the workers
+        - `path`: path of the socket file (created with mode 0600)
+        - `asyncLoop`: AsyncWorkerLoop that runs the server
+        - `logger`: Logger object
+    '''
+    def __init__(self, engine, path, asyncLoop, logger = None):
+        self.engine = engine
+        self.path = path
+        self.asyncLoop = asyncLoop
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.server = None
+        self.operationQueue = queue.Queue()
+        self.operationThreads = []
+        self.connections = 0
+        self.requests = 0
+        self.operations = {
+            'start': engine.op_start,
+            'stop': engine.op_stop,
+            'timer': engine.op_timer,
+            'pace': engine.op_pace,
+            'list': engine.op_list,
+            'status': engine.op_status,
+            'status_all': engine.op_status_all,
+            'snapshots': engine.op_snapshots,
+            'profile': engine.op_profile,
+            'ping': self.ping,
+        }
+
+    # start listening (callable from any thread, returns when the socket exists)
+    def start(self, timeout = 5):
+        self.removeStaleSocket()
+        future = asyncio.run_coroutine_threadsafe(self.serve(), self.asyncLoop.loop)
+        future.result(timeout)
+        # (requests that came in meanwhile wait on the queue)
+        self.operationThreads = [threading.Thread(target=self.runOperations, name=f'control-operations-{index}', daemon=True)
+                                 for index in range(OPERATION_THREADS)]
+        for thread in self.operationThreads:
+            thread.start()
+        self.logger.info(f'Control server listening on {self.path}.')
+
+    def stop(self, timeout = 5):
+        if self.server is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.close(), self.asyncLoop.loop)
+        try:
+            future.result(timeout)
+        except Exception as error:
+            self.logger.warning(f'Control server did not close cleanly: {error!r}')
+        for _ in self.operationThreads:
+            self.operationQueue.put(None)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.logger.info('Control server stopped.')
+
+    # a socket file without a listening server is left over from a crashed process
+    def removeStaleSocket(self):
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f'{self.path} exists and is not a socket')
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise FileExistsError(f'another control server is listening on {self.path}')
+
+    # bind in a new directory of mode 0700 (in the directory of the socket, the link
+    # must not cross file systems), the socket file is never reachable with a wider mode
+    # (a link, unlike a rename, does not replace a socket file created meanwhile)
+    def bindSocket(self):
+        directory = tempfile.mkdtemp(prefix='.control-', dir=os.path.dirname(os.path.abspath(self.path)))
+        privatePath = os.path.join(directory, 's')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(privatePath)
+            os.chmod(privatePath, 0o600)
+            os.link(privatePath, self.path)
+        except BaseException:
+            sock.close()
+            raise
+        finally:
+            try:
+                os.unlink(privatePath)
+            except FileNotFoundError:
+                pass
+            os.rmdir(directory)
+        return sock
+
+    async def serve(self):
+        self.server = await asyncio.start_unix_server(self.handleConnection, sock=self.bindSocket(), limit=MAX_LINE)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    # operation thread: runs the operations and hands the results to the loop
+    def runOperations(self):
+        while True:
+            item = self.operationQueue.get()
+            if item is None:
+                return
+            operation, args, future = item
+            try:
+                result = operation(**args)
+            except Exception as error:
+                future.get_loop().call_soon_threadsafe(self.setFutureException, future, error)
+            else:
+                future.get_loop().call_soon_threadsafe(self.setFutureResult, future, result)
+
+    @staticmethod
+    def setFutureResult(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def setFutureException(future, error):
+        if not future.done():
+            future.set_exception(error)
+
+    async def handleConnection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # line longer than MAX_LINE
+                    writer.write(self.encode({'id': None, 'ok': False, 'error': 'Request too long.'}))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                writer.write(self.encode(await self.handleRequest(line)))
+                # the client reads while it sends (pipelining), drain keeps the buffer small
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def handleRequest(self, line):
+        self.requests += 1
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'id': None, 'ok': False, 'error': 'Invalid JSON.'}
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': 'Request must be a JSON object.'}
+        requestId = request.get('id')
+        operation = self.operations.get(request.get('op'))
+        args = request.get('args') or {}
+        if operation is None:
+            return {'id': requestId, 'ok': False, 'error': f'Unknown operation {request.get("op")}, valid are: {", ".join(self.operations)}.'}
+        if not isinstance(args, dict):
+            return {'id': requestId, 'ok': False, 'error': 'args must be a JSON object.'}
+        try:
+            inspect.signature(operation).bind(**args)
+        except TypeError as error:
+            return {'id': requestId, 'ok': False, 'error': f'Invalid arguments for {request.get("op")}: {error}'}
+        future = asyncio.get_running_loop().create_future()
+        self.operationQueue.put((operation, args, future))
+        try:
+            result = await future
+        except CommandError as error:
+            return {'id': requestId, 'ok': False, 'error': str(error)}
+        except Exception as error:
+            self.logger.exception(f'Control operation {request.get("op")} failed')
+            return {'id': requestId, 'ok': False, 'error': f'Operation failed: {error!r}'}
+        return {'id': requestId, 'ok': True, 'result': result}
+
+    def encode(self, response):
+        return (json.dumps(response, default=str) + '\n').encode()
+
+    def ping(self):
+        return {'pong': True, 'pid': os.getpid(), 'connections': self.connections, 'requests': self.requests}
@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from collections import deque
+from enum import Enum
+
+from workerstats import LatencyHistogram
+
+# conversion factor for the monotonic (nanosecond) timestamps
+NS_PER_SEC = 1_000_000_000
+
+# what put() does if the queue is full
+class QueueFullPolicy(str, Enum):
+   block = 'block'
+   reject = 'reject'
+
+
+class JobQueue():
+    '''
+    Bounded input queue of a worker (or of all instances of a pool).
+    Producers put() items, the workers take them in batches with get_batch():
+    up to `maxItems` items or whatever arrives within `maxWaitSec` after the first
+    item. An empty queue blocks the worker on a condition (no polling).
+    If the queue is full, put() blocks until there is space (backpressure) or
+    rejects the item with queue.Full, depending on the policy.
+    Parameters:
+        - `maxsize`: capacity of the queue (items)
+        - `policy`: QueueFullPolicy for a full queue
+        - `putTimeoutSec`: longest blocking time of put() with the block policy
+    '''
+    def __init__(self, maxsize = 1000, policy = QueueFullPolicy.block.value, putTimeoutSec = 5):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.putTimeoutSec = putTimeoutSec
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.notEmpty = threading.Condition(self.lock)
+        self.notFull = threading.Condition(self.lock)
+        self.submitted = 0
+        self.rejected = 0
+        self.taken = 0
+        # time from put() to get_batch() per item
+        self.waitTime = LatencyHistogram()
+
+    def __len__(self):
+        return len(self.items)
+
+    # put one item, raises queue.Full if it is rejected (or the blocking time is over)
+    def put(self, item, timeoutSec = None):
+        if not self.put_many((item,), timeoutSec):
+            raise queue.Full('job queue full, item not accepted')
+
+    # put several items with one lock, returns the number of accepted items
+    # (the rest was rejected)
+    def put_many(self, items, timeoutSec = None):
+        items = list(items)
+        if timeoutSec is None:
+            timeoutSec = self.putTimeoutSec
+        deadlineNs = time.monotonic_ns() + int(timeoutSec * NS_PER_SEC)
+        accepted = 0
+        with self.lock:
+            while accepted < len(items):
+                free = self.maxsize - len(self.items)
+                if free <= 0:
+                    remainingNs = deadlineNs - time.monotonic_ns()
+                    if self.policy == QueueFullPolicy.reject.value or remainingNs <= 0:
+                        self.rejected += len(items) - accepted
+                        break
+                    self.notFull.wait(remainingNs / NS_PER_SEC)
+                    continue
+                nowNs = time.monotonic_ns()
+                for item in items[accepted:accepted + free]:
+                    self.items.append((nowNs, item))
+                added = min(free, len(items) - accepted)
+                accepted += added
+                self.submitted += added
+                self.notEmpty.notify(added)
+        return accepted
+
+    def get_batch(self, maxItems, maxWaitSec = 0, timeoutSec = None, interrupted = None):
+        '''
+        Take up to `maxItems` items. Blocks until the first item arrives
+        (at most `timeoutSec`, None: no limit) and collects more items until
+        `maxItems` or `maxWaitSec` after the first item.
+        The wait ends early (with the items collected so far) if `interrupted()`
+        returns True, interrupt() wakes the waiting workers for this check.
+        '''
+        batch = []
+        nowNs = time.monotonic_ns()
+        idleDeadlineNs = None if timeoutSec is None else nowNs + int(timeoutSec * NS_PER_SEC)
+        batchDeadlineNs = None
+        with self.lock:
+            while True:
+                if self.items:
+                    nowNs = time.monotonic_ns()
+                    if batchDeadlineNs is None:
+                        batchDeadlineNs = nowNs + int(maxWaitSec * NS_PER_SEC)
+                    while self.items and len(batch) < maxItems:
+                        enqueuedNs, item = self.items.popleft()
+                        self.waitTime.record(nowNs - enqueuedNs)
+                        batch.append(item)
+                    self.notFull.notify(len(batch))
+                if len(batch) >= maxItems:
+                    break
+                if interrupted is not None and interrupted():
+                    break
+                deadlineNs = batchDeadlineNs if batch else idleDeadlineNs
+                if deadlineNs is None:
+                    self.notEmpty.wait()
+                    continue
+                remainingNs = deadlineNs - time.monotonic_ns()
+                if remainingNs <= 0:
+                    break
+                self.notEmpty.wait(remainingNs / NS_PER_SEC)
+            self.taken += len(batch)
+        return batch
+
+    # wake all waiting workers, they check their interruption (stop, timer, status)
+    def interrupt(self):
+        with self.lock:
+            self.notEmpty.notify_all()
+
+    def get_status(self):
+        p50, p99 = self.waitTime.percentiles(50, 99)
+        return {
+            'queue-depth': len(self.items),
+            'queue-capacity': self.maxsize,
+            'queue-submitted': self.submitted,
+            'queue-rejected': self.rejected,
+            'queue-wait-p50-ms': round(p50 / 1e6, 3),
+            'queue-wait-p99-ms': round(p99 / 1e6, 3),
+        }
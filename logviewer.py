@@ -0,0 +1,214 @@
+import mmap
+import os
+import re
+from datetime import datetime, timedelta
+
+from statushistory import parse_duration
+
+# leading timestamp of a log record (LOG_FORMAT: asctime is the local time with milliseconds),
+# the timestamps sort like the bytes
+_timestamp = re.compile(rb'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} ')
+
+# bytes searched at once by --grep (from the end of the file backwards)
+GREP_BLOCK_SIZE = 1 << 20
+
+# formats of an absolute --since value (T or _ instead of the space between date and time)
+_since_formats = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%H:%M:%S', '%H:%M')
+
+
+def parse_since(value, now = None):
+    '''
+    Start of the lines for --since as a timestamp prefix of the log records (bytes):
+    a duration back from now (90, 30s, 10m, 1h, 1d) or a local time
+    (2024-05-01T12:00:00, 2024-05-01, 12:00 of today). None if the value is invalid.
+    '''
+    now = now if now is not None else datetime.now()
+    seconds = parse_duration(value)
+    if seconds is not None:
+        return (now - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S').encode()
+    value = value.replace('T', ' ').replace('_', ' ')
+    for format in _since_formats:
+        try:
+            since = datetime.strptime(value, format)
+        except ValueError:
+            continue
+        if not format.startswith('%Y'):
+            since = datetime.combine(now.date(), since.time())
+        return since.strftime('%Y-%m-%d %H:%M:%S').encode()
+    return None
+
+
+class LogFile():
+    '''
+    Read-only view of a log file through mmap, nothing is read that is not needed:
+        - the last lines are found by scanning backwards from the end (tail)
+        - the first record at or after a time is found by a binary search on the
+          leading timestamps (lines without one, e.g. tracebacks, belong to the
+          record above them)
+        - a regex is searched in blocks of GREP_BLOCK_SIZE from the end backwards,
+          only the lines with a match are cut out (no Python loop over all lines)
+    The view covers the file as it was when it was opened.
+    Parameters:
+        - `path`: path of the log file
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.map = None
+
+    def __enter__(self):
+        with open(self.path, 'rb') as stream:
+            self.size = os.fstat(stream.fileno()).st_size
+            # (an empty file can not be mapped)
+            if self.size:
+                self.map = mmap.mmap(stream.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self
+
+    def __exit__(self, *exc):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    # start of the first record with a timestamp at or after `offset` (None: no more records)
+    def recordAt(self, offset):
+        data = self.map
+        if offset > 0 and data[offset - 1] != 0x0a:
+            offset = data.find(b'\n', offset) + 1
+            if offset == 0:
+                return None
+        while offset < self.size:
+            if _timestamp.match(data, offset):
+                return offset
+            offset = data.find(b'\n', offset) + 1
+            if offset == 0:
+                return None
+        return None
+
+    # offset of the first record at or after the timestamp prefix `since` (binary search)
+    def find_since(self, since):
+        if self.map is None:
+            return 0
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            record = self.recordAt(middle)
+            if record is None or self.map[record:record + len(since)] >= since:
+                high = middle
+            else:
+                low = middle + 1
+        record = self.recordAt(low)
+        return self.size if record is None else record
+
+    # lines between the offsets from the last to the first (without the newline)
+    def reverse_lines(self, start, end):
+        data = self.map
+        if end > start and data[end - 1] == 0x0a:
+            end -= 1
+        while end > start:
+            newline = data.rfind(b'\n', start, end)
+            yield data[newline + 1 if newline >= 0 else start:end]
+            if newline < 0:
+                return
+            end = newline
+
+    # lines between the offsets with a match of `pattern` from the last to the first;
+    # a match is checked again on its line alone (e.g. \s can match the newline)
+    def reverse_matches(self, pattern, start, end):
+        data = self.map
+        while end > start:
+            blockStart = start
+            if end - start > GREP_BLOCK_SIZE:
+                # (the block starts with a line)
+                blockStart = max(start, data.rfind(b'\n', start, end - GREP_BLOCK_SIZE) + 1)
+            lines = []
+            position = blockStart
+            while position < end:
+                match = pattern.search(data, position, end)
+                if match is None:
+                    break
+                lineStart = max(blockStart, data.rfind(b'\n', blockStart, match.start()) + 1)
+                lineEnd = data.find(b'\n', match.start(), end)
+                if lineEnd < 0:
+                    lineEnd = end
+                line = data[lineStart:lineEnd]
+                if pattern.search(line):
+                    lines.append(line)
+                position = lineEnd + 1
+            yield from reversed(lines)
+            end = blockStart
+
+    def tail(self, count, pattern = None, since = None):
+        '''
+        The last `count` lines (oldest first, decoded), only lines matching the
+        compiled bytes regex `pattern` (use re.MULTILINE for ^ and $) and not before
+        the timestamp prefix `since`.
+        '''
+        if self.map is None:
+            return []
+        start = self.find_since(since) if since is not None else 0
+        if pattern is None:
+            candidates = self.reverse_lines(start, self.size)
+        else:
+            candidates = self.reverse_matches(pattern, start, self.size)
+        lines = []
+        for line in candidates:
+            lines.append(line)
+            if len(lines) >= count:
+                break
+        return [line.decode('utf-8', errors='replace') for line in reversed(lines)]
+
+
+class LogFollower():
+    '''
+    New lines of a growing log file (logs --follow).
+    Every poll reads only the bytes appended since the previous one (one fstat when
+    nothing is new), a line is returned when it is complete. A truncated or
+    replaced file is read again from the start.
+    Parameters:
+        - `path`: path of the log file
+        - `offset`: where the new lines start (e.g. the size at the tail)
+        - `pattern`: compiled bytes regex the lines must match (None: all lines)
+    '''
+    def __init__(self, path, offset, pattern = None):
+        self.path = path
+        self.offset = offset
+        self.pattern = pattern
+        self.partial = b''
+        self.stream = open(path, 'rb')
+        self.inode = os.fstat(self.stream.fileno()).st_ino
+
+    def close(self):
+        self.stream.close()
+
+    def poll(self):
+        self.reopenIfReplaced()
+        size = os.fstat(self.stream.fileno()).st_size
+        if size < self.offset:
+            # truncated: read again from the start
+            self.offset = 0
+            self.partial = b''
+        if size == self.offset:
+            return []
+        self.stream.seek(self.offset)
+        data = self.stream.read(size - self.offset)
+        self.offset += len(data)
+        data = self.partial + data
+        end = data.rfind(b'\n') + 1
+        self.partial = data[end:]
+        lines = data[:end].splitlines()
+        if self.pattern is not None:
+            lines = [line for line in lines if self.pattern.search(line)]
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    # a new file under the same path (rotated): follow the new one from its start
+    def reopenIfReplaced(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self.inode:
+            self.stream.close()
+            self.stream = open(self.path, 'rb')
+            self.inode = inode
+            self.offset = 0
+            self.partial = b''
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import queue
+import re
+import threading
+
+from queuedlogging import get_log_listener
+
+# status keys exported as own metric families:
+# status key -> (family, type, help, labels of the sample)
+STATUS_METRICS = {
+    'counter': ('iterations_total', 'counter', 'Iterations of the worker loop.', ''),
+    'runtime-sec': ('runtime_seconds', 'gauge', 'Runtime of the worker.', ''),
+    'timer-remaining-sec': ('timer_remaining_seconds', 'gauge', 'Time until the timer of the worker ends.', ''),
+    'running': ('running', 'gauge', 'Worker loop is running (1) or not (0).', ''),
+    'running-enabled': ('running_enabled', 'gauge', 'Worker has no stop request (1) or has one (0).', ''),
+    'periodic-jobs': ('periodic_jobs_total', 'counter', 'Periodic jobs done by the worker.', ''),
+    'rate-10s': ('iteration_rate', 'gauge', 'Iterations per second (EWMA).', 'window="10s"'),
+    'rate-60s': ('iteration_rate', 'gauge', 'Iterations per second (EWMA).', 'window="60s"'),
+    'iteration-p50-ms': ('iteration_latency_ms', 'gauge', 'Duration of taskForIteration.', 'quantile="0.5"'),
+    'iteration-p99-ms': ('iteration_latency_ms', 'gauge', 'Duration of taskForIteration.', 'quantile="0.99"'),
+    'iteration-max-ms': ('iteration_latency_ms', 'gauge', 'Duration of taskForIteration.', 'quantile="1"'),
+    'queue-depth': ('queue_depth', 'gauge', 'Jobs waiting in the job queue of the worker (shared by a pool).', ''),
+    'jobs-done': ('jobs_done_total', 'counter', 'Jobs done by the worker.', ''),
+    'restarts': ('restarts_total', 'counter', 'Restarts of the worker by the supervisor.', ''),
+    'crashes': ('crashes_total', 'counter', 'Ends of the worker by an exception.', ''),
+    'circuit-open': ('circuit_open', 'gauge', 'Restarts of the worker are stopped by the circuit breaker (1) or not (0).', ''),
+}
+
+# counters of the log listener of the process: status key -> (family, help)
+LOG_METRICS = {
+    'dropped': ('log_dropped_total', 'Log records dropped on a full log queue.'),
+    'failed': ('log_failed_total', 'Log lines that could not be written to their file.'),
+}
+
+# status keys that are no metrics (identity, strings of the shell output)
+IGNORED_KEYS = ('worker', 'process-id', 'status-version')
+
+_invalid_name_chars = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def metric_name(key):
+    name = _invalid_name_chars.sub('_', key)
+    return name if not name[:1].isdigit() else f'_{name}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def sample_value(value):
+    # numbers, booleans (0/1) and counters rendered as strings, None is no sample
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str) and value.isdigit():
+        return value
+    return None
+
+
+class MetricsExporter():
+    '''
+    HTTP endpoint with the metrics of all workers in Prometheus text format (GET /metrics).
+    The samples are taken from the status snapshots of the workers: the loop
+    counters, runtime, timer, running flags, periodic jobs, rates and latencies,
+    and every other numeric status value (e.g. of specificStatus) as
+    `<prefix>_status_<key>`, and the log records lost by the shell
+    (`<prefix>_log_dropped_total`, `<prefix>_log_failed_total`).
+    The samples of a worker are rendered once per status version and cached,
+    a scrape only renders the workers with a new snapshot. If no worker has
+    changed, the last response is returned as it is.
+    The server runs on an asyncio event loop (the AsyncWorkerLoop of the main process).
+    The responses are rendered in a render thread, so a scrape of many workers
+    does not hold up the async workers and the control server on the same loop.
+    The thread is started with the server: in batch mode the main thread has ended
+    and no new executor threads can be created. The renders of overlapping scrapes
+    run one after the other (they share the cache and the last response).
+    Parameters:
+        - `engine`: cliEngine with the workers
+        - `port`: TCP port (0: any free port, see `port` after start)
+        - `host`: address to listen on
+        - `asyncLoop`: AsyncWorkerLoop that runs the server
+        - `prefix`: prefix of the metric names
+        - `logger`: Logger object
+    '''
+    def __init__(self, engine, port, asyncLoop, host = '127.0.0.1', prefix = 'bgworker', logger = None):
+        self.engine = engine
+        self.port = port
+        self.host = host
+        self.asyncLoop = asyncLoop
+        self.prefix = prefix
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.server = None
+        # worker name -> (status version, {family: [sample lines]})
+        self.cache = {}
+        # families of the generic status metrics -> help text
+        self.statusFamilies = {}
+        # worker name -> (pool, {status key: (family, sample prefix)})
+        self.prefixes = {}
+        self.response = None
+        self.responseKey = None
+        self.scrapes = 0
+        self.renders = 0
+        # guards the cache and the last response
+        self.renderLock = threading.Lock()
+        self.renderQueue = queue.Queue()
+        self.renderThread = None
+
+    def start(self, timeout = 5):
+        future = asyncio.run_coroutine_threadsafe(self.serve(), self.asyncLoop.loop)
+        future.result(timeout)
+        self.renderThread = threading.Thread(target=self.runRenders, name='metrics-render', daemon=True)
+        self.renderThread.start()
+        self.logger.info(f'Metrics exporter listening on http://{self.host}:{self.port}/metrics.')
+
+    def stop(self, timeout = 5):
+        if self.server is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.close(), self.asyncLoop.loop)
+        try:
+            future.result(timeout)
+        except Exception as error:
+            self.logger.warning(f'Metrics exporter did not close cleanly: {error!r}')
+        self.renderQueue.put(None)
+
+    async def serve(self):
+        self.server = await asyncio.start_server(self.handleConnection, host=self.host, port=self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    # render thread: renders the responses and hands them to the loop
+    def runRenders(self):
+        while True:
+            future = self.renderQueue.get()
+            if future is None:
+                return
+            try:
+                body = self.render()
+            except Exception as error:
+                future.get_loop().call_soon_threadsafe(self.setFutureException, future, error)
+            else:
+                future.get_loop().call_soon_threadsafe(self.setFutureResult, future, body)
+
+    @staticmethod
+    def setFutureResult(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def setFutureException(future, error):
+        if not future.done():
+            future.set_exception(error)
+
+    async def handleConnection(self, reader, writer):
+        try:
+            requestLine = await reader.readline()
+            # skip the headers
+            while True:
+                line = await reader.readline()
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+            parts = requestLine.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+                self.writeResponse(writer, '405 Method Not Allowed', b'')
+            elif parts[1].split('?')[0] != '/metrics':
+                self.writeResponse(writer, '404 Not Found', b'')
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self.renderQueue.put(future)
+                try:
+                    body = await future
+                except Exception:
+                    self.logger.exception('Rendering the metrics failed')
+                    self.writeResponse(writer, '500 Internal Server Error', b'')
+                else:
+                    self.writeResponse(writer, '200 OK', b'' if parts[0] == 'HEAD' else body, len(body))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def writeResponse(self, writer, status, body, length = None):
+        writer.write((f'HTTP/1.1 {status}\r\n'
+                      'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                      f'Content-Length: {len(body) if length is None else length}\r\n'
+                      'Connection: close\r\n\r\n').encode() + body)
+
+    # sample name and labels of a status key of a worker (without the value)
+    def samplePrefix(self, name, pool, key):
+        labels = f'worker="{escape_label(name)}",pool="{escape_label(pool)}"'
+        metric = STATUS_METRICS.get(key)
+        if metric is not None:
+            family, _, _, extraLabels = metric
+            if extraLabels:
+                labels = f'{labels},{extraLabels}'
+        else:
+            family = f'status_{metric_name(key)}'
+            if family not in self.statusFamilies:
+                self.statusFamilies[family] = f'Status value {key} of the worker.'
+        return family, f'{self.prefix}_{family}{{{labels}}} '
+
+    # samples of one worker per family (rendered once per status version,
+    # the sample prefixes once per worker)
+    def renderWorker(self, name, pool, status):
+        self.renders += 1
+        prefixes = self.prefixes.get(name)
+        if prefixes is None or prefixes[0] != pool:
+            prefixes = self.prefixes[name] = (pool, {})
+        prefixes = prefixes[1]
+        families = {}
+        for key, value in status.items():
+            if key in IGNORED_KEYS:
+                continue
+            sample = sample_value(value)
+            if sample is None:
+                continue
+            prefix = prefixes.get(key)
+            if prefix is None:
+                prefix = prefixes[key] = self.samplePrefix(name, pool, key)
+            family, linePrefix = prefix
+            families.setdefault(family, []).append(linePrefix + sample)
+        return families
+
+    def render(self):
+        with self.renderLock:
+            self.scrapes += 1
+            rendered = {}
+            for pool, instances in self.engine.get_pools().items():
+                for name in instances:
+                    process = self.engine.background_processes.get(name)
+                    if process is None:
+                        continue
+                    # ProcessBgWorker rebuilds its snapshot in get_status()
+                    status = process.get_status()
+                    version = status.get('status-version')
+                    cached = self.cache.get(name)
+                    if cached is None or cached[0] != version:
+                        cached = (version, self.renderWorker(name, pool, status))
+                    rendered[name] = cached
+            self.cache = rendered
+            if len(self.prefixes) > len(rendered):
+                self.prefixes = {name: self.prefixes[name] for name in rendered if name in self.prefixes}
+
+            # unchanged workers, versions and log counters: the last response is still valid
+            log = get_log_listener().get_status()
+            responseKey = (tuple((name, cached[0]) for name, cached in rendered.items()),
+                           tuple(log[key] for key in LOG_METRICS))
+            if responseKey == self.responseKey:
+                return self.response
+
+            lines = []
+            families = {}
+            for family, metricType, helpText, _ in STATUS_METRICS.values():
+                families.setdefault(family, (metricType, helpText))
+            for family in sorted(self.statusFamilies):
+                families[family] = ('gauge', self.statusFamilies[family])
+            for family, (metricType, helpText) in families.items():
+                samples = [sample for _, workerFamilies in rendered.values() for sample in workerFamilies.get(family, ())]
+                if not samples:
+                    continue
+                lines.append(f'# HELP {self.prefix}_{family} {helpText}')
+                lines.append(f'# TYPE {self.prefix}_{family} {metricType}')
+                lines.extend(samples)
+            lines.append(f'# HELP {self.prefix}_workers Running workers of the shell.')
+            lines.append(f'# TYPE {self.prefix}_workers gauge')
+            lines.append(f'{self.prefix}_workers {len(rendered)}')
+            for key, (family, helpText) in LOG_METRICS.items():
+                lines.append(f'# HELP {self.prefix}_{family} {helpText}')
+                lines.append(f'# TYPE {self.prefix}_{family} counter')
+                lines.append(f'{self.prefix}_{family} {log[key]}')
+            self.response = ('\n'.join(lines) + '\n').encode()
+            self.responseKey = responseKey
+            return self.response
@@ -0,0 +1,113 @@
+from enum import Enum
+
+# conversion factor for the monotonic (nanosecond) deadlines
+NS_PER_SEC = 1_000_000_000
+
+# pacing modes of the worker loop
+class PaceMode(str, Enum):
+   fixed = 'fixed'
+   rate = 'rate'
+   adaptive = 'adaptive'
+
+# returned by taskForIteration when there was nothing to do (adaptive backoff)
+NO_WORK = False
+
+
+class Pacer():
+    '''
+    Wait of the worker loop after an iteration.
+        - `fixed`: `slowDownSec` after every iteration (None or 0: no wait),
+          the throughput drifts with the cost of the iterations
+        - `rate`: `rateHz` iterations per second on a fixed schedule of deadlines
+          (the next deadline is the previous one plus the interval, not the end of the
+          iteration plus the interval), so the rate does not drift with the cost of the
+          iterations or the wake-up latency; a loop that fell behind catches up at most
+          `burst` iterations without wait (token bucket), older ones are dropped
+        - `adaptive`: an iteration without work (taskForIteration returns NO_WORK) waits
+          `idleMinSec`, every further one `factor` times longer up to `idleMaxSec`;
+          an iteration with work resets the wait (the next one follows right away)
+    The pacer is replaced as a whole when the pace changes (set_pace), it is only
+    used by the thread of the worker.
+    Parameters:
+        - `mode`: PaceMode value
+        - `slowDownSec`: wait of the fixed mode
+        - `rateHz`: target rate of the rate mode
+        - `burst`: iterations the rate mode catches up after a delay
+        - `idleMinSec`: first wait of the adaptive mode
+        - `idleMaxSec`: longest wait of the adaptive mode (the reaction time to new work)
+        - `factor`: growth of the adaptive wait per idle iteration
+    '''
+    def __init__(self,
+                 mode = PaceMode.fixed.value,
+                 slowDownSec = None,
+                 rateHz = None,
+                 burst = 1,
+                 idleMinSec = 0.001,
+                 idleMaxSec = 1.0,
+                 factor = 2):
+        if mode not in [member.value for member in PaceMode]:
+            raise ValueError(f'invalid pace mode {mode}')
+        if mode == PaceMode.fixed.value and slowDownSec is not None and slowDownSec < 0:
+            raise ValueError(f'invalid slow-down {slowDownSec}')
+        if mode == PaceMode.rate.value and (rateHz is None or rateHz <= 0):
+            raise ValueError(f'invalid target rate {rateHz}')
+        if mode == PaceMode.rate.value and (not isinstance(burst, int) or burst < 1):
+            raise ValueError(f'invalid burst {burst}')
+        if mode == PaceMode.adaptive.value and not 0 < idleMinSec <= idleMaxSec:
+            raise ValueError(f'invalid idle backoff {idleMinSec}..{idleMaxSec} s')
+        if mode == PaceMode.adaptive.value and factor < 1:
+            raise ValueError(f'invalid backoff factor {factor}')
+        self.mode = mode
+        self.slowDownSec = slowDownSec
+        self.rateHz = rateHz
+        self.burst = burst
+        self.idleMinSec = idleMinSec
+        self.idleMaxSec = idleMaxSec
+        self.factor = factor
+        self.intervalNs = int(NS_PER_SEC / rateHz) if mode == PaceMode.rate.value else None
+        # next deadline of the rate mode (None: starts with the first iteration)
+        self.nextNs = None
+        # current wait of the adaptive mode (0: the last iteration had work)
+        self.idleWaitSec = 0
+
+    # monotonic time to resume the loop after an iteration (None: no wait)
+    def resume_at(self, nowNs, idle = False):
+        if self.mode == PaceMode.rate.value:
+            if self.nextNs is None:
+                self.nextNs = nowNs
+            self.nextNs += self.intervalNs
+            # more than `burst` intervals behind: the missed iterations are dropped
+            earliestNs = nowNs - (self.burst - 1) * self.intervalNs
+            if self.nextNs < earliestNs:
+                self.nextNs = earliestNs
+            return self.nextNs if self.nextNs > nowNs else None
+        if self.mode == PaceMode.adaptive.value:
+            if not idle:
+                self.idleWaitSec = 0
+                return None
+            if self.idleWaitSec:
+                self.idleWaitSec = min(self.idleWaitSec * self.factor, self.idleMaxSec)
+            else:
+                self.idleWaitSec = self.idleMinSec
+            return nowNs + int(self.idleWaitSec * NS_PER_SEC)
+        if self.slowDownSec:
+            return nowNs + int(self.slowDownSec * NS_PER_SEC)
+        return None
+
+    # status items of the pacing
+    def get_status(self):
+        status = {'pace': self.mode}
+        if self.mode == PaceMode.rate.value:
+            status['pace-target-rate'] = self.rateHz
+            status['pace-burst'] = self.burst
+        elif self.mode == PaceMode.adaptive.value:
+            status['pace-idle-wait-sec'] = self.idleWaitSec
+            status['pace-idle-max-sec'] = self.idleMaxSec
+        return status
+
+    def __repr__(self):
+        if self.mode == PaceMode.rate.value:
+            return f'Pacer(rate {self.rateHz}/s, burst {self.burst})'
+        if self.mode == PaceMode.adaptive.value:
+            return f'Pacer(adaptive {self.idleMinSec}..{self.idleMaxSec} s, x{self.factor})'
+        return f'Pacer(fixed {self.slowDownSec} s)'
@@ -0,0 +1,456 @@
+import logging
+import math
+import multiprocessing
+from multiprocessing import connection
+import sys
+import threading
+import time
+
+from threadingbgworker import ThreadingBgWorker, NS_PER_SEC
+from pacing import PaceMode
+from workerstats import stats_status
+from queuedlogging import FileQueueHandler, shutdown_log_listener
+from checkpoint import get_checkpoint_writer, shutdown_checkpoint_writer
+
+# the child processes are started by a fork server (a single-threaded process started
+# early), not forked from the main process: its scheduler, event loop, log listener and
+# server threads may hold a lock at the moment of the fork, the child would inherit it locked
+# (spawn where there is no fork server)
+mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# modules imported once by the fork server (not by every child): the engine
+# (with its dependencies) and the modules of the worker classes, see preload()
+_preload_modules = {'processbgworker', 'cliengine'}
+
+# attributes of threading.Thread, they are not sent to the child process
+_THREAD_ATTRIBUTES = frozenset(vars(threading.Thread()))
+# main process side of the worker: not sent to the child process (None there)
+_MAIN_ONLY_ATTRIBUTES = ('childProcess', 'commandSender', 'statusReceiver', 'scheduler', 'supervision',
+                         'statusSnapshot', 'history', 'checkpointWriter', 'jobQueue')
+# synchronisation objects of the worker, new ones in the child process
+_LOCAL_ATTRIBUTES = ('wakeup', 'statusLock', 'commandLock', 'no_more_running', 'exitCallbacks')
+
+# slots of the shared counters (int64), -1 stands for None
+SLOT_ITERATIONS = 0
+SLOT_RUNNING = 1
+SLOT_RUNNING_ENABLED = 2
+SLOT_TIME_TO_STOP_NS = 3
+SLOT_STOP_NS = 4
+SLOT_STOP_LATENCY_NS = 5
+SLOT_PERIODIC_JOBS = 6
+SLOT_END_REASON = 7
+SLOT_COUNT = 8
+
+# end reasons in the shared counters (index, -1 stands for None)
+END_REASONS = ('stop', 'timer', 'error')
+
+
+def _from_slot(value):
+    return None if value < 0 else value
+
+
+def _to_slot(value):
+    return -1 if value is None else value
+
+
+class ProcessBgWorker(ThreadingBgWorker):
+    '''
+    Background worker running in a separate OS process (for CPU-bound jobs).
+    It has the same hooks as ThreadingBgWorker (addToJobRun, taskForIteration,
+    taskForPeriodicJob, taskForTimerEnd, taskForStop, specificStatus),
+    they are executed in the child process.
+    The worker object is pickled to the child process (started by a fork server):
+    the worker class has to be importable (defined at module level) and the
+    attributes set in __init__ picklable; connections, locks and other resources
+    of the child are created in addToJobRun.
+    In the main process the object is a thread that supervises the child process,
+    so start(), stop(), join(), is_alive(), set_timer() and get_status() work like
+    for a ThreadingBgWorker.
+        - stop, timer, pace and profile commands are sent to the child process over a pipe
+        - counters are published by the child in shared memory, status reads
+          them without a round-trip to the child process
+        - specificStatus() is sent by the child only when it has changed,
+          the instrumentation summary once per status interval
+        - the status history is sampled by the supervising thread
+    Parameters (additional to ThreadingBgWorker):
+        - `publishSec`: interval in seconds to publish the status in the child process
+    '''
+    def __init__(self,
+                 name,
+                 event,
+                 timerMin = None,
+                 slowDownSec = None,
+                 periodicJobSec = None,
+                 logging_on = True,
+                 cli_name = None,
+                 log_directory = './logs',
+                 timezone = 'Europe/Paris',
+                 statusIntervalSec = 1,
+                 stats_on = False,
+                 historySize = 720,
+                 historyIntervalSec = 5,
+                 paceMode = PaceMode.fixed.value,
+                 rateHz = None,
+                 idleBackoffMaxSec = 1.0,
+                 publishSec = 0.1):
+
+        super().__init__(name=name,
+                         event=event,
+                         timerMin=timerMin,
+                         slowDownSec=slowDownSec,
+                         periodicJobSec=periodicJobSec,
+                         logging_on=logging_on,
+                         cli_name=cli_name,
+                         log_directory=log_directory,
+                         timezone=timezone,
+                         statusIntervalSec=statusIntervalSec,
+                         stats_on=stats_on,
+                         historySize=historySize,
+                         historyIntervalSec=historyIntervalSec,
+                         paceMode=paceMode,
+                         rateHz=rateHz,
+                         idleBackoffMaxSec=idleBackoffMaxSec)
+        self.publishSec = publishSec
+        self.inChild = False
+        self.childProcess = None
+        self.exitcode = None
+        # commands: main process -> child process
+        self.commandReceiver, self.commandSender = mp_context.Pipe(duplex=False)
+        self.commandLock = threading.Lock()
+        # specific status: child process -> main process
+        self.statusReceiver, self.statusSender = mp_context.Pipe(duplex=False)
+        self.specificStatusCache = {}
+        self.statsCache = None
+        self.statsNextNs = 0
+        self.statusStale = True
+        # counters in shared memory (written by the child, read by the main process)
+        self.counters = mp_context.RawArray('q', SLOT_COUNT)
+        self.sharedTimerMin = mp_context.RawArray('d', 1)
+        self.publishCounters()
+
+    # ---------------- main process side ----------------
+
+    # state sent to the child process (pickled by the start of the child process)
+    def __getstate__(self):
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in _THREAD_ATTRIBUTES and key not in _LOCAL_ATTRIBUTES}
+        for key in _MAIN_ONLY_ATTRIBUTES:
+            state[key] = None
+        state['threadName'] = self.name
+        # the child writes the same log file(s) with its own log listener
+        state['logFiles'] = [handler.filename for handler in self.loggi.handlers
+                             if isinstance(handler, FileQueueHandler)] if self.logging_on else []
+        return state
+
+    # the worker in the child process
+    def __setstate__(self, state):
+        threading.Thread.__init__(self, name=state.pop('threadName'))
+        logFiles = state.pop('logFiles')
+        self.__dict__.update(state)
+        self.wakeup = threading.Event()
+        self.statusLock = threading.Lock()
+        self.commandLock = threading.Lock()
+        self.no_more_running = threading.Event()
+        self.exitCallbacks = []
+        if self.checkpointPath is not None:
+            self.checkpointWriter = get_checkpoint_writer()
+        if self.logging_on and not self.loggi.handlers:
+            self.loggi.setLevel(logging.INFO)
+            for filename in logFiles:
+                handler = FileQueueHandler(filename)
+                handler.setLevel(logging.INFO)
+                self.loggi.addHandler(handler)
+
+    # modules for the fork server, it starts with the first child process
+    # (the main module is imported by every child, its __main__ block does not run)
+    def preload(self):
+        module = type(self).__module__
+        if module != '__main__':
+            _preload_modules.add(module)
+        if mp_context.get_start_method() == 'forkserver':
+            mp_context.set_forkserver_preload(sorted(name for name in _preload_modules if name in sys.modules))
+
+    # run the supervising thread in the main process
+    def run(self):
+        self.running = True
+        self.preload()
+        self.childProcess = mp_context.Process(target=self.childMain, name=self.name, daemon=True)
+        self.childProcess.start()
+        self.pid = self.childProcess.pid
+        self.thread_id = threading.current_thread().native_id
+        # the child ends of the pipes are only used in the child process
+        self.commandReceiver.close()
+        self.statusSender.close()
+
+        # receive status updates until the child process has finished
+        # (and sample the history in between)
+        sentinel = self.childProcess.sentinel
+        while True:
+            ready = connection.wait([sentinel, self.statusReceiver], self.historyWaitSec())
+            if self.history is not None:
+                self.syncFromChild()
+                with self.statusLock:
+                    self.recordHistory(time.monotonic_ns())
+            if self.statusReceiver in ready:
+                try:
+                    self.specificStatusCache, self.statsCache, self.lastException = self.statusReceiver.recv()
+                    self.statusStale = True
+                except EOFError:
+                    # child has closed its end, wait for the process to end
+                    connection.wait([sentinel])
+                    break
+            elif sentinel in ready:
+                break
+
+        self.childProcess.join()
+        self.exitcode = self.childProcess.exitcode
+        self.statusReceiver.close()
+        self.syncFromChild()
+        if self.exitcode and self.endReason != 'error':
+            # killed or crashed without a Python exception
+            self.endReason = 'error'
+            self.lastException = f'child process exit code {self.exitcode}'
+        self.running = False
+        self.statusStale = True
+        self.no_more_running.set()
+        self.notifyExit()
+
+    # longest wait of the supervising thread (None: until the next status update)
+    def historyWaitSec(self):
+        if self.history is None:
+            return None
+        return max(0, (self.historyNextNs - time.monotonic_ns()) / NS_PER_SEC)
+
+    # the instrumentation summary of the child has the count and the mean
+    def iterationLatencyTotals(self):
+        if self.inChild or not self.statsCache:
+            return super().iterationLatencyTotals()
+        iteration = self.statsCache['iteration']
+        return iteration['count'], int(iteration['mean'] * iteration['count'])
+
+    # send a command to the child process
+    def sendCommand(self, command):
+        with self.commandLock:
+            try:
+                self.commandSender.send(command)
+            except (BrokenPipeError, OSError):
+                # child process has already finished
+                pass
+
+    # place request for stop the child process
+    def stop(self):
+        if self.inChild:
+            return super().stop()
+        # (the supervisor does not restart a worker stopped by the user,
+        # also when its child misses the deadline and is terminated)
+        if self.stopRequestNs is None:
+            self.stopRequestNs = time.monotonic_ns()
+        self.running_enabled = False
+        self.statusStale = True
+        self.sendCommand(('stop', self.stopRequestNs))
+
+    # kill the child process (escalation of a missed stop deadline)
+    def terminate(self):
+        if self.logging_on:
+            self.loggi.warning(f'terminate child process {self.pid}')
+        if self.childProcess is not None and self.childProcess.is_alive():
+            self.childProcess.terminate()
+
+    # the stop tasks run in the child process, which can only be terminated
+    def force_stop(self):
+        if self.inChild:
+            return super().force_stop()
+        self.terminate()
+
+    # set a timer for the child process
+    def set_timer(self, timerMin = None, timerMode = 'set'):
+        if self.inChild:
+            return super().set_timer(timerMin=timerMin, timerMode=timerMode)
+        self.statusStale = True
+        self.sendCommand(('timer', timerMin, timerMode))
+
+    # the pace is applied in the child process, the main process keeps a copy for the status
+    def set_pace(self, mode, slowDownSec = None, rateHz = None, burst = 1, idleMaxSec = 1.0):
+        if self.inChild:
+            return super().set_pace(mode, slowDownSec, rateHz, burst, idleMaxSec)
+        self.applyPace(self.makePacer(mode, slowDownSec, rateHz, burst, idleMaxSec))
+        self.statusStale = True
+        self.sendCommand(('pace', mode, slowDownSec, rateHz, burst, idleMaxSec))
+
+    # (the idle wait of the adaptive pace is only known in the child process)
+    def collectPaceStatus(self):
+        message = super().collectPaceStatus()
+        if not self.inChild:
+            message.pop('pace-idle-wait-sec', None)
+        return message
+
+    # the instrumentation runs in the child process, it sends its summary with the specific status
+    def set_stats(self, on = True):
+        if self.inChild:
+            return super().set_stats(on)
+        if not on:
+            self.statsCache = None
+        self.statusStale = True
+        self.sendCommand(('stats', on))
+
+    # the profiler runs in the child process (the stacks are there),
+    # it writes the file and reports the result itself
+    def start_profile(self, durationSec, rateHz = 100, path = None):
+        if self.inChild:
+            return super().start_profile(durationSec, rateHz, path)
+        if self.childProcess is None or not self.childProcess.is_alive():
+            raise RuntimeError(f'worker {self.name} has no running process to profile')
+        self.sendCommand(('profile', durationSec, rateHz, path))
+        return None
+
+    # restored before the start of the child, the main process shows the restored counters right away
+    # (the checkpoints are saved by the child process)
+    def restore_checkpoint(self, checkpoint):
+        super().restore_checkpoint(checkpoint)
+        self.publishCounters()
+
+    # copy the shared counters into the attributes used for the status
+    def syncFromChild(self):
+        counters = self.counters
+        self.iterations = counters[SLOT_ITERATIONS]
+        self.periodicJobs = counters[SLOT_PERIODIC_JOBS]
+        if self.childProcess is not None:
+            self.running = bool(counters[SLOT_RUNNING]) or self.childProcess.is_alive()
+        self.running_enabled = bool(counters[SLOT_RUNNING_ENABLED]) and self.running_enabled
+        self.timeToStopNs = _from_slot(counters[SLOT_TIME_TO_STOP_NS])
+        self.stopNs = _from_slot(counters[SLOT_STOP_NS])
+        self.stopLatencyNs = _from_slot(counters[SLOT_STOP_LATENCY_NS])
+        endReason = counters[SLOT_END_REASON]
+        self.endReason = None if endReason < 0 else END_REASONS[endReason]
+        timerMin = self.sharedTimerMin[0]
+        self.timerMin = None if math.isnan(timerMin) else timerMin
+
+    def get_runtime(self):
+        if not self.inChild:
+            self.syncFromChild()
+        return super().get_runtime()
+
+    # the main process rebuilds the snapshot from the shared memory,
+    # at most once per status interval or after a change
+    def get_status(self):
+        if self.inChild:
+            return super().get_status()
+        nowNs = time.monotonic_ns()
+        statusNextNs = self.statusNextNs
+        if self.statusStale or self.statusSnapshot is None or (statusNextNs is not None and nowNs >= statusNextNs):
+            self.statusStale = False
+            self.syncFromChild()
+            self.publishStatus(nowNs)
+        return self.statusSnapshot
+
+    def buildStatus(self, nowNs):
+        message = super().buildStatus(nowNs)
+        if not self.inChild:
+            message['exit-code'] = self.exitcode
+        return message
+
+    # the timers run in the child process (local deadlines), not in the scheduler
+    def attach_scheduler(self, scheduler):
+        pass
+
+    def get_stats(self):
+        if self.inChild:
+            return super().get_stats()
+        return self.statsCache
+
+    def collectStatsStatus(self, nowNs):
+        if self.inChild:
+            return super().collectStatsStatus(nowNs)
+        return stats_status(self.statsCache)
+
+    def collectSpecificStatus(self):
+        if self.inChild:
+            return self.specificStatus()
+        return self.specificStatusCache
+
+    # ---------------- child process side ----------------
+
+    # entry point of the child process
+    def childMain(self):
+        self.inChild = True
+        # the history is kept by the supervising thread
+        self.history = None
+        # the end is reported by the supervising thread
+        self.exitCallbacks = []
+        # (the locks and events are new ones, see __setstate__),
+        # the child uses local deadlines
+        self.childFinished = threading.Event()
+
+        threading.Thread(target=self.childCommandListener, name=f'{self.name}-commands', daemon=True).start()
+        publisher = threading.Thread(target=self.childStatusPublisher, name=f'{self.name}-status', daemon=True)
+        publisher.start()
+
+        try:
+            ThreadingBgWorker.run(self)
+        finally:
+            self.running = False
+            # last publishing after the publisher thread has finished
+            self.childFinished.set()
+            publisher.join()
+            self.publishCounters()
+            self.publishSpecificStatus(force=True)
+            self.statusSender.close()
+            # the child ends without atexit handlers, write the queued log records
+            # and the last checkpoint now
+            shutdown_checkpoint_writer()
+            shutdown_log_listener()
+
+    # apply the commands of the main process
+    def childCommandListener(self):
+        while True:
+            try:
+                command = self.commandReceiver.recv()
+            except (EOFError, OSError):
+                return
+            if command[0] == 'stop':
+                if self.stopRequestNs is None:
+                    # monotonic clock is system-wide, the request time of the
+                    # main process is the start of the stop latency
+                    self.stopRequestNs = command[1]
+                ThreadingBgWorker.stop(self)
+            elif command[0] == 'timer':
+                ThreadingBgWorker.set_timer(self, timerMin=command[1], timerMode=command[2])
+            elif command[0] == 'pace':
+                ThreadingBgWorker.set_pace(self, *command[1:])
+            elif command[0] == 'stats':
+                ThreadingBgWorker.set_stats(self, command[1])
+            elif command[0] == 'profile':
+                try:
+                    ThreadingBgWorker.start_profile(self, durationSec=command[1], rateHz=command[2], path=command[3])
+                except RuntimeError as error:
+                    print(f'Profiling of {self.name} failed: {error}')
+
+    # publish the counters periodically
+    def childStatusPublisher(self):
+        while not self.childFinished.wait(self.publishSec):
+            self.publishCounters()
+            self.publishSpecificStatus()
+
+    def publishCounters(self):
+        counters = self.counters
+        counters[SLOT_ITERATIONS] = self.iterations
+        counters[SLOT_PERIODIC_JOBS] = self.periodicJobs
+        counters[SLOT_RUNNING] = int(self.running)
+        counters[SLOT_RUNNING_ENABLED] = int(self.running_enabled)
+        counters[SLOT_TIME_TO_STOP_NS] = _to_slot(self.timeToStopNs)
+        counters[SLOT_STOP_NS] = _to_slot(self.stopNs)
+        counters[SLOT_STOP_LATENCY_NS] = _to_slot(self.stopLatencyNs)
+        counters[SLOT_END_REASON] = -1 if self.endReason is None else END_REASONS.index(self.endReason)
+        self.sharedTimerMin[0] = math.nan if self.timerMin is None else self.timerMin
+
+    def publishSpecificStatus(self, force = False):
+        specific = self.specificStatus()
+        nowNs = time.monotonic_ns()
+        statsDue = self.stats is not None and nowNs >= self.statsNextNs
+        if force or statsDue or specific != self.specificStatusCache:
+            self.specificStatusCache = dict(specific)
+            self.statsNextNs = nowNs + int((self.statusIntervalSec or 1) * NS_PER_SEC)
+            try:
+                self.statusSender.send((self.specificStatusCache, self.get_stats(), self.lastException))
+            except (BrokenPipeError, OSError):
+                pass
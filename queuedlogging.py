@@ -0,0 +1,222 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# default log format of the shell and the workers
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# marker in the queue to end the listener thread
+_STOP = object()
+
+
+class LogListener():
+    '''
+    Writes the log records of all loggers (shell and workers) in one background thread.
+    The loggers only put their records into a bounded queue (FileQueueHandler),
+    so log I/O never blocks a worker loop or the prompt.
+    The listener takes the records in batches, groups them per file and writes
+    every file once per batch. If the queue is full, records are dropped and counted,
+    lines that can not be written are counted as failed; stop() reports both
+    in every log file and on stderr.
+    Parameters:
+        - `maxsize`: capacity of the queue (records)
+        - `batchSize`: maximum number of records written per batch
+    '''
+    def __init__(self, maxsize = 10000, batchSize = 500):
+        self.maxsize = maxsize
+        self.batchSize = batchSize
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        # one writer at a time: the listener thread or a stop() that drains the queue
+        self.writeLock = threading.Lock()
+        self.thread = None
+        self.files = {}
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    # start the listener thread on first use
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='log-listener', daemon=True)
+                self.thread.start()
+
+    # put a record into the queue without blocking (called by the handlers)
+    def put(self, handler, record):
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait((handler, record))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            # take everything that is already waiting (up to batchSize)
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.writeLock:
+                keepRunning = self.writeBatch(batch)
+            if not keepRunning:
+                return
+
+    # write one batch, returns False if the listener has to stop
+    def writeBatch(self, batch):
+        keepRunning = True
+        lines = {}
+        for item in batch:
+            if item is _STOP:
+                keepRunning = False
+                continue
+            handler, record = item
+            try:
+                lines.setdefault(handler.filename, []).append(handler.format(record))
+            except Exception:
+                handler.handleError(record)
+
+        for filename, fileLines in lines.items():
+            try:
+                stream = self.files.get(filename)
+                if stream is None:
+                    stream = open(filename, 'a', encoding='utf-8')
+                    self.files[filename] = stream
+                stream.write('\n'.join(fileLines) + '\n')
+                stream.flush()
+            except OSError as error:
+                self.failed += len(fileLines)
+                print(f'Error: writing log file {filename} failed: {error}')
+            else:
+                self.written += len(fileLines)
+        self.batches += 1
+        return keepRunning
+
+    # write all queued records, close the files and end the thread
+    def stop(self, timeout = 5):
+        with self.lock:
+            thread = self.thread
+        if thread is None or not thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(_STOP, timeout=timeout / 2)
+        except queue.Full:
+            # the listener does not keep up: the caller writes the queued records itself
+            self.drain(timeout / 2)
+            try:
+                self.queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+        thread.join(max(0.0, deadline - time.monotonic()))
+        # (a listener that is still writing keeps its files)
+        if thread.is_alive():
+            return
+        self.reportLoss()
+        for stream in self.files.values():
+            stream.close()
+        self.files = {}
+        with self.lock:
+            self.thread = None
+
+    # the lost records are reported in every log file (where they are missing) and on stderr
+    def reportLoss(self):
+        if not self.dropped and not self.failed:
+            return
+        message = f'{self.dropped} log records were dropped (queue full), {self.failed} lines could not be written.'
+        line = logging.Formatter(LOG_FORMAT).format(logging.makeLogRecord(
+            {'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING', 'msg': message}))
+        for stream in self.files.values():
+            try:
+                stream.write(line + '\n')
+                stream.flush()
+            except OSError:
+                pass
+        print(f'Warning: {message}', file=sys.stderr)
+
+    # write the records waiting in the queue in the calling thread
+    # (at most one queue full, the loggers may still add records)
+    def drain(self, timeout = 5):
+        if not self.writeLock.acquire(timeout=timeout):
+            return
+        try:
+            batch = []
+            while len(batch) < self.maxsize:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    batch.append(item)
+            if batch:
+                self.writeBatch(batch)
+        finally:
+            self.writeLock.release()
+
+    def get_status(self):
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+    # a forked child process has no listener thread, it starts its own on first use
+    def reinitAfterFork(self):
+        self.queue = queue.Queue(self.maxsize)
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+        self.thread = None
+        self.files = {}
+
+
+class FileQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Logging handler that hands the records to the LogListener for the given file.
+    The message is merged with its arguments in the calling thread (the arguments
+    may change later), formatting and writing happen in the listener thread.
+    Parameters:
+        - `filename`: log file of the handler
+        - `listener`: LogListener (default: the listener of the process)
+    '''
+    def __init__(self, filename, listener = None):
+        self.listener = listener if listener is not None else get_log_listener()
+        super().__init__(self.listener.queue)
+        self.filename = os.path.abspath(filename)
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self.listener.put(self, record)
+
+
+_listener = LogListener()
+
+def get_log_listener():
+    return _listener
+
+# write the remaining records (called at exit and before a hard exit)
+def shutdown_log_listener(timeout = 5):
+    _listener.stop(timeout)
+
+atexit.register(shutdown_log_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_listener.reinitAfterFork)
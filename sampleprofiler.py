@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# conversion factor for the (nanosecond) timestamps
+NS_PER_SEC = 1_000_000_000
+
+# highest sampling rate (samples per second) and deepest recorded stack
+MAX_RATE_HZ = 1000
+MAX_DEPTH = 128
+
+
+class SamplingProfiler(threading.Thread):
+    '''
+    Statistical profiler for one thread of the process.
+    A daemon thread takes the stack of the target thread from sys._current_frames()
+    `rateHz` times per second for `durationSec` seconds and counts the stacks
+    (collapsed: "root;...;leaf count", the input of flamegraph.pl and speedscope).
+    The target thread is not interrupted or instrumented, the cost is the sampling
+    thread itself (a short GIL hold per sample); it is measured and reported as
+    share of the profiling time.
+    Parameters:
+        - `threadIdent`: ident of the target thread (Thread.ident, the key of sys._current_frames)
+        - `durationSec`: profiling time in seconds
+        - `rateHz`: samples per second (at most MAX_RATE_HZ)
+        - `path`: file for the collapsed stacks (written when the profiling ends)
+        - `stackFilter`: callable(frame) -> bool, only matching stacks are counted
+                         (e.g. the coroutine of one async worker on a shared loop)
+        - `onDone`: callable(profiler) called after the file is written
+    '''
+    def __init__(self, threadIdent, durationSec, rateHz = 100, path = None, stackFilter = None, onDone = None, name = None):
+        super().__init__(name=name or f'profiler-{threadIdent}', daemon=True)
+        self.threadIdent = threadIdent
+        self.durationSec = durationSec
+        self.rateHz = min(max(rateHz, 1), MAX_RATE_HZ)
+        self.path = path
+        self.stackFilter = stackFilter
+        self.onDone = onDone
+        self.stacks = Counter()
+        # code object -> frame label
+        self.labels = {}
+        self.samples = 0
+        self.filtered = 0
+        self.samplingNs = 0
+        self.elapsedNs = 0
+        self.stopRequested = threading.Event()
+        self.error = None
+
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f'{os.path.basename(code.co_filename)}:{code.co_qualname}'
+        return label
+
+    # collapsed stack of a frame (root first), None if the filter rejects it
+    def collapse(self, frame):
+        if self.stackFilter is not None and not self.stackFilter(frame):
+            return None
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            labels.append(self.label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+    def run(self):
+        intervalNs = NS_PER_SEC // self.rateHz
+        startNs = time.monotonic_ns()
+        endNs = startNs + int(self.durationSec * NS_PER_SEC)
+        nextNs = startNs
+        try:
+            while True:
+                nowNs = time.monotonic_ns()
+                if nowNs >= endNs:
+                    break
+                if nowNs < nextNs:
+                    if self.stopRequested.wait((nextNs - nowNs) / NS_PER_SEC):
+                        break
+                    continue
+                # fixed cadence, missed samples are not caught up
+                nextNs = max(nextNs + intervalNs, nowNs)
+                sampleStartNs = time.perf_counter_ns()
+                frame = sys._current_frames().get(self.threadIdent)
+                if frame is None:
+                    # the target thread has ended
+                    break
+                stack = self.collapse(frame)
+                del frame
+                if stack is None:
+                    self.filtered += 1
+                else:
+                    self.stacks[stack] += 1
+                    self.samples += 1
+                self.samplingNs += time.perf_counter_ns() - sampleStartNs
+            self.elapsedNs = time.monotonic_ns() - startNs
+            if self.path is not None:
+                self.write_collapsed(self.path)
+        except Exception as error:
+            self.error = error
+        if self.onDone is not None:
+            self.onDone(self)
+
+    # end the profiling early (the file is written anyway)
+    def stop(self):
+        self.stopRequested.set()
+
+    def write_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f'{stack} {count}\n')
+
+    # functions with the most samples on top of the stack
+    def top(self, count = 10):
+        leaves = Counter()
+        for stack, samples in self.stacks.items():
+            leaves[stack.rpartition(';')[2]] += samples
+        return leaves.most_common(count)
+
+    def summary(self):
+        elapsedSec = self.elapsedNs / NS_PER_SEC
+        return {
+            'samples': self.samples,
+            'filtered-samples': self.filtered,
+            'stacks': len(self.stacks),
+            'rate-hz': self.rateHz,
+            'elapsed-sec': round(elapsedSec, 3),
+            'sampling-ms': round(self.samplingNs / 1e6, 3),
+            # share of one core used by the sampling
+            'overhead-percent': round(100 * self.samplingNs / self.elapsedNs, 3) if self.elapsedNs else None,
+            'path': self.path,
+        }
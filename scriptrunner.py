@@ -0,0 +1,207 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+
+from controlserver import CommandError
+
+# exit codes of the script mode
+EXIT_OK = 0
+# a command failed (the script stops at the first failure)
+EXIT_FAILED = 1
+# the script can not be run (unknown command, unreadable file)
+EXIT_INVALID = 2
+
+
+# JSON mode: the results get the original stdout, everything else that is printed
+# (also by the workers and their child processes) goes to stderr
+def json_output():
+    sys.stdout.flush()
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1, encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return output
+
+
+class ErrorLog(logging.Handler):
+    '''
+    Collects the errors a command logs in the thread of the script.
+    Every user error of the engine is printed and logged with logger.error,
+    so a command without a structured operation has failed if it logged an error
+    (the errors of the workers and the supervisor come from other threads).
+    '''
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.threadIdent = threading.get_ident()
+        self.messages = []
+
+    def emit(self, record):
+        if record.thread == self.threadIdent:
+            self.messages.append(record.getMessage())
+
+
+class ScriptRunner():
+    '''
+    Runs the commands of a script (one shell command per line) on a cliEngine, without prompt.
+    Empty lines and lines starting with "#" are skipped, names can be glob patterns
+    (start tw*, timer tw* add 10). The script stops at the first failing command.
+    In JSON mode every command writes one line in the format of the control server:
+        {"id": <line number>, "command": "status tw1", "ok": true, "result": {...}}
+        {"id": <line number>, "command": "stop tw9", "ok": false, "error": "..."}
+    The commands with a structured operation (start, stop, timer, list, status,
+    status_all, profile) return its result (list and status_all are not paged),
+    the other commands their printed output ({"output": "..."}).
+    Parameters:
+        - `engine`: cliEngine that runs the commands
+        - `output`: text file for the JSON lines (default: stdout)
+        - `jsonOutput`: write the results as JSON lines instead of the shell output
+        - `logger`: Logger object (the logger of the engine)
+    '''
+    def __init__(self, engine, output = None, jsonOutput = False, logger = None):
+        self.engine = engine
+        self.output = output if output is not None else sys.stdout
+        self.jsonOutput = jsonOutput
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        # the script has ended with exit or quit (the workers are stopped)
+        self.exited = False
+        self.commands = 0
+        self.operations = {
+            'start': self.parseStart,
+            'stop': self.parseName,
+            'timer': self.parseTimer,
+            'list': self.parseListing,
+            'status': self.parseName,
+            'status_all': self.parseListing,
+            'profile': self.parseProfile,
+        }
+
+    # run the lines of a script, returns the exit code
+    def run(self, lines):
+        errorLog = ErrorLog()
+        self.engine.logger.addHandler(errorLog)
+        try:
+            for number, line in enumerate(lines, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                command = self.engine.parseline(line)[0]
+                if command is None or not hasattr(self.engine, f'do_{command}'):
+                    self.report(number, line, error=f'Unknown command {line.split()[0]}.')
+                    self.logger.error(f'Script line {number}: unknown command {line.split()[0]}.')
+                    return EXIT_INVALID
+                self.commands += 1
+                errorLog.messages.clear()
+                if self.jsonOutput and command in self.operations:
+                    ok = self.runOperation(number, line, command)
+                else:
+                    ok = self.runCommand(number, line, errorLog)
+                if not ok:
+                    self.logger.error(f'Script line {number} failed: {line}')
+                    return EXIT_FAILED
+                if self.exited:
+                    break
+        finally:
+            self.engine.logger.removeHandler(errorLog)
+        return EXIT_OK
+
+    # a shell command (the output is printed, or captured in JSON mode)
+    def runCommand(self, number, line, errorLog):
+        if not self.jsonOutput:
+            self.exited = bool(self.engine.onecmd(line))
+            return not errorLog.messages
+        captured = io.StringIO()
+        with contextlib.redirect_stdout(captured):
+            self.exited = bool(self.engine.onecmd(line))
+        if errorLog.messages:
+            self.report(number, line, error=errorLog.messages[0].removeprefix('Error: '))
+            return False
+        self.report(number, line, result={'output': captured.getvalue()})
+        return True
+
+    # a command with a structured operation of the engine (JSON mode)
+    def runOperation(self, number, line, command):
+        arguments = line.split()[1:]
+        try:
+            args = self.operations[command](command, arguments)
+            # the operations print like the commands (Started process: ...)
+            with contextlib.redirect_stdout(sys.stderr):
+                result = getattr(self.engine, f'op_{command}')(**args)
+        except CommandError as error:
+            self.report(number, line, error=str(error))
+            return False
+        except Exception as error:
+            self.logger.exception(f'Script line {number} failed: {line}')
+            self.report(number, line, error=f'Operation failed: {error!r}')
+            return False
+        self.report(number, line, result=result)
+        return True
+
+    def report(self, number, line, result = None, error = None):
+        if not self.jsonOutput:
+            if error is not None:
+                print(f'Error: line {number}: {error}')
+            return
+        if error is None:
+            response = {'id': number, 'command': line, 'ok': True, 'result': result}
+        else:
+            response = {'id': number, 'command': line, 'ok': False, 'error': error}
+        self.output.write(json.dumps(response, default=str) + '\n')
+        self.output.flush()
+
+    # ---------------- arguments of the operations (shell syntax) ----------------
+
+    @staticmethod
+    def invalid(command):
+        return CommandError(f'Invalid arguments for {command}, see help {command}.')
+
+    def parseName(self, command, arguments):
+        if len(arguments) != 1:
+            raise self.invalid(command)
+        return {'name': arguments[0]}
+
+    def parseStart(self, command, arguments):
+        if len(arguments) == 3 and arguments[1] in ('--replicas', '-r') and arguments[2].isdigit():
+            return {'name': arguments[0], 'replicas': int(arguments[2])}
+        return self.parseName(command, arguments)
+
+    def parseTimer(self, command, arguments):
+        if len(arguments) == 2:
+            return {'name': arguments[0], 'mode': arguments[1]}
+        if len(arguments) != 3:
+            raise self.invalid(command)
+        try:
+            minutes = float(arguments[2])
+        except ValueError:
+            raise CommandError(f'Invalid timer value {arguments[2]}.') from None
+        return {'name': arguments[0], 'mode': arguments[1], 'minutes': minutes}
+
+    def parseListing(self, command, arguments):
+        args = {}
+        while arguments:
+            argument = arguments.pop(0)
+            if argument == '--state' and arguments:
+                args['state'] = arguments.pop(0)
+            elif argument in ('--page', '--page-size') and arguments:
+                # (all entries, the results are not paged)
+                arguments.pop(0)
+            elif 'pattern' not in args and not argument.startswith('--'):
+                args['pattern'] = argument
+            else:
+                raise self.invalid(command)
+        return args
+
+    def parseProfile(self, command, arguments):
+        args = {}
+        if len(arguments) == 4 and arguments[2] == '--rate' and arguments[3].isdigit():
+            args['rate'] = int(arguments[3])
+            arguments = arguments[:2]
+        if len(arguments) != 2:
+            raise self.invalid(command)
+        try:
+            args['seconds'] = float(arguments[1])
+        except ValueError:
+            raise CommandError(f'Invalid profiling time {arguments[1]}.') from None
+        args['name'] = arguments[0]
+        return args
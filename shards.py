@@ -0,0 +1,234 @@
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from multiprocessing import connection
+
+from controlserver import CommandError
+from scriptrunner import ErrorLog
+
+# shards are forked (the worker definitions and the engine are inherited),
+# by mainProcess before it starts any thread; the process workers of a shard
+# are started by a fork server (see processbgworker)
+mp_context = multiprocessing.get_context('fork')
+
+# coordinator ends of the shard pipes, a forked shard closes the copies it inherits
+# (otherwise the pipe of a shard stays open when the coordinator dies)
+_coordinator_connections = []
+
+
+# a shard process is not running (died or stopped)
+class ShardDown(CommandError):
+    pass
+
+
+# shard of a worker definition: the explicit assignment or a stable hash of the name
+# (crc32, the same in every run, unlike hash())
+def shard_of(definition, count, assignment = None):
+    if assignment and definition in assignment:
+        return assignment[definition]
+    return zlib.crc32(definition.encode()) % count
+
+
+# CPUs of every shard: the usable CPUs of the process in contiguous blocks
+# (fewer CPUs than shards: the shards share them round-robin, no affinity support: None)
+def partition_cpus(count):
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * count
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < count:
+        return [{cpus[index % len(cpus)]} for index in range(count)]
+    return [set(cpus[index * len(cpus) // count:(index + 1) * len(cpus) // count]) for index in range(count)]
+
+
+def shard_main(index, cpus, commandConnection, make_engine):
+    '''
+    Main loop of a shard process: a headless cliEngine with the workers of the shard,
+    serving the requests of the coordinator over its pipe (one at a time):
+        ('command', line)          -> (ok, (output, errors)) of a shell command
+        ('op', name, kwargs)       -> (ok, result or error message) of an operation
+        ('batch', {name: replicas})-> (True, {'started': [...], 'errors': [...]})
+        ('stop', None)             -> (True, missed), the shard ends
+    A closed pipe (the coordinator has died) stops the workers as well.
+    '''
+    for inherited in _coordinator_connections:
+        inherited.close()
+    # CTRL+C and SIGTERM (e.g. to the whole process group) are handled by the coordinator,
+    # it stops the shards over the pipes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    engine, cleanup = make_engine(index)
+    engine.logger.info(f'Shard {index} started (pid {os.getpid()}, cpus {sorted(cpus) if cpus else "all"}).')
+    while True:
+        try:
+            request = commandConnection.recv()
+        except (EOFError, OSError):
+            request = ('stop', None)
+        kind = request[0]
+        if kind == 'command':
+            errorLog = ErrorLog()
+            captured = io.StringIO()
+            engine.logger.addHandler(errorLog)
+            try:
+                with contextlib.redirect_stdout(captured):
+                    engine.onecmd(request[1])
+            finally:
+                engine.logger.removeHandler(errorLog)
+            response = (not errorLog.messages, (captured.getvalue(), errorLog.messages))
+        elif kind == 'op':
+            try:
+                response = (True, getattr(engine, f'op_{request[1]}')(**request[2]))
+            except CommandError as error:
+                response = (False, str(error))
+            except Exception as error:
+                engine.logger.exception(f'Shard {index}: operation {request[1]} failed')
+                response = (False, f'Operation failed: {error!r}')
+        elif kind == 'batch':
+            started = []
+            errors = []
+            for definition, replicas in request[1].items():
+                try:
+                    started.extend(engine.op_start(definition, replicas if replicas > 1 else None)['started'])
+                except CommandError as error:
+                    errors.append(str(error))
+            response = (True, {'started': started, 'errors': errors})
+        else:
+            with engine.lock:
+                missed = engine._stop_all_processes() or [] if engine.background_processes else []
+            engine.logger.info(f'Shard {index} stopped.')
+            cleanup()
+            with contextlib.suppress(BrokenPipeError, OSError):
+                commandConnection.send((True, missed))
+            return
+        try:
+            commandConnection.send(response)
+        except (BrokenPipeError, OSError):
+            pass
+
+
+class Shard():
+    '''
+    One shard process (coordinator side): its definitions, CPUs and the pipe.
+    Requests are answered in order, the lock pairs every request with its response.
+    Parameters:
+        - `index`: number of the shard
+        - `definitions`: worker definitions owned by the shard
+        - `cpus`: CPUs the shard is pinned to (None: not pinned)
+        - `make_engine`: callable(index) -> (cliEngine, cleanup), called in the shard process
+    '''
+    def __init__(self, index, definitions, cpus, make_engine):
+        self.index = index
+        self.definitions = definitions
+        self.cpus = cpus
+        self.make_engine = make_engine
+        self.connection = None
+        self.process = None
+        self.lock = threading.Lock()
+        # the coordinator is stopping the shard (its end is no failure)
+        self.stopping = False
+
+    def start(self):
+        self.connection, childConnection = mp_context.Pipe()
+        # (not daemonic: a shard starts its own process workers)
+        self.process = mp_context.Process(target=shard_main,
+                                          args=(self.index, self.cpus, childConnection, self.make_engine),
+                                          name=f'shard-{self.index}')
+        self.process.start()
+        childConnection.close()
+        _coordinator_connections.append(self.connection)
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def send(self, request):
+        if not self.is_alive():
+            raise ShardDown(f'Shard {self.index} is down.')
+        try:
+            self.connection.send(request)
+        except (BrokenPipeError, OSError) as error:
+            raise ShardDown(f'Shard {self.index} is down.') from error
+
+    def receive(self):
+        # (the process workers of a died shard may still hold its end of the pipe)
+        ready = connection.wait([self.connection, self.process.sentinel])
+        if self.connection not in ready:
+            raise ShardDown(f'Shard {self.index} is down.')
+        try:
+            return self.connection.recv()
+        except (EOFError, OSError) as error:
+            raise ShardDown(f'Shard {self.index} is down.') from error
+
+    def request(self, request):
+        with self.lock:
+            self.send(request)
+            return self.receive()
+
+    def get_status(self):
+        return {
+            'shard': self.index,
+            'pid': self.process.pid if self.process is not None else None,
+            'alive': self.is_alive(),
+            'exit-code': self.process.exitcode if self.process is not None else None,
+            'cpus': sorted(self.cpus) if self.cpus else None,
+            'definitions': list(self.definitions),
+        }
+
+
+# the same request to several shards (or callable(shard) -> request): sent to all first,
+# then the responses are collected (the shards work in parallel);
+# a shard that is down answers with (False, message)
+def broadcast(shards, request):
+    pending = []
+    responses = {}
+    for shard in shards:
+        shard.lock.acquire()
+        try:
+            shard.send(request(shard) if callable(request) else request)
+            pending.append(shard)
+        except ShardDown as error:
+            shard.lock.release()
+            responses[shard.index] = (False, str(error))
+    for shard in pending:
+        try:
+            responses[shard.index] = shard.receive()
+        except ShardDown as error:
+            responses[shard.index] = (False, str(error))
+        finally:
+            shard.lock.release()
+    return [responses[shard.index] for shard in shards]
+
+
+class ShardMonitor(threading.Thread):
+    '''
+    Waits for the end of the shard processes (their sentinels, no polling) and
+    reports a shard that ends while the coordinator is not stopping it.
+    Parameters:
+        - `shards`: list of Shard
+        - `logger`: Logger object
+    '''
+    def __init__(self, shards, logger = None):
+        # (not daemonic: in batch mode the coordinator runs as long as its shards)
+        super().__init__(name='shard-monitor')
+        self.shards = shards
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.died = []
+
+    def run(self):
+        pending = {shard.process.sentinel: shard for shard in self.shards}
+        while pending:
+            for sentinel in connection.wait(list(pending)):
+                shard = pending.pop(sentinel)
+                shard.process.join()
+                if shard.stopping:
+                    continue
+                self.died.append(shard.index)
+                message = (f'Shard {shard.index} (pid {shard.process.pid}) has died with exit code {shard.process.exitcode}, '
+                           f'its workers are gone: {", ".join(shard.definitions) or "-"}')
+                print(f'Error: {message}')
+                self.logger.error(f'Error: {message}')
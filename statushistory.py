@@ -0,0 +1,151 @@
+import math
+import re
+import struct
+import sys
+from array import array
+
+# conversion factor for the (nanosecond) timestamps
+NS_PER_SEC = 1_000_000_000
+
+# columns of the history (and of the exports)
+HISTORY_COLUMNS = ('time', 'iterations', 'rate', 'latency-ms')
+
+# durations of the history command: 90, 30s, 10m, 1h, 1d
+_duration = re.compile(r'^(\d+(?:\.\d+)?)([smhd]?)$')
+_duration_units = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+# duration in seconds, None if the value is no valid duration
+def parse_duration(value):
+    match = _duration.match(value.strip().lower())
+    if match is None:
+        return None
+    seconds = float(match.group(1)) * _duration_units[match.group(2)]
+    return seconds if seconds > 0 else None
+
+
+class StatusHistory():
+    '''
+    Fixed-size ring buffer with sampled metrics of a worker.
+    Every sample has four values, each column is one preallocated array
+    (no object per sample), so the memory is fixed: 32 bytes per sample.
+        - `time`: wall-clock time of the sample (ns since the epoch)
+        - `iterations`: iteration counter of the worker
+        - `rate`: iterations per second since the previous sample
+        - `latency-ms`: mean duration of taskForIteration since the previous sample
+                        (NaN without instrumentation or iterations)
+    The oldest samples are overwritten when the buffer is full.
+    Parameters:
+        - `capacity`: number of samples
+    '''
+    def __init__(self, capacity = 720):
+        self.capacity = capacity
+        self.times = array('q', bytes(8 * capacity))
+        self.iterations = array('q', bytes(8 * capacity))
+        self.rates = array('d', bytes(8 * capacity))
+        self.latencies = array('d', bytes(8 * capacity))
+        # index of the next sample and number of samples in the buffer
+        self.next = 0
+        self.count = 0
+        # previous sample for the deltas
+        self.lastTimeNs = None
+        self.lastIterations = 0
+        self.lastLatencyCount = 0
+        self.lastLatencySumNs = 0
+
+    def __len__(self):
+        return self.count
+
+    # bytes of the buffer (fixed)
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self.times, self.iterations, self.rates, self.latencies))
+
+    # add a sample: counters are absolute values, the deltas are computed here
+    def record(self, timeNs, iterations, latencyCount = 0, latencySumNs = 0):
+        if self.lastTimeNs is not None and timeNs > self.lastTimeNs:
+            rate = (iterations - self.lastIterations) * NS_PER_SEC / (timeNs - self.lastTimeNs)
+        else:
+            rate = math.nan
+        # the instrumentation can be switched off and on (counters restart)
+        latencies = latencyCount - self.lastLatencyCount
+        if latencies > 0:
+            latency = (latencySumNs - self.lastLatencySumNs) / latencies / 1e6
+        else:
+            latency = math.nan
+        index = self.next
+        self.times[index] = timeNs
+        self.iterations[index] = iterations
+        self.rates[index] = rate
+        self.latencies[index] = latency
+        self.next = (index + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self.lastTimeNs = timeNs
+        self.lastIterations = iterations
+        self.lastLatencyCount = latencyCount
+        self.lastLatencySumNs = latencySumNs
+
+    # samples (oldest first) as rows (time in seconds), optionally only since `sinceNs`
+    def samples(self, sinceNs = None):
+        start = (self.next - self.count) % self.capacity
+        rows = []
+        for offset in range(self.count):
+            index = (start + offset) % self.capacity
+            timeNs = self.times[index]
+            if sinceNs is not None and timeNs < sinceNs:
+                continue
+            rows.append((timeNs / NS_PER_SEC, self.iterations[index], self.rates[index], self.latencies[index]))
+        return rows
+
+
+# downsample rows to buckets of `intervalSec` (aligned to the epoch):
+# time of the bucket start, last iteration counter, mean rate and latency
+def resample(rows, intervalSec):
+    buckets = []
+    current = None
+    for timeSec, iterations, rate, latency in rows:
+        bucket = math.floor(timeSec / intervalSec) * intervalSec
+        if current is None or current[0] != bucket:
+            current = [bucket, iterations, [], []]
+            buckets.append(current)
+        current[1] = iterations
+        if not math.isnan(rate):
+            current[2].append(rate)
+        if not math.isnan(latency):
+            current[3].append(latency)
+    return [(bucket, iterations,
+             sum(rates) / len(rates) if rates else math.nan,
+             sum(latencies) / len(latencies) if latencies else math.nan)
+            for bucket, iterations, rates, latencies in buckets]
+
+
+def write_csv(path, series):
+    '''
+    Write history rows as CSV.
+    `series` is a list of (worker name, rows), the first column is the worker.
+    '''
+    with open(path, 'w', encoding='utf-8') as output:
+        output.write('worker,' + ','.join(HISTORY_COLUMNS) + '\n')
+        for name, rows in series:
+            for timeSec, iterations, rate, latency in rows:
+                output.write(f'{name},{timeSec:.3f},{iterations},'
+                             f'{"" if math.isnan(rate) else f"{rate:.3f}"},'
+                             f'{"" if math.isnan(latency) else f"{latency:.4f}"}\n')
+
+
+def write_npy(path, rows):
+    '''
+    Write history rows as NumPy .npy file (format 1.0) without numpy:
+    a float64 matrix with one row per sample and the columns of HISTORY_COLUMNS.
+    '''
+    values = array('d')
+    for row in rows:
+        values.extend(row)
+    descr = '<f8' if sys.byteorder == 'little' else '>f8'
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({len(rows)}, {len(HISTORY_COLUMNS)}), }}"
+    # magic, version and header length are 10 bytes, the data starts 64-byte aligned
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = header + ' ' * padding + '\n'
+    with open(path, 'wb') as output:
+        output.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin-1'))
+        output.write(memoryview(values).cast('B'))
@@ -0,0 +1,195 @@
+import contextlib
+import os
+import select
+import sys
+import time
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
+# conversion factor for the monotonic (nanosecond) timestamps
+NS_PER_SEC = 1_000_000_000
+
+# status keys shown by default
+DEFAULT_WATCH_FIELDS = ('running', 'counter', 'timer-remaining-sec', 'pace', 'end-reason')
+
+# column with the iterations per second of the last interval (delta of the counter)
+RATE_COLUMN = 'iter/s'
+
+# narrowest column of the table (the values of a column grow, e.g. counters)
+MIN_COLUMN_WIDTH = 10
+
+# first line of the table rows on the terminal (title and header above)
+FIRST_ROW = 3
+
+
+# iteration counter of a status (the counter is a string in the status)
+def status_counter(status):
+    value = status.get('counter')
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+class StatusWatch():
+    '''
+    Differential rendering of the worker status for the watch command.
+    Every interval the status snapshots are collected in one pass (collect),
+    compared with those of the previous interval and only the changes are written:
+        - terminal: a table with one row per worker and one column per field,
+          drawn once, afterwards only the changed cells are overwritten
+          (cursor positioning); a new or ended worker draws the table again
+        - otherwise (pipe, script): one line per worker with its changed fields
+    The column iter/s is the delta of the counter over the interval. The fields of
+    a worker whose snapshot is the same object as in the previous interval are not
+    compared again, so an idle fleet costs a few lookups per worker.
+    Parameters:
+        - `collect`: callable() -> {name: status}
+        - `fields`: status keys to show
+        - `output`: text stream (default: stdout)
+        - `terminal`: draw the table on a terminal
+        - `title`: first line of the table
+    '''
+    def __init__(self, collect, fields = DEFAULT_WATCH_FIELDS, output = None, terminal = False, title = ''):
+        self.collect = collect
+        self.fields = list(fields)
+        self.labels = self.fields + [RATE_COLUMN]
+        self.output = output if output is not None else sys.stdout
+        self.terminal = terminal
+        self.title = title
+        # previous interval: snapshots, rendered cells and counters per worker
+        self.snapshots = {}
+        self.cells = {}
+        self.counters = {}
+        self.lastNs = None
+        # rows and columns of the drawn table (terminal)
+        self.layout = None
+        self.widths = []
+        self.columns = []
+        self.refreshes = 0
+        # cells written by the last refresh
+        self.written = 0
+
+    def refresh(self):
+        statuses = self.collect()
+        nowNs = time.monotonic_ns()
+        elapsedSec = None if self.lastNs is None else (nowNs - self.lastNs) / NS_PER_SEC
+        self.lastNs = nowNs
+        rows = {name: self.renderRow(name, status, elapsedSec) for name, status in statuses.items()}
+        for name in list(self.snapshots):
+            if name not in rows:
+                del self.snapshots[name]
+                self.counters.pop(name, None)
+        text = self.drawTable(rows) if self.terminal else self.drawLines(rows)
+        self.cells = rows
+        self.refreshes += 1
+        if text:
+            self.output.write(text)
+            self.output.flush()
+
+    # cells of a worker: the fields and the rate of the interval
+    def renderRow(self, name, status, elapsedSec):
+        if status is self.snapshots.get(name) and name in self.cells:
+            cells = self.cells[name][:-1]
+        else:
+            cells = [self.formatValue(status.get(field)) for field in self.fields]
+        counter = status_counter(status)
+        previous = self.counters.get(name)
+        if elapsedSec and counter is not None and previous is not None:
+            rate = f'{(counter - previous) / elapsedSec:.1f}'
+        else:
+            rate = '-'
+        self.snapshots[name] = status
+        self.counters[name] = counter
+        return cells + [rate]
+
+    @staticmethod
+    def formatValue(value):
+        return '-' if value is None else str(value)
+
+    # the whole table (new layout) or the changed cells
+    def drawTable(self, rows):
+        names = list(rows)
+        stamp = time.strftime('%H:%M:%S')
+        if names != self.layout:
+            self.layout = names
+            nameWidth = max([MIN_COLUMN_WIDTH] + [len(name) + 1 for name in names])
+            self.widths = [max(MIN_COLUMN_WIDTH, len(label) + 1, *(len(row[index]) + 2 for row in rows.values()))
+                           for index, label in enumerate(self.labels)]
+            self.columns = []
+            column = nameWidth + 1
+            for width in self.widths:
+                self.columns.append(column)
+                column += width
+            lines = [f'{self.title}  {stamp}',
+                     'name'.ljust(nameWidth) + ''.join(label.ljust(width) for label, width in zip(self.labels, self.widths))]
+            for name in names:
+                lines.append(name.ljust(nameWidth) + ''.join(cell[:width - 1].ljust(width) for cell, width in zip(rows[name], self.widths)))
+            if not names:
+                lines.append(' ...no matching background processes.')
+            self.written = len(names) * len(self.labels)
+            return '\x1b[H\x1b[2J' + '\n'.join(lines) + '\n'
+        parts = [f'\x1b[1;1H{self.title}  {stamp}']
+        self.written = 0
+        for row, name in enumerate(names, FIRST_ROW):
+            previous = self.cells[name]
+            for index, cell in enumerate(rows[name]):
+                if cell == previous[index]:
+                    continue
+                width = self.widths[index]
+                parts.append(f'\x1b[{row};{self.columns[index]}H{cell[:width - 1].ljust(width)}')
+                self.written += 1
+        # (the cursor waits below the table)
+        parts.append(f'\x1b[{FIRST_ROW + max(len(names), 1)};1H')
+        return ''.join(parts)
+
+    # one line per worker with its changed fields (the first refresh: all fields)
+    def drawLines(self, rows):
+        stamp = time.strftime('%H:%M:%S')
+        lines = []
+        self.written = 0
+        for name, cells in rows.items():
+            previous = self.cells.get(name)
+            changed = [f'{label}={cell}' for index, (label, cell) in enumerate(zip(self.labels, cells))
+                       if previous is None or previous[index] != cell]
+            if changed:
+                lines.append(f'[{stamp}] {name}: ' + ', '.join(changed))
+                self.written += len(changed)
+        for name in self.cells:
+            if name not in rows:
+                lines.append(f'[{stamp}] {name}: gone')
+        if not rows and self.refreshes == 0:
+            lines.append(f'[{stamp}] ...no matching background processes.')
+        return ''.join(line + '\n' for line in lines)
+
+
+@contextlib.contextmanager
+def key_listener(stream, terminal):
+    '''
+    Yields wait(seconds) -> True if a key was pressed meanwhile.
+    On a terminal the keys are read one by one without echo (the mode of the
+    terminal is restored at the end), otherwise wait() only sleeps.
+    '''
+    if not terminal or termios is None:
+        def wait(seconds):
+            time.sleep(seconds)
+            return False
+        yield wait
+        return
+    fd = stream.fileno()
+    saved = termios.tcgetattr(fd)
+    tty.setcbreak(fd)
+    try:
+        def wait(seconds):
+            if not select.select([fd], [], [], seconds)[0]:
+                return False
+            os.read(fd, 1024)
+            return True
+        yield wait
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from collections import deque
+from enum import Enum
+
+# conversion factor for the monotonic (nanosecond) deadlines
+NS_PER_SEC = 1_000_000_000
+
+# when a worker that has ended is started again
+class RestartPolicy(str, Enum):
+   never = 'never'
+   on_failure = 'on-failure'
+   always = 'always'
+
+# end reasons of a worker (endReason)
+END_STOP = 'stop'
+END_TIMER = 'timer'
+END_ERROR = 'error'
+
+
+class RestartSpec():
+    '''
+    Restart policy of a worker definition.
+    Parameters:
+        - `policy`: RestartPolicy
+        - `backoffSec`: delay before the first restart, doubled for every further
+                        failure in a row (the worker ran shorter than `stableSec`)
+        - `backoffMaxSec`: longest delay
+        - `maxRestarts`: restarts within `windowSec`, then the circuit breaker opens
+                         (no more restarts until the worker is started by hand)
+        - `windowSec`: window of the circuit breaker in seconds
+        - `stableSec`: runtime after which a worker counts as recovered (backoff reset)
+    '''
+    def __init__(self,
+                 policy = RestartPolicy.never.value,
+                 backoffSec = 1,
+                 backoffMaxSec = 60,
+                 maxRestarts = 5,
+                 windowSec = 60,
+                 stableSec = 30):
+        self.policy = policy
+        self.backoffSec = backoffSec
+        self.backoffMaxSec = backoffMaxSec
+        self.maxRestarts = maxRestarts
+        self.windowSec = windowSec
+        self.stableSec = stableSec
+
+    def restarts_on(self, endReason):
+        if self.policy == RestartPolicy.always.value:
+            return endReason in (END_TIMER, END_ERROR)
+        if self.policy == RestartPolicy.on_failure.value:
+            return endReason == END_ERROR
+        return False
+
+    def __repr__(self):
+        return (f'RestartSpec({self.policy}, backoff {self.backoffSec}..{self.backoffMaxSec} s, '
+                f'max {self.maxRestarts} restarts in {self.windowSec} s)')
+
+
+class SupervisionRecord():
+    '''
+    Restart history of one worker instance (kept over its restarts).
+    '''
+    __slots__ = ('restarts', 'crashes', 'lastException', 'lastEndReason',
+                 'failuresInRow', 'restartTimesNs', 'circuitOpen', 'pending')
+
+    def __init__(self):
+        self.restarts = 0
+        self.crashes = 0
+        self.lastException = None
+        self.lastEndReason = None
+        self.failuresInRow = 0
+        self.restartTimesNs = deque()
+        self.circuitOpen = False
+        # monotonic time of a scheduled restart (None: no restart pending)
+        self.pending = None
+
+    # status items of the worker
+    def get_status(self):
+        return {
+            'restarts': self.restarts,
+            'crashes': self.crashes,
+            'last-exception': self.lastException,
+            'circuit-open': self.circuitOpen,
+        }
+
+
+class Supervisor():
+    '''
+    Restarts workers that have ended, according to the restart policy of their definition.
+    Every worker reports its end (stop, timer end or exception) right away
+    (exit callback), the supervisor decides in that moment and starts the worker
+    again after the backoff delay; there is no polling of the workers.
+        - a stop requested by the user (or the shutdown) is never restarted
+        - `on-failure` restarts workers that ended with an exception,
+          `always` also workers whose timer ended
+        - the delay doubles with every failure in a row (up to backoffMaxSec)
+        - after maxRestarts restarts within windowSec the circuit breaker opens
+    A pending restart is a (non-daemon) timer thread, so a batch process whose
+    only worker has crashed does not end before the restart.
+    The restarts, crashes and the last exception are shown in the status of the worker.
+    Parameters:
+        - `restart`: callable(name, process) that starts the worker again
+                     (returns False if the worker was replaced or removed meanwhile)
+        - `specs`: dict of definition name -> RestartSpec (or a policy string)
+        - `default`: RestartSpec of definitions without an own one
+        - `definition_of`: callable(name) -> definition name of a worker instance
+        - `logger`: Logger object
+    '''
+    def __init__(self, restart, specs = None, default = None, definition_of = None, logger = None):
+        self.restart = restart
+        self.specs = {}
+        for definition, spec in (specs or {}).items():
+            self.set_spec(definition, spec)
+        self.default = default if default is not None else RestartSpec()
+        self.definition_of = definition_of if definition_of is not None else (lambda name: name)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.records = {}
+        # name -> timer thread of the pending restart
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.running_enabled = True
+
+    def set_spec(self, definition, spec):
+        if isinstance(spec, str):
+            spec = RestartSpec(policy=spec)
+        self.specs[definition] = spec
+
+    # restart spec of a definition: own spec, the `restartSpec` of the worker class, the default
+    def spec_for(self, definition, process = None):
+        spec = self.specs.get(definition)
+        if spec is None and process is not None:
+            spec = getattr(process, 'restartSpec', None)
+        return spec if spec is not None else self.default
+
+    def record(self, name):
+        with self.lock:
+            record = self.records.get(name)
+            if record is None:
+                record = self.records[name] = SupervisionRecord()
+            return record
+
+    # a worker is started or stopped by hand: no pending restart, closed circuit
+    # (the counters are kept)
+    def reset(self, name):
+        with self.lock:
+            timer = self.timers.pop(name, None)
+            if timer is not None:
+                timer.cancel()
+            record = self.records.get(name)
+            if record is not None:
+                record.pending = None
+                record.circuitOpen = False
+                record.failuresInRow = 0
+                record.restartTimesNs.clear()
+
+    # no more restarts (shutdown)
+    def stop(self):
+        with self.lock:
+            self.running_enabled = False
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers.clear()
+
+    # exit callback of the workers (runs in the thread of the ending worker)
+    def worker_exited(self, process):
+        nowNs = time.monotonic_ns()
+        name = process.name
+        endReason = process.endReason or END_STOP
+        spec = self.spec_for(self.definition_of(name), process)
+        record = self.record(name)
+        with self.lock:
+            record.lastEndReason = endReason
+            if endReason == END_ERROR:
+                record.crashes += 1
+                record.lastException = process.lastException
+            # stop requested by the user or the shutdown
+            if process.stopRequestNs is not None or not self.running_enabled or not spec.restarts_on(endReason):
+                delaySec = None
+            else:
+                delaySec = self.scheduleRestart(name, process, record, spec, endReason, nowNs)
+        # the last snapshot of the worker shows the crash and the circuit breaker
+        process.publishStatus()
+        if endReason == END_ERROR:
+            self.logger.error(f'Process {name} failed: {record.lastException}')
+        else:
+            self.logger.info(f'Process {name} ended ({endReason}).')
+        if record.circuitOpen:
+            self.logger.error(f'Process {name}: {spec.maxRestarts} restarts within {spec.windowSec} s, '
+                              'circuit breaker open, no more restarts.')
+            print(f'Process {name} is not restarted any more (circuit breaker open), please check its log.')
+        elif delaySec is not None:
+            self.logger.info(f'Process {name} will be restarted in {delaySec} s ({spec.policy}).')
+
+    # backoff and circuit breaker (called with the lock), returns the delay or None
+    def scheduleRestart(self, name, process, record, spec, endReason, nowNs):
+        # a worker that ran long enough has recovered, the backoff starts again
+        if endReason != END_ERROR or nowNs - process.startNs >= spec.stableSec * NS_PER_SEC:
+            record.failuresInRow = 0
+        windowStartNs = nowNs - int(spec.windowSec * NS_PER_SEC)
+        while record.restartTimesNs and record.restartTimesNs[0] < windowStartNs:
+            record.restartTimesNs.popleft()
+        if len(record.restartTimesNs) >= spec.maxRestarts:
+            record.circuitOpen = True
+            return None
+        delaySec = min(spec.backoffMaxSec, spec.backoffSec * 2 ** record.failuresInRow)
+        if endReason == END_ERROR:
+            record.failuresInRow += 1
+        record.pending = nowNs + int(delaySec * NS_PER_SEC)
+        timer = threading.Timer(delaySec, self.restartNow, args=(name, process))
+        timer.name = f'{name}-restart'
+        self.timers[name] = timer
+        timer.start()
+        return delaySec
+
+    # timer thread of a pending restart
+    def restartNow(self, name, process):
+        with self.lock:
+            if self.timers.get(name) is not threading.current_thread() or not self.running_enabled:
+                return
+            del self.timers[name]
+            record = self.records[name]
+            record.pending = None
+            # counted before the start, the first status of the new worker shows it
+            record.restartTimesNs.append(time.monotonic_ns())
+            record.restarts += 1
+        try:
+            restarted = self.restart(name, process)
+        except Exception:
+            self.logger.exception(f'Restart of process {name} failed')
+            restarted = False
+        if not restarted:
+            with self.lock:
+                record.restartTimesNs.pop()
+                record.restarts -= 1
+
+    def is_pending(self, name):
+        return name in self.timers
+
+    # restart state of all supervised instances
+    def get_status(self):
+        with self.lock:
+            return {name: dict(record.get_status(), pending=record.pending is not None)
+                    for name, record in self.records.items()}
@@ -0,0 +1,106 @@
+import os
+import zlib
+
+import pytest
+
+from checkpoint import Checkpoint, CheckpointError, CheckpointWriter, read_checkpoint, write_atomic, _header, _crc
+
+
+def make_checkpoint(**changes):
+    values = dict(name='tw1#0', savedAtNs=1_700_000_000_000_000_000, startedAtNs=1_699_999_000_000_000_000,
+                  iterations=12345, periodicJobs=7, jobsDone=3, timerMin=2.5,
+                  timerRemainingNs=90_000_000_000, state={'offset': 42, 'seen': ['a', 'b']})
+    values.update(changes)
+    return Checkpoint(**values)
+
+
+def assert_same(checkpoint, other):
+    assert vars(checkpoint) == vars(other)
+
+
+def test_round_trip():
+    checkpoint = make_checkpoint()
+    data = checkpoint.to_bytes()
+    assert data[:4] == b'BGWC'
+    assert_same(Checkpoint.from_bytes(data), checkpoint)
+
+
+def test_round_trip_without_timer_and_state():
+    checkpoint = make_checkpoint(timerMin=None, timerRemainingNs=None, state=None)
+    data = checkpoint.to_bytes()
+    assert len(data) == _header.size + len('tw1#0') + _crc.size
+    restored = Checkpoint.from_bytes(data)
+    assert restored.timerMin is None and restored.timerRemainingNs is None and restored.state is None
+    assert_same(restored, checkpoint)
+
+
+def test_crc_covers_every_byte():
+    data = make_checkpoint().to_bytes()
+    for offset in range(len(data)):
+        corrupt = bytearray(data)
+        corrupt[offset] ^= 0x01
+        with pytest.raises(CheckpointError):
+            Checkpoint.from_bytes(bytes(corrupt))
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'', 'truncated'),
+    (b'XXXX' + bytes(100), 'not a checkpoint'),
+])
+def test_invalid_files(data, message):
+    with pytest.raises(CheckpointError, match=message):
+        Checkpoint.from_bytes(data)
+
+
+def test_truncated_and_extended():
+    data = make_checkpoint().to_bytes()
+    with pytest.raises(CheckpointError, match='truncated'):
+        Checkpoint.from_bytes(data[:-1])
+    with pytest.raises(CheckpointError, match='truncated'):
+        Checkpoint.from_bytes(data + b'\x00')
+
+
+def test_other_version():
+    data = bytearray(make_checkpoint().to_bytes())
+    data[4:6] = (1).to_bytes(2, 'little')
+    end = len(data) - _crc.size
+    data[end:] = _crc.pack(zlib.crc32(data[:end]))
+    with pytest.raises(CheckpointError, match='unknown version 1'):
+        Checkpoint.from_bytes(bytes(data))
+
+
+def test_write_atomic_and_read(tmp_path):
+    path = str(tmp_path / 'shell-tw1.ckpt')
+    assert read_checkpoint(path) is None
+    first = make_checkpoint(iterations=1)
+    write_atomic(path, first.to_bytes())
+    second = make_checkpoint(iterations=2)
+    write_atomic(path, second.to_bytes())
+    # the temporary file is renamed, nothing is left next to the checkpoint
+    assert os.listdir(tmp_path) == ['shell-tw1.ckpt']
+    assert_same(read_checkpoint(path), second)
+
+
+def test_interrupted_write_keeps_the_old_checkpoint(tmp_path):
+    path = str(tmp_path / 'shell-tw1.ckpt')
+    checkpoint = make_checkpoint()
+    write_atomic(path, checkpoint.to_bytes())
+    # a crash before the rename leaves only a partial temporary file
+    with open(f'{path}.tmp', 'wb') as stream:
+        stream.write(make_checkpoint(iterations=99).to_bytes()[:20])
+    assert_same(read_checkpoint(path), checkpoint)
+
+
+def test_writer_coalesces_and_removes(tmp_path):
+    path = str(tmp_path / 'shell-tw1.ckpt')
+    writer = CheckpointWriter()
+    # a checkpoint that is not written yet is replaced by the next one
+    writer.pending[path] = make_checkpoint(iterations=1).to_bytes()
+    writer.put(path, make_checkpoint(iterations=2).to_bytes())
+    writer.stop()
+    assert read_checkpoint(path).iterations == 2
+    assert writer.get_status()['coalesced'] == 1
+    writer.put(path, None)
+    writer.stop()
+    assert not os.path.exists(path)
+    assert writer.get_status()['removed'] == 1
@@ -0,0 +1,123 @@
+import logging
+import os
+import socket
+import stat
+
+import pytest
+
+import cliengine
+from asyncbgworker import AsyncWorkerLoop
+from controlclient import ControlClient
+from controlserver import ControlServer
+
+
+@pytest.fixture
+def asyncLoop():
+    asyncLoop = AsyncWorkerLoop()
+    asyncLoop.start()
+    yield asyncLoop
+    asyncLoop.stop()
+
+
+@pytest.fixture
+def engine(tmp_path, asyncLoop):
+    engine = cliengine.cliEngine('test-control', {}, None, {'tw1': cliengine.TestBgWorker}, logging.getLogger('test-control'),
+                                 str(tmp_path / 'logs'), async_loop=asyncLoop, interactive=False)
+    yield engine
+    engine.do_exit('')
+
+
+@pytest.fixture
+def server(tmp_path, engine, asyncLoop):
+    server = ControlServer(engine, str(tmp_path / 'ctl.sock'), asyncLoop)
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_ping(server):
+    with ControlClient(server.path, timeout=5) as client:
+        response = client.request('ping')
+    assert response['ok']
+    assert response['result']['pong']
+    assert response['result']['pid'] == os.getpid()
+    assert response['result']['connections'] == 1
+
+
+def test_socket_is_private(server):
+    assert stat.S_ISSOCK(os.stat(server.path).st_mode)
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+
+
+def test_start_status_stop(server):
+    with ControlClient(server.path, timeout=5) as client:
+        response = client.request('start', name='tw1')
+        assert response['ok'], response
+        response = client.request('status', name='tw1')
+        assert response['ok'], response
+        assert 'iterations' in response['result']
+        response = client.request('stop', name='tw1')
+        assert response['ok'], response
+        assert response['result']['stopped'] == ['tw1']
+        response = client.request('status', name='tw1')
+    assert not response['ok']
+    assert response['error'] == 'Process tw1 is not running.'
+
+
+def test_pipelined_responses_keep_the_order(server):
+    requests = [
+        {'id': 'a', 'op': 'start', 'args': {'name': 'tw1'}},
+        {'id': 'b', 'op': 'status', 'args': {'name': 'tw1'}},
+        {'id': 'c', 'op': 'ping'},
+        {'id': 'd', 'op': 'list'},
+        {'id': 'e', 'op': 'stop', 'args': {'name': 'tw1'}},
+        {'id': 'f', 'op': 'status', 'args': {'name': 'tw1'}},
+    ]
+    with ControlClient(server.path, timeout=5) as client:
+        responses = client.pipeline(requests)
+    assert [response['id'] for response in responses] == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert [response['ok'] for response in responses] == [True, True, True, True, True, False]
+    assert responses[4]['result']['stopped'] == ['tw1']
+
+
+def test_invalid_requests(server):
+    with ControlClient(server.path, timeout=5) as client:
+        unknown = client.request('restart', name='tw1')
+        arguments = client.request('status', nome='tw1')
+        missing = client.request('start', name='tx1')
+        client.sock.sendall(b'not json\n')
+        invalid = client.reader.readline()
+    assert not unknown['ok']
+    assert unknown['error'].startswith('Unknown operation restart, valid are: start, stop,')
+    assert not arguments['ok']
+    assert arguments['error'].startswith('Invalid arguments for status:')
+    assert not missing['ok']
+    assert missing['error'] == 'Process tx1 does not exist or is not valid.'
+    assert invalid == b'{"id": null, "ok": false, "error": "Invalid JSON."}\n'
+
+
+def test_stop_removes_the_socket(tmp_path, server):
+    server.stop()
+    # the socket file and the private directory of the bind
+    assert not os.path.exists(server.path)
+    assert [name for name in os.listdir(tmp_path) if name.startswith('.control-')] == []
+    with pytest.raises(OSError):
+        ControlClient(server.path, timeout=5)
+
+
+def test_stale_socket_is_replaced(tmp_path, engine, asyncLoop):
+    path = str(tmp_path / 'ctl.sock')
+    # left over from a crashed process: nobody listens
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = ControlServer(engine, path, asyncLoop)
+    server.start()
+    try:
+        # another server listens: the socket is kept
+        with pytest.raises(FileExistsError):
+            ControlServer(engine, path, asyncLoop).start()
+        with ControlClient(path, timeout=5) as client:
+            assert client.request('ping')['ok']
+    finally:
+        server.stop()
@@ -0,0 +1,143 @@
+import random
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import logviewer
+from logviewer import LogFile, parse_since
+
+START = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def timestamp(second):
+    return (START + timedelta(seconds=second)).strftime('%Y-%m-%d %H:%M:%S,000').encode()
+
+
+# log records with a second each, some with traceback lines without a timestamp
+# and some with long messages (the lines cross the grep blocks)
+def make_lines(count, seed = 7):
+    generator = random.Random(seed)
+    lines = []
+    for second in range(count):
+        message = b'x' * generator.choice((1, 10, 50, 200))
+        level = b'ERROR' if second % 7 == 0 else b'INFO'
+        lines.append(timestamp(second) + b' - ' + level + b' - record ' + str(second).encode() + b' ' + message)
+        if second % 11 == 0:
+            lines.append(b'Traceback (most recent call last):')
+            lines.append(b'  ValueError: ERROR in line ' + str(second).encode())
+    return lines
+
+
+@pytest.fixture
+def log(tmp_path):
+    lines = make_lines(300)
+    path = tmp_path / 'shell.log'
+    path.write_bytes(b'\n'.join(lines) + b'\n')
+    return str(path), lines
+
+
+# lines from the record of `second` on
+def lines_from(lines, second):
+    prefix = timestamp(second)
+    return lines[next(index for index, line in enumerate(lines) if line.startswith(prefix)):]
+
+
+# offset of the first line of the record of `second`
+def record_offset(lines, second):
+    prefix = timestamp(second)
+    offset = 0
+    for line in lines:
+        if line.startswith(prefix):
+            return offset
+        offset += len(line) + 1
+    return offset
+
+
+@pytest.mark.parametrize('second', [0, 1, 11, 12, 150, 299])
+def test_find_since(log, second):
+    path, lines = log
+    with LogFile(path) as logFile:
+        assert logFile.find_since(timestamp(second)[:19]) == record_offset(lines, second)
+
+
+def test_find_since_outside_the_file(log):
+    path, lines = log
+    with LogFile(path) as logFile:
+        assert logFile.find_since(b'2024-04-30') == 0
+        assert logFile.find_since(timestamp(1000)[:19]) == logFile.size
+
+
+def test_find_since_between_records(log):
+    path, lines = log
+    with LogFile(path) as logFile:
+        # 12:00:10.5 is after the record of second 10
+        assert logFile.find_since(timestamp(10)[:19] + b',5') == record_offset(lines, 11)
+
+
+@pytest.mark.parametrize('blockSize', [1, 16, 63, 64, 65, 211, 212, 213, 1000, 1 << 20])
+def test_reverse_matches_at_block_boundaries(log, monkeypatch, blockSize):
+    path, lines = log
+    monkeypatch.setattr(logviewer, 'GREP_BLOCK_SIZE', blockSize)
+    pattern = re.compile(rb'ERROR')
+    expected = [line for line in reversed(lines) if pattern.search(line)]
+    with LogFile(path) as logFile:
+        assert list(logFile.reverse_matches(pattern, 0, logFile.size)) == expected
+        # from the middle of the file (a start found by find_since)
+        start = logFile.find_since(timestamp(100)[:19])
+        middle = [line for line in reversed(lines_from(lines, 100)) if pattern.search(line)]
+        assert list(logFile.reverse_matches(pattern, start, logFile.size)) == middle
+
+
+def test_reverse_matches_every_block_edge(tmp_path, monkeypatch):
+    lines = make_lines(12, seed=3)
+    path = tmp_path / 'small.log'
+    path.write_bytes(b'\n'.join(lines) + b'\n')
+    pattern = re.compile(rb'record 1|ValueError')
+    expected = [line for line in reversed(lines) if pattern.search(line)]
+    with LogFile(str(path)) as logFile:
+        # the edge of the first block falls on every offset of the file once
+        for blockSize in range(1, logFile.size + 2):
+            monkeypatch.setattr(logviewer, 'GREP_BLOCK_SIZE', blockSize)
+            assert list(logFile.reverse_matches(pattern, 0, logFile.size)) == expected, blockSize
+
+
+@pytest.mark.parametrize('blockSize', [1, 40, 64, 1 << 20])
+def test_match_is_checked_on_its_line(log, monkeypatch, blockSize):
+    path, lines = log
+    monkeypatch.setattr(logviewer, 'GREP_BLOCK_SIZE', blockSize)
+    # \s matches the newline: x at the end of a line and the start of a traceback
+    pattern = re.compile(rb'x\sTraceback')
+    with LogFile(path) as logFile:
+        assert list(logFile.reverse_matches(pattern, 0, logFile.size)) == []
+
+
+@pytest.mark.parametrize('blockSize', [16, 100, 1 << 20])
+def test_tail(log, monkeypatch, blockSize):
+    path, lines = log
+    monkeypatch.setattr(logviewer, 'GREP_BLOCK_SIZE', blockSize)
+    with LogFile(path) as logFile:
+        assert logFile.tail(5) == [line.decode() for line in lines[-5:]]
+        errors = [line.decode() for line in lines if b'ERROR' in line]
+        assert logFile.tail(4, re.compile(rb'ERROR')) == errors[-4:]
+        # (the traceback lines belong to the record above them)
+        recent = [line.decode() for line in lines_from(lines, 290) if b'ERROR' in line]
+        assert logFile.tail(1000, re.compile(rb'ERROR'), since=timestamp(290)[:19]) == recent
+        assert any(line.startswith('  ValueError') for line in recent)
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.log'
+    path.write_bytes(b'')
+    with LogFile(str(path)) as logFile:
+        assert logFile.tail(10) == []
+        assert logFile.find_since(b'2024') == 0
+
+
+def test_parse_since():
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    assert parse_since('90', now) == b'2024-05-01 11:58:30'
+    assert parse_since('1h', now) == b'2024-05-01 11:00:00'
+    assert parse_since('2024-04-30T08:15', now) == b'2024-04-30 08:15:00'
+    assert parse_since('09:30', now) == b'2024-05-01 09:30:00'
+    assert parse_since('yesterday', now) is None
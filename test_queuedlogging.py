@@ -0,0 +1,72 @@
+import logging
+
+import pytest
+
+from queuedlogging import FileQueueHandler, LogListener
+
+
+@pytest.fixture
+def listener():
+    listener = LogListener(maxsize=10, batchSize=5)
+    yield listener
+    listener.stop()
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [handler]
+    return logger
+
+
+def test_records_are_written(tmp_path):
+    listener = LogListener()
+    logger = make_logger('test-written', FileQueueHandler(str(tmp_path / 'a.log'), listener))
+    for index in range(25):
+        logger.info(f'record {index}')
+    listener.stop()
+    lines = (tmp_path / 'a.log').read_text().splitlines()
+    assert [line.rsplit(' - ', 1)[1] for line in lines] == [f'record {index}' for index in range(25)]
+    assert listener.get_status()['written'] == 25
+    assert listener.get_status()['dropped'] == 0
+
+
+def test_full_queue_drops_and_reports(tmp_path, listener, capsys):
+    logger = make_logger('test-dropped', FileQueueHandler(str(tmp_path / 'a.log'), listener))
+    listener.start()
+    # the listener can not write: the queue fills up
+    with listener.writeLock:
+        for index in range(30):
+            logger.info(f'record {index}')
+    listener.stop()
+    status = listener.get_status()
+    assert status['dropped'] >= 30 - 10 - listener.batchSize
+    assert status['written'] + status['dropped'] == 30
+    lines = (tmp_path / 'a.log').read_text().splitlines()
+    assert len(lines) == status['written'] + 1
+    assert f'WARNING - {status["dropped"]} log records were dropped' in lines[-1]
+    assert f'{status["dropped"]} log records were dropped' in capsys.readouterr().err
+
+
+def test_failed_writes_are_not_counted_as_written(tmp_path, listener, capsys):
+    good = FileQueueHandler(str(tmp_path / 'good.log'), listener)
+    bad = FileQueueHandler(str(tmp_path / 'missing' / 'bad.log'), listener)
+    logger = make_logger('test-failed', good)
+    logger.addHandler(bad)
+    for index in range(3):
+        logger.info(f'record {index}')
+    listener.stop()
+    status = listener.get_status()
+    assert status['written'] == 3
+    assert status['failed'] == 3
+    assert 'WARNING - 0 log records were dropped (queue full), 3 lines could not be written.' in (tmp_path / 'good.log').read_text()
+    assert '3 lines could not be written' in capsys.readouterr().err
+
+
+def test_no_report_without_loss(tmp_path, listener, capsys):
+    logger = make_logger('test-no-loss', FileQueueHandler(str(tmp_path / 'a.log'), listener))
+    logger.info('record')
+    listener.stop()
+    assert 'WARNING' not in (tmp_path / 'a.log').read_text()
+    assert capsys.readouterr().err == ''
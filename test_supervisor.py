@@ -0,0 +1,162 @@
+import logging
+import re
+import threading
+import time
+
+import pytest
+
+from supervisor import END_ERROR, END_STOP, END_TIMER, NS_PER_SEC, RestartPolicy, RestartSpec, Supervisor
+
+
+class FakeProcess():
+    '''
+    The attributes of a worker the supervisor reads when the worker has ended.
+    '''
+    def __init__(self, name, endReason = END_ERROR, runtimeSec = 0):
+        self.name = name
+        self.endReason = endReason
+        self.stopRequestNs = None
+        self.lastException = RuntimeError('failed') if endReason == END_ERROR else None
+        self.startNs = time.monotonic_ns() - int(runtimeSec * NS_PER_SEC)
+        self.published = 0
+
+    def publishStatus(self):
+        self.published += 1
+
+
+class Restarts():
+    '''
+    Restart callback of the supervisor, counts the restarts.
+    '''
+    def __init__(self, result = True):
+        self.result = result
+        self.names = []
+        self.condition = threading.Condition()
+
+    def __call__(self, name, process):
+        with self.condition:
+            self.names.append(name)
+            self.condition.notify_all()
+        return self.result
+
+    def wait(self, count, timeout = 2):
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.names) >= count, timeout)
+
+
+@pytest.fixture
+def restarts():
+    return Restarts()
+
+
+def make_supervisor(restarts, **spec):
+    return Supervisor(restarts, default=RestartSpec(**spec), logger=logging.getLogger('test-supervisor'))
+
+
+# delays of the scheduled restarts from the log
+def delays(caplog):
+    return [float(match.group(1)) for match in
+            (re.search(r'will be restarted in ([\d.]+) s', record.getMessage()) for record in caplog.records) if match]
+
+
+@pytest.mark.parametrize('policy, endReason, restarted', [
+    (RestartPolicy.never.value, END_ERROR, False),
+    (RestartPolicy.on_failure.value, END_ERROR, True),
+    (RestartPolicy.on_failure.value, END_TIMER, False),
+    (RestartPolicy.always.value, END_TIMER, True),
+    (RestartPolicy.always.value, END_STOP, False),
+])
+def test_policies(restarts, policy, endReason, restarted):
+    supervisor = make_supervisor(restarts, policy=policy, backoffSec=0.01)
+    process = FakeProcess('tw1', endReason)
+    supervisor.worker_exited(process)
+    assert restarts.wait(1, timeout=0.2) == restarted
+    assert process.published == 1
+    supervisor.stop()
+
+
+def test_requested_stop_is_not_restarted(restarts):
+    supervisor = make_supervisor(restarts, policy=RestartPolicy.always.value, backoffSec=0.01)
+    process = FakeProcess('tw1')
+    process.stopRequestNs = time.monotonic_ns()
+    supervisor.worker_exited(process)
+    assert not supervisor.is_pending('tw1')
+    assert supervisor.record('tw1').crashes == 1
+
+
+def test_backoff_doubles_up_to_the_max(restarts, caplog):
+    caplog.set_level(logging.INFO, logger='test-supervisor')
+    supervisor = make_supervisor(restarts, policy=RestartPolicy.on_failure.value,
+                                 backoffSec=0.01, backoffMaxSec=0.04, maxRestarts=10)
+    for count in range(1, 6):
+        supervisor.worker_exited(FakeProcess('tw1'))
+        assert restarts.wait(count)
+    assert delays(caplog) == [0.01, 0.02, 0.04, 0.04, 0.04]
+    status = supervisor.get_status()['tw1']
+    assert status['restarts'] == 5 and status['crashes'] == 5 and not status['circuit-open']
+
+
+def test_stable_worker_resets_the_backoff(restarts, caplog):
+    caplog.set_level(logging.INFO, logger='test-supervisor')
+    supervisor = make_supervisor(restarts, policy=RestartPolicy.on_failure.value,
+                                 backoffSec=0.01, maxRestarts=10, stableSec=30)
+    for count, runtimeSec in enumerate((0, 0, 60, 0), start=1):
+        supervisor.worker_exited(FakeProcess('tw1', runtimeSec=runtimeSec))
+        assert restarts.wait(count)
+    assert delays(caplog) == [0.01, 0.02, 0.01, 0.02]
+
+
+def test_circuit_breaker_opens_and_reset_closes_it(restarts):
+    supervisor = make_supervisor(restarts, policy=RestartPolicy.on_failure.value,
+                                 backoffSec=0.01, backoffMaxSec=0.01, maxRestarts=3, windowSec=60)
+    for count in range(1, 4):
+        supervisor.worker_exited(FakeProcess('tw1'))
+        assert restarts.wait(count)
+    # the 4th failure within the window opens the circuit
+    supervisor.worker_exited(FakeProcess('tw1'))
+    assert not supervisor.is_pending('tw1')
+    assert supervisor.get_status()['tw1']['circuit-open']
+    assert not restarts.wait(4, timeout=0.1)
+    # started by hand: the circuit is closed, the counters are kept
+    supervisor.reset('tw1')
+    assert not supervisor.get_status()['tw1']['circuit-open']
+    supervisor.worker_exited(FakeProcess('tw1'))
+    assert restarts.wait(4)
+    assert supervisor.get_status()['tw1']['restarts'] == 4
+
+
+def test_restarts_outside_the_window_do_not_count(restarts):
+    supervisor = make_supervisor(restarts, policy=RestartPolicy.on_failure.value,
+                                 backoffSec=0.01, backoffMaxSec=0.01, maxRestarts=2, windowSec=0.2)
+    for count in range(1, 3):
+        supervisor.worker_exited(FakeProcess('tw1'))
+        assert restarts.wait(count)
+    time.sleep(0.25)
+    supervisor.worker_exited(FakeProcess('tw1'))
+    assert restarts.wait(3)
+    assert not supervisor.get_status()['tw1']['circuit-open']
+
+
+def test_failed_restart_is_not_counted():
+    restarts = Restarts(result=False)
+    supervisor = make_supervisor(restarts, policy=RestartPolicy.on_failure.value, backoffSec=0.01)
+    supervisor.worker_exited(FakeProcess('tw1'))
+    assert restarts.wait(1)
+    # (the counters are taken back after the callback has returned)
+    deadline = time.monotonic() + 2
+    while supervisor.get_status()['tw1']['restarts'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert supervisor.get_status()['tw1']['restarts'] == 0
+    assert not supervisor.is_pending('tw1')
+
+
+def test_stop_cancels_pending_restarts(restarts):
+    supervisor = make_supervisor(restarts, policy=RestartPolicy.on_failure.value, backoffSec=0.2)
+    supervisor.worker_exited(FakeProcess('tw1'))
+    assert supervisor.is_pending('tw1')
+    supervisor.stop()
+    assert not supervisor.is_pending('tw1')
+    assert not restarts.wait(1, timeout=0.4)
+    # no restarts after the shutdown
+    supervisor.worker_exited(FakeProcess('tw1'))
+    assert not supervisor.is_pending('tw1')
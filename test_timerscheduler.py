@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from timerscheduler import TimerScheduler, NS_PER_SEC
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = TimerScheduler(name='test-scheduler')
+    yield scheduler
+    scheduler.stop()
+    if scheduler.is_alive():
+        scheduler.join(2)
+
+
+# callback that records its tag and sets `done` after `expected` calls
+def recorder(fired, expected, done):
+    lock = threading.Lock()
+
+    def make(tag):
+        def callback(handle):
+            with lock:
+                fired.append(tag)
+                if len(fired) == expected:
+                    done.set()
+        return callback
+    return make
+
+
+def test_fires_in_deadline_order(scheduler):
+    fired = []
+    done = threading.Event()
+    make = recorder(fired, 5, done)
+    nowNs = time.monotonic_ns()
+    # all due before the thread starts, they are fired in one pass
+    for offset in (30, 10, 50, 20, 40):
+        scheduler.schedule(nowNs - 100 * NS_PER_SEC + offset, make(offset))
+    scheduler.start()
+    assert done.wait(2)
+    assert fired == [10, 20, 30, 40, 50]
+    assert scheduler.get_status() == {'pending': 0, 'fired': 5, 'failed': 0}
+
+
+def test_same_deadline_fires_in_schedule_order(scheduler):
+    fired = []
+    done = threading.Event()
+    make = recorder(fired, 4, done)
+    dueNs = time.monotonic_ns()
+    for tag in 'abcd':
+        scheduler.schedule(dueNs, make(tag))
+    scheduler.start()
+    assert done.wait(2)
+    assert fired == list('abcd')
+
+
+def test_waits_for_the_deadline(scheduler):
+    fired = []
+    done = threading.Event()
+    make = recorder(fired, 2, done)
+    scheduler.start()
+    startNs = time.monotonic_ns()
+    scheduler.schedule_in(0.1, make('late'))
+    # an earlier entry wakes the sleeping scheduler
+    scheduler.schedule_in(0.02, make('early'))
+    assert done.wait(2)
+    assert fired == ['early', 'late']
+    assert time.monotonic_ns() - startNs >= 0.1 * NS_PER_SEC
+
+
+def test_cancelled_entries_do_not_fire(scheduler):
+    fired = []
+    done = threading.Event()
+    make = recorder(fired, 2, done)
+    dueNs = time.monotonic_ns()
+    first = scheduler.schedule(dueNs, make('first'))
+    cancelled = scheduler.schedule(dueNs, make('cancelled'))
+    scheduler.schedule(dueNs + 1, make('last'))
+    scheduler.cancel(cancelled)
+    # cancelling twice or None changes nothing
+    scheduler.cancel(cancelled)
+    scheduler.cancel(None)
+    assert scheduler.pending() == 2
+    scheduler.start()
+    assert done.wait(2)
+    assert fired == ['first', 'last']
+    assert first.fired and not cancelled.fired
+    # a fired entry can not be cancelled any more
+    scheduler.cancel(first)
+    assert scheduler.pending() == 0
+    assert scheduler.cancelled == 0
+
+
+def test_heap_is_compacted(scheduler):
+    dueNs = time.monotonic_ns() + 3600 * NS_PER_SEC
+    handles = [scheduler.schedule(dueNs + index, lambda handle: None) for index in range(100)]
+    for handle in handles[:70]:
+        scheduler.cancel(handle)
+    # compacted on the 65th cancel (more than 64 and more than half of the heap),
+    # the 5 entries cancelled afterwards stay until they reach the top
+    assert len(scheduler.heap) == 35
+    assert scheduler.cancelled == 5
+    assert scheduler.pending() == 30
+    assert scheduler.heap[0][2] is handles[65]
+
+
+def test_failing_callback_is_counted(scheduler):
+    fired = []
+    done = threading.Event()
+
+    def fail(handle):
+        raise RuntimeError('broken callback')
+
+    dueNs = time.monotonic_ns()
+    scheduler.schedule(dueNs, fail)
+    scheduler.schedule(dueNs + 1, recorder(fired, 1, done)('after'))
+    scheduler.start()
+    assert done.wait(2)
+    assert fired == ['after']
+    assert scheduler.get_status()['failed'] == 1
+    assert scheduler.is_alive()
@@ -0,0 +1,93 @@
+import math
+import random
+
+import pytest
+
+from workerstats import NS_PER_SEC, EwmaRate, LatencyHistogram
+
+
+# value at a percentile of sorted values (the same rank as the histogram)
+def exact_percentile(values, percent):
+    return values[max(1, math.ceil(percent / 100 * len(values))) - 1]
+
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentiles(50, 99) == [0, 0]
+    assert histogram.summary() == {'count': 0, 'mean': 0, 'p50': 0, 'p95': 0, 'p99': 0, 'max': 0}
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    values = list(range(1, 32))
+    for value in values:
+        histogram.record(value)
+    for percent in (1, 10, 50, 90, 99, 100):
+        assert histogram.percentiles(percent) == [exact_percentile(values, percent)]
+
+
+def test_bucket_bounds():
+    histogram = LatencyHistogram()
+    for index in range(histogram.lastIndex):
+        upper = histogram.upperBound(index)
+        assert histogram.index(upper) == index
+        assert histogram.index(upper + 1) == index + 1
+
+
+def test_percentiles_within_relative_error():
+    generator = random.Random(42)
+    histogram = LatencyHistogram(subBucketBits=4)
+    values = [int(generator.lognormvariate(12, 2)) for _ in range(20000)]
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    percents = (50, 90, 95, 99, 99.9)
+    for percent, value in zip(percents, histogram.percentiles(*percents)):
+        exact = exact_percentile(values, percent)
+        # the upper bound of the bucket: never below, at most 1/16 above
+        assert exact <= value <= exact * (1 + 1 / 16)
+    summary = histogram.summary()
+    assert summary['count'] == len(values)
+    assert summary['max'] == values[-1]
+    assert summary['mean'] == sum(values) / len(values)
+    assert summary['p50'] <= summary['p95'] <= summary['p99'] <= summary['max']
+
+
+def test_percentiles_in_any_order():
+    histogram = LatencyHistogram()
+    for value in range(1000):
+        histogram.record(value * 1000)
+    assert histogram.percentiles(99, 50) == list(reversed(histogram.percentiles(50, 99)))
+
+
+def test_out_of_range_values():
+    histogram = LatencyHistogram(maxExponent=20)
+    histogram.record(-5)
+    histogram.record(1 << 30)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[histogram.lastIndex] == 1
+    # (the last bucket is capped by the largest recorded value)
+    assert histogram.percentiles(100) == [1 << 30]
+    assert histogram.percentiles(50) == [0]
+
+
+def test_rate_is_not_seeded_from_a_short_interval():
+    rate = EwmaRate(10)
+    # 20 iterations per second, the first status 5 ms after the start (counter 1)
+    assert rate.update(0, 0) is None
+    assert rate.update(1, 5_000_000) is None
+    assert rate.update(10, NS_PER_SEC // 2) is None
+    # the seed is the average since the first update
+    assert rate.update(20, NS_PER_SEC) == 20
+    for second in range(2, 12):
+        assert rate.update(20 * second, second * NS_PER_SEC) == pytest.approx(20)
+
+
+def test_rate_follows_a_change():
+    rate = EwmaRate(10)
+    rate.update(0, 0)
+    rate.update(100, NS_PER_SEC)
+    # 10 s (one time constant) at 200/s: 1 - 1/e of the way
+    for second in range(2, 12):
+        rate.update(100 + 200 * (second - 1), second * NS_PER_SEC)
+    assert rate.rate == pytest.approx(200 - 100 / math.e)
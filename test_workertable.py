@@ -0,0 +1,98 @@
+import pytest
+
+from workertable import WorkerState, WorkerTable, has_wildcards, match_names
+
+
+class FakeWorker():
+    def __init__(self, name):
+        self.name = name
+
+
+def definition_of(name):
+    return name.partition('#')[0]
+
+
+@pytest.fixture
+def table():
+    table = WorkerTable(definition_of=definition_of)
+    for name in ('tw1', 'tw2#0', 'tw2#1', 'tw2#2', 'tx1', 'aw1'):
+        table[name] = FakeWorker(name)
+    return table
+
+
+@pytest.mark.parametrize('pattern, wildcards', [('tw1', False), ('tw*', True), ('tw?', True), ('tw[12]', True)])
+def test_has_wildcards(pattern, wildcards):
+    assert has_wildcards(pattern) == wildcards
+
+
+def test_match_names():
+    names = ['tw1', 'tw10', 'tw2#0', 'tx1']
+    assert match_names(names, 'tw1') == ['tw1']
+    assert match_names(names, 'tw?') == ['tw1']
+    assert match_names(names, 'tw*') == ['tw1', 'tw10', 'tw2#0']
+    assert match_names(names, 't[wx]1') == ['tw1', 'tx1']
+    assert match_names(names, 'tw2#*') == ['tw2#0']
+    assert match_names(names, 'nothing*') == []
+
+
+def test_select_by_pattern(table):
+    assert table.select() == ['tw1', 'tw2#0', 'tw2#1', 'tw2#2', 'tx1', 'aw1']
+    # a name without wildcards: the worker or the instances of a pool
+    assert table.select('tw1') == ['tw1']
+    assert table.select('tw2') == ['tw2#0', 'tw2#1', 'tw2#2']
+    assert table.select('tw2#1') == ['tw2#1']
+    assert table.select('tw9') == []
+    assert table.select('tw*') == ['tw1', 'tw2#0', 'tw2#1', 'tw2#2']
+    assert table.select('tw2#[02]') == ['tw2#0', 'tw2#2']
+    assert table.select('?w1') == ['tw1', 'aw1']
+
+
+def test_select_by_state(table):
+    table.set_state('tw2#1', WorkerState.restarting.value)
+    table.set_state('aw1', WorkerState.restarting.value)
+    assert table.select(state=WorkerState.restarting.value) == ['tw2#1', 'aw1']
+    assert table.select(state=WorkerState.running.value) == ['tw1', 'tw2#0', 'tw2#2', 'tx1']
+    assert table.select('tw2', WorkerState.running.value) == ['tw2#0', 'tw2#2']
+    assert table.select('tw*', WorkerState.restarting.value) == ['tw2#1']
+    assert table.state_of('tw2#1') == WorkerState.restarting.value
+    assert table.by_state(WorkerState.restarting.value) == {'tw2#1', 'aw1'}
+
+
+def test_delete_keeps_the_indexes(table):
+    del table['tw2#1']
+    del table['tw1']
+    assert table.instances_of('tw2') == ['tw2#0', 'tw2#2']
+    assert 'tw1' not in table.get_pools()
+    assert table.state_of('tw1') is None
+    assert 'tw1' not in table.by_state(WorkerState.running.value)
+    assert len(table) == 4
+
+
+def test_reap_finished_workers(table):
+    for name in ('tw1', 'tw2#0'):
+        table.worker_finished(table[name])
+    assert table.reap() == ['tw1', 'tw2#0']
+    assert table.select() == ['tw2#1', 'tw2#2', 'tx1', 'aw1']
+    # nothing finished: nothing to do
+    assert table.reap() == []
+
+
+def test_reap_keeps_pending_restarts(table):
+    pending = {'tw1'}
+    table.worker_finished(table['tw1'])
+    table.worker_finished(table['tx1'])
+    assert table.reap(keep=pending.__contains__) == ['tx1']
+    assert table.state_of('tw1') == WorkerState.restarting.value
+    # the restart was given up: removed on the next reap
+    pending.clear()
+    assert table.reap(keep=pending.__contains__) == ['tw1']
+    assert 'tw1' not in table
+
+
+def test_reap_skips_replaced_workers(table):
+    finished = table['tw1']
+    # restarted meanwhile, the new worker is running
+    table['tw1'] = FakeWorker('tw1')
+    table.worker_finished(finished)
+    assert table.reap() == []
+    assert table.state_of('tw1') == WorkerState.running.value
@@ -4,6 +4,19 @@ from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import threading
 import logging
+from types import MappingProxyType
+
+from queuedlogging import FileQueueHandler
+from workerstats import WorkerStats, stats_status, HOUSEKEEPING_SAMPLE
+from statushistory import StatusHistory
+from sampleprofiler import SamplingProfiler
+from jobqueue import JobQueue, QueueFullPolicy
+from pacing import Pacer, PaceMode, NO_WORK
+from checkpoint import Checkpoint, get_checkpoint_writer
+
+# conversion factors for the monotonic (nanosecond) deadlines
+NS_PER_SEC = 1_000_000_000
+NS_PER_MIN = 60 * NS_PER_SEC
 
 class ThreadingBgWorker(threading.Thread):
     '''
@@ -17,10 +30,46 @@ class ThreadingBgWorker(threading.Thread):
         - `event`: event to stop the worker
         - `timerMin`: time in minutes to run the worker
         - `slowDownSec`: time in seconds to slow down the worker
+                         (interruptible wait, stop and timer changes wake it up)
         - `periodicJobSec`: time in seconds to run a periodic job
         - `logging_on`: enable logging
         - `cli_name!`: name of the cli for different log file names
+        - `timezone`: timezone for the wall-clock values in the status
+        - `statusIntervalSec`: cadence in seconds to publish the status snapshot
+                               (None: only on state changes)
+        - `stats_on`: enable the hot-path instrumentation (latency histograms, rates)
+        - `queueSize`: capacity of the job queue (None: no job queue)
+        - `batchSize`: maximum number of jobs per taskForBatch call
+        - `batchWaitMs`: time in ms to collect more jobs after the first one
+        - `queueFullPolicy`: QueueFullPolicy for submissions to a full queue
+        - `historySize`: number of samples in the status history (None: no history)
+        - `historyIntervalSec`: time in seconds between two history samples
+        - `paceMode`: pacing of the loop (PaceMode): `fixed` waits slowDownSec,
+                      `rate` runs `rateHz` iterations per second on a drift-free schedule,
+                      `adaptive` backs off up to `idleBackoffMaxSec` while taskForIteration
+                      returns NO_WORK (False)
+        - `rateHz`: target rate of the `rate` mode
+        - `idleBackoffMaxSec`: longest idle wait of the `adaptive` mode
+    All loop decisions (timer, periodic job, runtime) are based on
+    monotonic deadlines, wall-clock values are only rendered for the status.
+    With a TimerScheduler attached (attach_scheduler), the timer and the periodic
+    job are registered at the central scheduler and the loop only checks flags.
+    The worker publishes its status as an immutable snapshot (with a version number),
+    get_status() returns the latest snapshot without building or logging anything.
+    With a job queue, submitted jobs are handed to taskForBatch in batches, an idle
+    worker blocks on the queue instead of the slow-down wait (slowDownSec is then
+    the longest idle wait). The instances of a pool share one queue (attach_queue).
+    With the status snapshots, the worker samples its counter, rate and iteration
+    latency into a fixed-size ring buffer (StatusHistory, get_history()).
+    The pacing can be changed at runtime (set_pace), the current wait ends then.
+    With a checkpoint file attached (attach_checkpoint), the counters, the start time,
+    the rest of the timer and the value of checkpointState() are saved with the status
+    snapshots (at most every `intervalSec`) and at the end; restore_checkpoint()
+    continues a worker from it (the state of the child class goes to restoreState).
     '''
+    # restart policy of the worker class (supervisor.RestartSpec), None: the default of the supervisor
+    restartSpec = None
+
     def __init__(self,
                  name,
                  event,
@@ -29,31 +78,98 @@ class ThreadingBgWorker(threading.Thread):
                  periodicJobSec = None,
                  logging_on = True,
                  cli_name = None,
-                 log_directory = './logs'):
+                 log_directory = './logs',
+                 timezone = 'Europe/Paris',
+                 statusIntervalSec = 1,
+                 stats_on = False,
+                 queueSize = None,
+                 batchSize = 100,
+                 batchWaitMs = 10,
+                 queueFullPolicy = QueueFullPolicy.block.value,
+                 historySize = 720,
+                 historyIntervalSec = 5,
+                 paceMode = PaceMode.fixed.value,
+                 rateHz = None,
+                 idleBackoffMaxSec = 1.0):
         
-        super().__init__()
+        self.initThread()
         self.name = name
         self.no_more_running = event
         self.running = False
         self.running_enabled = True
+        # wakes the worker from its slow-down wait (stop, timer changes)
+        self.wakeup = threading.Event()
+        self.stopRequestNs = None
+        self.stopLatencyNs = None
+        self.forceStopped = False
+        # why the worker has ended (stop, timer, error) and the exception of an error
+        self.endReason = None
+        self.lastException = None
+        # called with the worker when it has ended (e.g. Supervisor.worker_exited)
+        self.exitCallbacks = []
+        # restart history of the supervisor (SupervisionRecord), shown in the status
+        self.supervision = None
+        # central scheduler (optional) and the handles of the registered deadlines
+        self.scheduler = None
+        self.timerHandle = None
+        self.periodicJobHandle = None
+        self.timerDue = False
+        self.periodicJobDue = False
+        # published status snapshot (read-only mapping) and its version
+        self.statusIntervalSec = statusIntervalSec
+        self.statusLock = threading.Lock()
+        self.statusSnapshot = None
+        self.statusVersion = 0
+        self.statusNextNs = None
+        self.statusHandle = None
+        self.statusDue = False
+        # hot-path instrumentation (None: disabled)
+        self.stats = WorkerStats() if stats_on else None
+        # input queue (optional) for taskForBatch
+        self.jobQueue = JobQueue(queueSize, queueFullPolicy) if queueSize else None
+        self.batchSize = batchSize
+        self.batchWaitSec = batchWaitMs / 1000
+        self.jobsDone = 0
+        # sampled metrics (optional), recorded when a status snapshot is published
+        self.history = StatusHistory(historySize) if historySize else None
+        self.historyIntervalSec = historyIntervalSec
+        self.historyNextNs = 0
+        # checkpoint file (optional), written by the CheckpointWriter thread
+        self.checkpointPath = None
+        self.checkpointIntervalSec = None
+        self.checkpointNextNs = 0
+        self.checkpointWriter = None
         self.pid = None
         self.thread_id = None
+        # ident of the worker thread (key of sys._current_frames for the profiler)
+        self.thread_ident = None
         self.iterations = 0
+        self.periodicJobs = 0
         self.slowDownSec = slowDownSec
+        # pacing of the loop (None: fixed slow-down), the version ends a running wait on a change
+        self.pacer = None
+        self.paceVersion = 0
+        if paceMode != PaceMode.fixed.value:
+            self.pacer = self.makePacer(paceMode, rateHz=rateHz, idleMaxSec=idleBackoffMaxSec)
         self.periodicJobSec = periodicJobSec
         self.cli_name = cli_name
-        self.starttime = datetime.now(ZoneInfo('Europe/Paris'))
+        self.timezone = ZoneInfo(timezone)
+        # monotonic start is the base for all deadlines,
+        # the wall-clock start is only used to render times for the status
+        self.startNs = time.monotonic_ns()
+        self.stopNs = None
+        self.starttime = datetime.now(self.timezone)
         # How often to process a periodic job
         self.periodicJobSec = periodicJobSec
+        self.periodicJobNextNs = None
         if self.periodicJobSec:
-            self.periodicJobLastTime = datetime.now(ZoneInfo('Europe/Paris'))
-            self.periodicJobNextTime = self.periodicJobLastTime + timedelta(seconds=self.periodicJobSec)
+            self.periodicJobNextNs = self.startNs + int(self.periodicJobSec * NS_PER_SEC)
         self.runtime = None
-        self.timeToStop = None
+        self.timeToStopNs = None
         self.lastStatus = None
         self.timerMin = timerMin
         if self.timerMin:
-            self.timeToStop = self.starttime + timedelta(minutes=self.timerMin)
+            self.timeToStopNs = self.startNs + int(self.timerMin * NS_PER_MIN)
         self.calculateRuntime()
 
         self.logging_on = logging_on
@@ -65,20 +181,17 @@ class ThreadingBgWorker(threading.Thread):
             # check if handler of the logger already exists
             if not logger.hasHandlers():
 
-                # create file handler for this worker
+                # create (queued) file handler for this worker,
+                # the file is written by the log listener thread
 
                 if not os.path.exists(log_directory):
                     os.makedirs(log_directory)
                 if self.cli_name:
-                    fh = logging.FileHandler(f'{log_directory}/{self.cli_name}-{self.name}.log')
+                    fh = FileQueueHandler(f'{log_directory}/{self.cli_name}-{self.name}.log')
                 else:
-                    fh = logging.FileHandler(f'{log_directory}/{self.name}.log')
+                    fh = FileQueueHandler(f'{log_directory}/{self.name}.log')
                 fh.setLevel(logging.INFO)
 
-                # create formatter and add it to the handler
-                formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-                fh.setFormatter(formatter)
-
                 # add the handler to the logger
                 logger.addHandler(fh)
 
@@ -88,6 +201,136 @@ class ThreadingBgWorker(threading.Thread):
             # log the start of the worker
             self.loggi.info(f'Worker {self.name} started. Worker status at start:')
 
+    # state of threading.Thread (a backend without an own thread skips it)
+    def initThread(self):
+        threading.Thread.__init__(self)
+
+    # wall-clock time of the timer end (derived from the monotonic deadline)
+    @property
+    def timeToStop(self):
+        if self.timeToStopNs is None:
+            return None
+        return self.wallclock(self.timeToStopNs)
+
+    # convert a monotonic timestamp of this worker into a wall-clock datetime
+    def wallclock(self, ns):
+        return self.starttime + timedelta(microseconds=(ns - self.startNs) // 1000)
+
+    # register timer and periodic job at a central scheduler (call before start)
+    def attach_scheduler(self, scheduler):
+        self.scheduler = scheduler
+
+    # share the job queue of a pool (call before start)
+    def attach_queue(self, jobQueue):
+        self.jobQueue = jobQueue
+
+    # save checkpoints to `path`, at most every `intervalSec` seconds and at the end (call before start)
+    def attach_checkpoint(self, path, intervalSec, writer = None):
+        self.checkpointPath = path
+        self.checkpointIntervalSec = intervalSec
+        self.checkpointNextNs = time.monotonic_ns() + int(intervalSec * NS_PER_SEC)
+        self.checkpointWriter = writer if writer is not None else get_checkpoint_writer()
+
+    def restore_checkpoint(self, checkpoint):
+        '''
+        Continue from a checkpoint of a previous run (call before start).
+        The counters are restored, the start time is the one of the first run
+        (the runtime contains the time the worker was down) and the timer runs
+        for the rest it had at the checkpoint. The state of the child class
+        is handed to restoreState().
+        '''
+        nowNs = time.monotonic_ns()
+        self.iterations = checkpoint.iterations
+        self.periodicJobs = checkpoint.periodicJobs
+        self.jobsDone = checkpoint.jobsDone
+        self.starttime = datetime.fromtimestamp(checkpoint.startedAtNs / NS_PER_SEC, self.timezone)
+        self.startNs = nowNs - (time.time_ns() - checkpoint.startedAtNs)
+        self.timerMin = checkpoint.timerMin
+        self.timeToStopNs = None if checkpoint.timerRemainingNs is None else nowNs + checkpoint.timerRemainingNs
+        if checkpoint.state is not None:
+            self.restoreState(checkpoint.state)
+        if self.logging_on:
+            self.loggi.info(f'Restored from {checkpoint}, will stop at: {self.timeToStop}.')
+
+    # submit a job, raises queue.Full if the queue rejects it
+    def submit(self, item, timeoutSec = None):
+        if self.jobQueue is None:
+            raise ValueError(f'worker {self.name} has no job queue')
+        self.jobQueue.put(item, timeoutSec)
+
+    # submit several jobs, returns the number of accepted jobs
+    def submit_many(self, items, timeoutSec = None):
+        if self.jobQueue is None:
+            raise ValueError(f'worker {self.name} has no job queue')
+        return self.jobQueue.put_many(items, timeoutSec)
+
+    # wake the worker from its slow-down wait or its wait for jobs
+    def wake(self):
+        self.wakeup.set()
+        if self.jobQueue is not None:
+            self.jobQueue.interrupt()
+
+    # (re-)register the timer deadline at the scheduler
+    def armTimer(self):
+        if self.scheduler is None:
+            return
+        oldHandle = self.timerHandle
+        if self.timeToStopNs is not None:
+            self.timerHandle = self.scheduler.schedule(self.timeToStopNs, self.timerFired)
+        else:
+            self.timerHandle = None
+        self.scheduler.cancel(oldHandle)
+        self.timerDue = False
+
+    # register the next periodic job at the scheduler
+    def armPeriodicJob(self):
+        if self.scheduler is None or not self.periodicJobSec:
+            return
+        self.periodicJobHandle = self.scheduler.schedule(self.periodicJobNextNs, self.periodicJobFired)
+
+    # register the next status publishing at the scheduler
+    def armStatus(self):
+        if self.scheduler is None or self.statusNextNs is None:
+            return
+        self.statusHandle = self.scheduler.schedule(self.statusNextNs, self.statusFired)
+
+    # remove all deadlines of this worker from the scheduler
+    def disarmScheduler(self):
+        if self.scheduler is None:
+            return
+        self.scheduler.cancel(self.timerHandle)
+        self.scheduler.cancel(self.periodicJobHandle)
+        self.scheduler.cancel(self.statusHandle)
+        self.timerHandle = None
+        self.periodicJobHandle = None
+        self.statusHandle = None
+
+    # scheduler callback (scheduler thread): timer end reached
+    def timerFired(self, handle):
+        if handle is self.timerHandle:
+            self.timerDue = True
+            self.wake()
+
+    # scheduler callback (scheduler thread): periodic job is due
+    def periodicJobFired(self, handle):
+        if handle is self.periodicJobHandle:
+            self.periodicJobDue = True
+            # next deadline is based on the previous one (no drift)
+            self.periodicJobNextNs = handle.dueNs + int(self.periodicJobSec * NS_PER_SEC)
+            self.armPeriodicJob()
+            # an idle worker waits for jobs, the periodic job must not wait for them
+            if self.jobQueue is not None:
+                self.wake()
+
+    # scheduler callback (scheduler thread): status snapshot is due,
+    # it is published by the worker thread (also from its slow-down wait)
+    def statusFired(self, handle):
+        if handle is self.statusHandle:
+            self.statusDue = True
+            self.statusNextNs = handle.dueNs + int(self.statusIntervalSec * NS_PER_SEC)
+            self.armStatus()
+            self.wake()
+
     # stop request will be checked for every iteration to stop the thread cleanly
     def askForStop(self):
         # if self.logging_on:
@@ -100,25 +343,71 @@ class ThreadingBgWorker(threading.Thread):
     # run the thread
     def run(self):
         self.running = True
-        self.running_enabled = True
         self.pid = os.getpid()
         self.thread_id = threading.current_thread().native_id
-        self.iterations = 0
+        self.thread_ident = threading.get_ident()
+        if self.statusIntervalSec:
+            self.statusNextNs = time.monotonic_ns() + int(self.statusIntervalSec * NS_PER_SEC)
+        self.armTimer()
+        self.armPeriodicJob()
+        self.armStatus()
         print(f'Starting for: {self.timerMin} minutes, will stop at: {self.timeToStop}.')
         if self.logging_on:
             self.loggi.info(f'Starting for: {self.timerMin} minutes, will stop at: {self.timeToStop}.')
-        self.addToJobRun()
-        self.doJob()
+        try:
+            self.addToJobRun()
+            self.publishStatus()
+            self.doJob()
+        except Exception as exc:
+            # the worker ends, the supervisor decides about a restart
+            self.endReason = 'error'
+            self.lastException = repr(exc)
+            if self.logging_on:
+                self.loggi.exception(f'Worker {self.name} failed')
+            self.disarmScheduler()
+            self.stopNs = time.monotonic_ns()
+            self.finishCheckpoint()
+            self.running = False
+            self.publishStatus()
+            self.no_more_running.set()
+        finally:
+            self.notifyExit()
+
+    # register a callable(worker) that is called when the worker has ended
+    def add_exit_callback(self, callback):
+        self.exitCallbacks.append(callback)
+
+    def notifyExit(self):
+        for callback in list(self.exitCallbacks):
+            try:
+                callback(self)
+            except Exception:
+                if self.logging_on:
+                    self.loggi.exception('Exit callback failed')
 
     # place request for stop the thread
     def stop(self):
         if self.logging_on:
-            self.loggi.info(f'stop request: {self.running_enabled} at {datetime.now(ZoneInfo("Europe/Paris"))}')
+            self.loggi.info(f'stop request: {self.running_enabled} at {datetime.now(self.timezone)}')
+        if self.stopRequestNs is None:
+            self.stopRequestNs = time.monotonic_ns()
+        self.running_enabled = False
+        self.wake()
+        self.publishStatus()
+
+    # escalation of a missed stop deadline: run the stop tasks from the calling thread
+    def force_stop(self):
+        if self.logging_on:
+            self.loggi.warning(f'force stop at {datetime.now(self.timezone)}')
         self.running_enabled = False
+        self.forceStopped = True
+        self.taskForStop()
+        self.log_status()
+        self.no_more_running.set()
 
     # get the runtime of the thread
     def get_runtime(self):
-        return self.runtime
+        return self.calculateRuntime()
 
     # get process id of the thread
     def get_pid(self):
@@ -126,20 +415,174 @@ class ThreadingBgWorker(threading.Thread):
     
     def log_status(self):
         if self.logging_on:
-            staust = self.get_status()
+            staust = self.publishStatus()
             for key, value in staust.items():
                 self.loggi.info(f'  {key}: {value}')
         
-    # get the status of the thread
+    # get the status of the thread: the latest published snapshot (read-only mapping)
     def get_status(self):
+        snapshot = self.statusSnapshot
+        if snapshot is None:
+            return self.publishStatus()
+        return snapshot
+
+    # switch the hot-path instrumentation on or off (at runtime)
+    def set_stats(self, on = True):
+        if on and self.stats is None:
+            self.stats = WorkerStats()
+        elif not on:
+            self.stats = None
+
+    # full summary of the instrumentation (values in ns), None if disabled
+    def get_stats(self):
+        stats = self.stats
+        if stats is None:
+            return None
+        return stats.summary()
+
+    # part of the instrumentation for the status
+    def collectStatsStatus(self, nowNs):
+        stats = self.stats
+        if stats is None:
+            return {}
+        stats.updateRates(self.iterations, nowNs)
+        return stats_status(stats.statusSummary())
+
+    # version of the latest snapshot, consumers can skip unchanged workers
+    def get_status_version(self):
+        return self.statusVersion
+
+    # build a new status snapshot and publish it
+    def publishStatus(self, nowNs = None):
+        with self.statusLock:
+            if nowNs is None:
+                nowNs = time.monotonic_ns()
+            message = self.buildStatus(nowNs)
+            self.statusVersion += 1
+            message['status-version'] = self.statusVersion
+            self.statusSnapshot = MappingProxyType(message)
+            self.recordHistory(nowNs)
+            if self.statusIntervalSec and self.scheduler is None:
+                self.statusNextNs = nowNs + int(self.statusIntervalSec * NS_PER_SEC)
+            return self.statusSnapshot
+
+    # sample the stack of the worker thread for `durationSec` seconds,
+    # the collapsed stacks are written to `path` (see SamplingProfiler)
+    def start_profile(self, durationSec, rateHz = 100, path = None):
+        threadIdent = self.profileThreadIdent()
+        if threadIdent is None:
+            raise RuntimeError(f'worker {self.name} has no running thread to profile')
+        profiler = SamplingProfiler(threadIdent, durationSec, rateHz, path,
+                                    stackFilter=self.profileStackFilter(),
+                                    onDone=self.profileDone,
+                                    name=f'{self.name}-profiler')
+        profiler.start()
+        return profiler
+
+    # thread sampled by the profiler
+    def profileThreadIdent(self):
+        return self.thread_ident
+
+    # filter for the sampled stacks (None: every stack of the thread)
+    def profileStackFilter(self):
+        return None
+
+    # report of a finished profiling (runs in the profiler thread)
+    def profileDone(self, profiler):
+        if profiler.error is not None:
+            message = f'Profiling of {self.name} failed: {profiler.error!r}'
+        else:
+            summary = profiler.summary()
+            message = (f'Profiling of {self.name} done: {summary["samples"]} samples in {summary["elapsed-sec"]} s, '
+                       f'sampling overhead {summary["overhead-percent"]} % of one core, stacks in {summary["path"]}')
+        print(message)
         if self.logging_on:
-            self.loggi.info(f'ask for status at {datetime.now(ZoneInfo("Europe/Paris"))}')
+            self.loggi.info(message)
+            for label, samples in profiler.top():
+                self.loggi.info(f'  {samples:>7} {label}')
+
+    # add a sample to the history if it is due (called with the status lock)
+    def recordHistory(self, nowNs):
+        history = self.history
+        if history is None or nowNs < self.historyNextNs:
+            return
+        self.historyNextNs = nowNs + int(self.historyIntervalSec * NS_PER_SEC)
+        latencyCount, latencySumNs = self.iterationLatencyTotals()
+        history.record(time.time_ns(), self.iterations, latencyCount, latencySumNs)
+
+    # number and total duration (ns) of the measured iterations
+    def iterationLatencyTotals(self):
+        stats = self.stats
+        if stats is None:
+            return 0, 0
+        return stats.iteration.count, stats.iteration.sum
+
+    # samples of the status history (oldest first), None if the history is disabled
+    def get_history(self, sinceNs = None):
+        if self.history is None:
+            return None
+        with self.statusLock:
+            return self.history.samples(sinceNs)
+
+    # publish the status if the cadence is due (and save a checkpoint if that is due as well)
+    def checkForPublishStatus(self, nowNs = None):
+        if self.scheduler is not None:
+            if self.statusDue:
+                self.statusDue = False
+                self.publishStatus()
+                self.checkForCheckpoint()
+        elif self.statusNextNs is not None and nowNs >= self.statusNextNs:
+            self.publishStatus(nowNs)
+            self.checkForCheckpoint(nowNs)
+
+    # save a checkpoint if the interval is over (in the thread of the worker)
+    def checkForCheckpoint(self, nowNs = None):
+        if self.checkpointPath is None:
+            return
+        if nowNs is None:
+            nowNs = time.monotonic_ns()
+        if nowNs < self.checkpointNextNs:
+            return
+        self.checkpointNextNs = nowNs + int(self.checkpointIntervalSec * NS_PER_SEC)
+        self.saveCheckpoint(nowNs)
+
+    # hand the checkpoint to the writer thread (the file is written there)
+    def saveCheckpoint(self, nowNs):
+        try:
+            checkpoint = Checkpoint(name=self.name,
+                                    savedAtNs=time.time_ns(),
+                                    startedAtNs=int(self.starttime.timestamp() * NS_PER_SEC),
+                                    iterations=self.iterations,
+                                    periodicJobs=self.periodicJobs,
+                                    jobsDone=self.jobsDone,
+                                    timerMin=self.timerMin,
+                                    timerRemainingNs=None if self.timeToStopNs is None else max(0, self.timeToStopNs - nowNs),
+                                    state=self.checkpointState())
+            data = checkpoint.to_bytes()
+        except Exception:
+            if self.logging_on:
+                self.loggi.exception(f'Checkpoint of {self.name} failed')
+            return
+        self.checkpointWriter.put(self.checkpointPath, data)
+
+    # last checkpoint at the end: kept for a resume after a stop or an error,
+    # a worker that has reached its timer end has nothing to resume
+    def finishCheckpoint(self):
+        if self.checkpointPath is None:
+            return
+        if self.endReason == 'timer':
+            self.checkpointWriter.put(self.checkpointPath, None)
+        else:
+            self.saveCheckpoint(self.stopNs if self.stopNs is not None else time.monotonic_ns())
 
+    # collect the status items of the worker
+    def buildStatus(self, nowNs):
         message = {}
+        self.lastStatus = str(self.wallclock(nowNs).replace(microsecond=0, tzinfo=None).isoformat(' '))
 
-        if self.timerMin:
+        if self.timerMin and self.timeToStopNs is not None:
             timeToStop_value = str(self.timeToStop.replace(microsecond=0, tzinfo=None).isoformat(' '))
-            diff_minutes = round((self.timeToStop - datetime.now(ZoneInfo('Europe/Paris'))).total_seconds() / 60, 1)
+            diff_minutes = round((self.timeToStopNs - nowNs) / NS_PER_MIN, 1)
             timer_value = f'{diff_minutes} / {self.timerMin} min'
         else:
             timeToStop_value = None
@@ -148,24 +591,60 @@ class ThreadingBgWorker(threading.Thread):
 
         parentStats = {
             'worker': self.name,
-            'process-id': os.getpid(),
+            'process-id': self.pid if self.pid else os.getpid(),
             'running': self.running,
             'running-enabled': self.running_enabled,
+            'stop-latency-ms': None if self.stopLatencyNs is None else round(self.stopLatencyNs / 1_000_000, 3),
             # 'thread-id': threading.current_thread().native_id,
             'counter': str(self.iterations),
             'started-at': str(self.starttime.replace(microsecond=0, tzinfo=None).isoformat(' ')),
             'last-state-at': self.lastStatus,
-            'runtime': self.runtime,
+            'runtime': self.calculateRuntime(),
+            'runtime-sec': round(((self.stopNs if self.stopNs is not None else nowNs) - self.startNs) / NS_PER_SEC, 3),
             'timer': timer_value,
+            'timer-remaining-sec': None if diff_minutes is None else round((self.timeToStopNs - nowNs) / NS_PER_SEC, 1),
             'will-stop-at': timeToStop_value,
             'slow-down': str(self.slowDownSec),
-            'periodic-job-evry-sec': str(self.periodicJobSec)
+            **self.collectPaceStatus(),
+            'periodic-job-evry-sec': str(self.periodicJobSec),
+            'periodic-jobs': self.periodicJobs,
+            'end-reason': self.endReason
         }
 
         message.update(parentStats)
-        message.update(self.specificStatus())
-        self.lastStatus = str(datetime.now(ZoneInfo('Europe/Paris')).replace(microsecond=0, tzinfo=None).isoformat(' '))
-        return message.copy()
+        message.update(self.collectStatsStatus(nowNs))
+        message.update(self.collectQueueStatus())
+        message.update(self.collectSupervisionStatus())
+        message.update(self.collectSpecificStatus())
+        return message
+
+    # pacing mode and its state
+    def collectPaceStatus(self):
+        if self.pacer is None:
+            return {'pace': PaceMode.fixed.value}
+        return self.pacer.get_status()
+
+    # status of the job queue (shared by a pool) and the jobs done by this worker
+    def collectQueueStatus(self):
+        if self.jobQueue is None:
+            return {}
+        message = self.jobQueue.get_status()
+        message['jobs-done'] = self.jobsDone
+        return message
+
+    # restarts, crashes and last exception (only for supervised workers)
+    def collectSupervisionStatus(self):
+        if self.supervision is None:
+            return {}
+        message = self.supervision.get_status()
+        if self.lastException is not None:
+            message['last-exception'] = self.lastException
+        return message
+
+    # specific status-items for get_status (overwritten by backends that
+    # collect them from elsewhere, e.g. from a child process)
+    def collectSpecificStatus(self):
+        return self.specificStatus()
 
     # add user defined intialization to the process
     def addToJobRun(self):
@@ -204,6 +683,16 @@ class ThreadingBgWorker(threading.Thread):
         '''
         Method is to programm in child class.
         Things to do during a single iteration of the process 
+        (return NO_WORK if there was nothing to do, the adaptive pace backs off then)
+        '''
+        pass
+
+    # tasks to do with a batch of jobs from the job queue
+    def taskForBatch(self, items):
+        '''
+        Method is to programm in child class.
+        Things to do with the submitted jobs (list of up to batchSize items),
+        only called for workers with a job queue (queueSize).
         '''
         pass
 
@@ -215,23 +704,59 @@ class ThreadingBgWorker(threading.Thread):
         '''
         pass
 
-    def periodicJobEnabled(self):
+    # progress of the child class for the checkpoint
+    def checkpointState(self):
+        '''
+        Method is to programm in child class.
+        Progress to keep over a restart (a picklable value, e.g. a dict),
+        None: nothing to keep. Called in the thread of the worker.
+        '''
+        return None
+
+    # restore the progress of the child class from a checkpoint
+    def restoreState(self, state):
+        '''
+        Method is to programm in child class.
+        Gets the value of checkpointState() of the previous run,
+        called before the worker starts (before addToJobRun).
+        '''
+        pass
+
+    def periodicJobEnabled(self, nowNs = None):
         if self.periodicJobSec:
-            if (datetime.now(ZoneInfo('Europe/Paris')) >= self.periodicJobNextTime):
-                self.periodicJobLastTime = datetime.now(ZoneInfo('Europe/Paris'))
-                self.periodicJobNextTime = self.periodicJobLastTime + timedelta(seconds=self.periodicJobSec)
+            if self.scheduler is not None:
+                # the scheduler sets the flag when the job is due
+                if self.periodicJobDue:
+                    self.periodicJobDue = False
+                    return True
+                return False
+            if nowNs is None:
+                nowNs = time.monotonic_ns()
+            if nowNs >= self.periodicJobNextNs:
+                self.periodicJobNextNs = nowNs + int(self.periodicJobSec * NS_PER_SEC)
                 return True
             else:
                 return False
         else:
             return False
 
-    def checkForStartPeriodicJob(self):
-        if self.periodicJobEnabled():
-            self.taskForPeriodicJob()
+    def checkForStartPeriodicJob(self, nowNs = None):
+        if self.periodicJobEnabled(nowNs):
+            self.periodicJobs += 1
+            stats = self.stats
+            if stats is None:
+                self.taskForPeriodicJob()
+            else:
+                startNs = time.perf_counter_ns()
+                self.taskForPeriodicJob()
+                durationNs = time.perf_counter_ns() - startNs
+                stats.periodicJob.record(durationNs)
+                stats.periodicJobNs += durationNs
 
+    # runtime is only rendered on request (status, list), not in the loop
     def calculateRuntime(self):
-        self.runtime = str((datetime.now(ZoneInfo('Europe/Paris')) - self.starttime))
+        endNs = self.stopNs if self.stopNs is not None else time.monotonic_ns()
+        self.runtime = str(timedelta(microseconds=(endNs - self.startNs) // 1000))
         return self.runtime
     
     def set_timer(self, timerMin = None, timerMode = 'set'):
@@ -246,61 +771,220 @@ class ThreadingBgWorker(threading.Thread):
             if timerMin:
                 # Set new timer value from now
                 self.timerMin = timerMin
-                self.timeToStop = datetime.now(ZoneInfo('Europe/Paris')) + timedelta(minutes=self.timerMin)
+                self.timeToStopNs = time.monotonic_ns() + int(self.timerMin * NS_PER_MIN)
 
             else:
                 # Reset timer (set job to infinity-job)
-                self.timerMin = None
+                self.clear_timer()
 
         elif timerMode == 'add':
-            if timerMin:
+            if timerMin and self.timeToStopNs is not None:
                 # Add time to existing timer
                 self.timerMin = self.timerMin + timerMin
-                self.timeToStop = self.timeToStop + timedelta(minutes=timerMin)
+                self.timeToStopNs = self.timeToStopNs + int(timerMin * NS_PER_MIN)
+
+            elif timerMin:
+                # No timer running: start a new one from now
+                self.timerMin = timerMin
+                self.timeToStopNs = time.monotonic_ns() + int(self.timerMin * NS_PER_MIN)
 
             else:
                 # Reset timer (set job to infinity-job)
-                self.timerMin = None
+                self.clear_timer()
 
         else:
             # Reset timer (set job to infinity-job)
-            self.timerMin = None
+            self.clear_timer()
+
+        # replace the deadline at the scheduler and
+        # let the loop recalculate its wait with the new deadline
+        if self.running:
+            self.armTimer()
+        self.wake()
+        self.publishStatus()
+
+    def clear_timer(self):
+        self.timerMin = None
+        self.timeToStopNs = None
+
+    def set_pace(self, mode, slowDownSec = None, rateHz = None, burst = 1, idleMaxSec = 1.0):
+        '''
+        Change the pacing of the loop (PaceMode), raises ValueError for invalid values.
+            - fixed: wait `slowDownSec` after every iteration
+            - rate: `rateHz` iterations per second, up to `burst` missed ones are caught up
+            - adaptive: idle iterations back off up to `idleMaxSec`
+        The current wait ends, the new pace starts with the next iteration.
+        '''
+        pacer = self.makePacer(mode, slowDownSec, rateHz, burst, idleMaxSec)
+        print(f'set_pace, {pacer}')
+        if self.logging_on:
+            self.loggi.info(f'set_pace, {pacer}')
+        self.applyPace(pacer)
+        self.wake()
+        self.publishStatus()
+
+    @staticmethod
+    def makePacer(mode, slowDownSec = None, rateHz = None, burst = 1, idleMaxSec = 1.0):
+        return Pacer(mode, slowDownSec=slowDownSec, rateHz=rateHz, burst=burst,
+                     idleMinSec=min(0.001, idleMaxSec), idleMaxSec=idleMaxSec)
+
+    # the fixed mode is the slow-down of the loop (no pacer)
+    def applyPace(self, pacer):
+        if pacer.mode == PaceMode.fixed.value:
+            self.slowDownSec = pacer.slowDownSec
+            self.pacer = None
+        else:
+            self.pacer = pacer
+        self.paceVersion += 1
+
+    def timerExpired(self, nowNs):
+        if self.scheduler is not None:
+            return self.timerDue
+        timeToStopNs = self.timeToStopNs
+        return timeToStopNs is not None and nowNs >= timeToStopNs
+
+    def waitForNextIteration(self, nowNs, resumeNs = None):
+        '''
+        Slow-Down the loop for self.slowDownSec (or until `resumeNs` of the pacer).
+        The wait ends early on a stop request, when the timer expires or the pace
+        changes, a changed timer makes the wait recalculate its deadline.
+        Returns the monotonic time after the wait.
+        '''
+        if resumeNs is None:
+            resumeNs = nowNs + int(self.slowDownSec * NS_PER_SEC)
+        paceVersion = self.paceVersion
+        while True:
+            deadlineNs = resumeNs
+            # (a scheduler wakes the worker itself at the timer end and for the status)
+            if self.scheduler is None:
+                timeToStopNs = self.timeToStopNs
+                if timeToStopNs is not None and timeToStopNs < deadlineNs:
+                    deadlineNs = timeToStopNs
+                statusNextNs = self.statusNextNs
+                if statusNextNs is not None and statusNextNs < deadlineNs:
+                    deadlineNs = statusNextNs
+            if nowNs >= deadlineNs:
+                return nowNs
+            self.wakeup.wait((deadlineNs - nowNs) / NS_PER_SEC)
+            # flags are set before the event, so clearing here loses nothing
+            self.wakeup.clear()
+            nowNs = time.monotonic_ns()
+            if self.askForStop() or self.timerExpired(nowNs) or self.paceVersion != paceVersion:
+                return nowNs
+            # keep the snapshot fresh during long waits
+            self.checkForPublishStatus(nowNs)
+
+    def waitForBatch(self, nowNs):
+        '''
+        Wait for the next batch of jobs and run taskForBatch with it.
+        The wait is interrupted like the slow-down wait (stop, timer, status,
+        periodic job), without a scheduler it ends at the next deadline.
+        Returns the monotonic time after the batch.
+        '''
+        deadlineNs = None
+        if self.slowDownSec:
+            deadlineNs = nowNs + int(self.slowDownSec * NS_PER_SEC)
+        if self.scheduler is None:
+            for dueNs in (self.timeToStopNs, self.statusNextNs, self.periodicJobNextNs):
+                if dueNs is not None and (deadlineNs is None or dueNs < deadlineNs):
+                    deadlineNs = dueNs
+        timeoutSec = None if deadlineNs is None else max(0, deadlineNs - nowNs) / NS_PER_SEC
+        items = self.jobQueue.get_batch(self.batchSize, self.batchWaitSec, timeoutSec, self.wakeup.is_set)
+        # flags are set before the event, so clearing here loses nothing
+        self.wakeup.clear()
+        if items:
+            stats = self.stats
+            if stats is None:
+                self.taskForBatch(items)
+            else:
+                startNs = time.perf_counter_ns()
+                self.taskForBatch(items)
+                stats.batch.record(time.perf_counter_ns() - startNs)
+            self.jobsDone += len(items)
+        return time.monotonic_ns()
+
+    # wait of the pacer after an iteration (idle: the iteration had no work)
+    def waitForPace(self, pacer, nowNs, idle):
+        resumeNs = pacer.resume_at(nowNs, idle)
+        if resumeNs is None:
+            return nowNs
+        return self.waitForNextIteration(nowNs, resumeNs)
 
     def doJob(self):
         while self.running:
+            # hot-path instrumentation (only one check if disabled),
+            # the housekeeping is measured in every HOUSEKEEPING_SAMPLE-th iteration
+            stats = self.stats
+            sampleHousekeeping = stats is not None and not self.iterations % HOUSEKEEPING_SAMPLE
+            if sampleHousekeeping:
+                loopStartNs = time.perf_counter_ns()
+                stats.periodicJobNs = 0
             
             self.iterations += 1
-            # Update runtime variable
-            self.calculateRuntime()
 
             # What to do if stop command was send
             if self.askForStop():
                 # Do something at the end
-                self.taskForStop()
-                self.log_status()
+                self.endReason = 'stop'
+                self.disarmScheduler()
+                self.stopNs = time.monotonic_ns()
+                if self.stopRequestNs is not None:
+                    self.stopLatencyNs = self.stopNs - self.stopRequestNs
+                # stop tasks were already done by force_stop()
+                if not self.forceStopped:
+                    self.taskForStop()
+                    self.log_status()
+                self.finishCheckpoint()
                 self.running = False
+                self.publishStatus()
                 self.no_more_running.set()
                 break
 
             # What to do by every iteration of the while-loop
-            self.taskForIteration()
+            if stats is not None:
+                taskStartNs = time.perf_counter_ns()
+            result = self.taskForIteration()
+            if stats is not None:
+                taskEndNs = time.perf_counter_ns()
+                stats.iteration.record(taskEndNs - taskStartNs)
+            # without scheduler one clock read per iteration serves all deadline checks below,
+            # with scheduler the checks are flags set by the scheduler
+            nowNs = time.monotonic_ns() if self.scheduler is None else None
             # What to do by a period of time (set by self.periodicJobSec)
             # If self.periodicJobSec = None, the periodicJob will be not processed
-            self.checkForStartPeriodicJob()
+            self.checkForStartPeriodicJob(nowNs)
+            # What to do by the status cadence (set by self.statusIntervalSec)
+            self.checkForPublishStatus(nowNs)
+
+            if sampleHousekeeping:
+                # loop overhead without the tasks (the slow-down wait is not counted)
+                stats.housekeeping.record(time.perf_counter_ns() - taskEndNs + taskStartNs - loopStartNs - stats.periodicJobNs)
 
+            # Wait for jobs (the slow-down is the longest idle wait),
+            # pace the loop (target rate, idle backoff) or
             # Slow-Down the Loop (useful for testing)
-            if self.slowDownSec:
-                time.sleep(self.slowDownSec)
+            pacer = self.pacer
+            if self.jobQueue is not None:
+                nowNs = self.waitForBatch(nowNs if nowNs is not None else time.monotonic_ns())
+            elif pacer is not None:
+                nowNs = self.waitForPace(pacer, nowNs if nowNs is not None else time.monotonic_ns(), result is NO_WORK)
+            elif self.slowDownSec:
+                nowNs = self.waitForNextIteration(nowNs if nowNs is not None else time.monotonic_ns())
 
             # Check the timer (if set)
             if self.timerMin:
-                if (datetime.now(ZoneInfo('Europe/Paris')) >= self.timeToStop):
+                if self.timerExpired(nowNs):
                     # What to do by timer end
+                    self.endReason = 'timer'
+                    self.disarmScheduler()
+                    self.stopNs = time.monotonic_ns()
                     if self.logging_on:
-                        self.loggi.info(f'TimerEnd at {datetime.now(ZoneInfo("Europe/Paris"))}')
+                        self.loggi.info(f'TimerEnd at {self.wallclock(self.stopNs)}')
                     self.taskForTimerEnd()
                     self.log_status()
+                    self.finishCheckpoint()
                     # Send information to host that the job is ready
                     self.running = False
+                    self.publishStatus()
                     self.no_more_running.set()
                     break
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# conversion factor for the monotonic (nanosecond) deadlines
+NS_PER_SEC = 1_000_000_000
+
+
+class TimerHandle():
+    '''
+    Handle of a scheduled callback.
+    Returned by TimerScheduler.schedule() and used to cancel the callback.
+    '''
+    __slots__ = ('dueNs', 'callback', 'cancelled', 'fired')
+
+    def __init__(self, dueNs, callback):
+        self.dueNs = dueNs
+        self.callback = callback
+        self.cancelled = False
+        self.fired = False
+
+
+class TimerScheduler(threading.Thread):
+    '''
+    Central timer-heap for the timers and periodic jobs of all background workers.
+    One scheduler thread sleeps until the next deadline of all registered workers
+    and calls the callback of every due entry. The callbacks run in the scheduler
+    thread, so they have to be short (set a flag, wake up the worker).
+    Scheduling is O(log n), cancelling is O(1) (cancelled entries are dropped
+    when they reach the top of the heap or when the heap is compacted).
+    A failing callback is logged and counted, the scheduler goes on with the others.
+    Parameters:
+        - `name`: name of the scheduler thread
+        - `logger`: Logger object for failing callbacks
+    '''
+    def __init__(self, name = 'timer-scheduler', logger = None):
+        super().__init__(name=name, daemon=True)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.heap = []
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.running_enabled = True
+        self.cancelled = 0
+        self.fired = 0
+        self.failed = 0
+
+    # schedule a callback at a monotonic time (ns), callback gets the handle as argument
+    def schedule(self, dueNs, callback):
+        handle = TimerHandle(dueNs, callback)
+        with self.condition:
+            heapq.heappush(self.heap, (dueNs, next(self.sequence), handle))
+            # wake the scheduler only if the new entry is the next one to fire
+            if self.heap[0][2] is handle:
+                self.condition.notify()
+        return handle
+
+    # schedule a callback in `delaySec` seconds from now
+    def schedule_in(self, delaySec, callback):
+        return self.schedule(time.monotonic_ns() + int(delaySec * NS_PER_SEC), callback)
+
+    # cancel a scheduled callback (lazy removal from the heap)
+    def cancel(self, handle):
+        if handle is None:
+            return
+        with self.condition:
+            if handle.cancelled or handle.fired:
+                return
+            handle.cancelled = True
+            self.cancelled += 1
+            # compact the heap if most of its entries are cancelled
+            if self.cancelled > 64 and self.cancelled * 2 > len(self.heap):
+                self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    # number of pending (not cancelled) entries
+    def pending(self):
+        with self.condition:
+            return len(self.heap) - self.cancelled
+
+    def get_status(self):
+        return {
+            'pending': self.pending(),
+            'fired': self.fired,
+            'failed': self.failed,
+        }
+
+    # stop the scheduler thread
+    def stop(self):
+        with self.condition:
+            self.running_enabled = False
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            due = []
+            with self.condition:
+                while self.running_enabled and not due:
+                    # drop cancelled entries on top of the heap
+                    while self.heap and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)
+                        self.cancelled -= 1
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    nowNs = time.monotonic_ns()
+                    dueNs = self.heap[0][0]
+                    if nowNs < dueNs:
+                        self.condition.wait((dueNs - nowNs) / NS_PER_SEC)
+                        continue
+                    # collect all due entries, they will be fired outside the lock
+                    while self.heap and self.heap[0][0] <= nowNs:
+                        handle = heapq.heappop(self.heap)[2]
+                        if handle.cancelled:
+                            self.cancelled -= 1
+                        else:
+                            handle.fired = True
+                            due.append(handle)
+                if not self.running_enabled:
+                    return
+
+            for handle in due:
+                self.fired += 1
+                # (one failing callback must not end the timers of all workers)
+                try:
+                    handle.callback(handle)
+                except Exception:
+                    self.failed += 1
+                    self.logger.exception(f'Scheduler callback {handle.callback!r} failed')
@@ -0,0 +1,109 @@
+import importlib
+import threading
+import time
+from collections.abc import Mapping
+from importlib import metadata
+
+# entry point group of installed worker classes
+ENTRY_POINT_GROUP = 'bgworker.workers'
+
+
+# a worker definition could not be imported
+class WorkerImportError(ImportError):
+    pass
+
+
+class WorkerRegistry(Mapping):
+    '''
+    Worker definitions that are imported on demand.
+    A definition is a worker class or a reference "package.module:ClassName";
+    installed packages can register references as entry points (group
+    `bgworker.workers`). The names are known without importing anything
+    (`name in registry`, `tuple(registry)`), a reference is imported on the
+    first access (`registry[name]`, i.e. the first start of the worker) and
+    the class is cached. The import time of every imported module is kept
+    for the `registry` command.
+    The registry is a read-only mapping, so it can be used as `worker_definitons`.
+    Parameters:
+        - `definitions`: dict of worker name -> class or "module:Class"
+        - `entry_point_group`: entry point group to add (None: no entry points),
+                               the explicit definitions take precedence
+    '''
+    def __init__(self, definitions = None, entry_point_group = None):
+        self.references = {}
+        self.classes = {}
+        self.entryPoints = {}
+        self.lock = threading.Lock()
+        # module name -> import time in seconds
+        self.importTimes = {}
+        if entry_point_group is not None:
+            for entryPoint in metadata.entry_points(group=entry_point_group):
+                self.entryPoints[entryPoint.name] = entryPoint.value
+                self.references[entryPoint.name] = entryPoint.value
+        for name, definition in (definitions or {}).items():
+            self.register(name, definition)
+
+    def register(self, name, definition):
+        with self.lock:
+            if isinstance(definition, str):
+                if ':' not in definition:
+                    raise ValueError(f'worker definition {definition!r} of {name} is not "module:Class"')
+                self.references[name] = definition
+                self.classes.pop(name, None)
+            else:
+                self.references[name] = f'{definition.__module__}:{definition.__qualname__}'
+                self.classes[name] = definition
+
+    def __iter__(self):
+        return iter(self.references)
+
+    def __len__(self):
+        return len(self.references)
+
+    def __contains__(self, name):
+        return name in self.references
+
+    # worker class of a name, imported on the first access
+    def __getitem__(self, name):
+        workerClass = self.classes.get(name)
+        if workerClass is not None:
+            return workerClass
+        reference = self.references[name]
+        with self.lock:
+            if name not in self.classes:
+                self.classes[name] = self.load(name, reference)
+            return self.classes[name]
+
+    def load(self, name, reference):
+        moduleName, _, attribute = reference.partition(':')
+        try:
+            startNs = time.perf_counter_ns()
+            module = importlib.import_module(moduleName)
+            # the first import of a module is the expensive one
+            self.importTimes.setdefault(moduleName, (time.perf_counter_ns() - startNs) / 1e9)
+            workerClass = module
+            for part in attribute.split('.'):
+                workerClass = getattr(workerClass, part)
+        # (also a SyntaxError or any exception of the module body, the shell and the
+        # control server must survive a broken worker module)
+        except Exception as error:
+            raise WorkerImportError(f'worker {name} ({reference}) can not be imported: '
+                                    f'{type(error).__name__}: {error}') from error
+        return workerClass
+
+    def is_loaded(self, name):
+        return name in self.classes
+
+    # definitions with their reference, origin and import state
+    def get_report(self):
+        report = []
+        for name, reference in self.references.items():
+            moduleName = reference.partition(':')[0]
+            report.append({
+                'name': name,
+                'reference': reference,
+                'entry-point': name in self.entryPoints and self.entryPoints[name] == reference,
+                'loaded': name in self.classes,
+                'import-ms': None if moduleName not in self.importTimes else round(self.importTimes[moduleName] * 1000, 3),
+            })
+        return report
@@ -0,0 +1,188 @@
+import math
+from array import array
+
+# conversion factor for the monotonic (nanosecond) timestamps
+NS_PER_SEC = 1_000_000_000
+
+# the loop housekeeping is measured in every n-th iteration (a sample, saves two clock reads)
+HOUSEKEEPING_SAMPLE = 16
+
+
+class LatencyHistogram():
+    '''
+    Latency histogram with fixed log-linear buckets (HDR-style), values in nanoseconds.
+    Every power of two is split into 2**subBucketBits linear sub-buckets, so the
+    relative error of a percentile is at most 1 / 2**subBucketBits (6.25 % for 4 bits).
+    Recording is O(1) without allocation, the memory is fixed (one array of counters).
+    Values above 2**maxExponent ns (about 18 minutes for 40) land in the last bucket.
+    Parameters:
+        - `subBucketBits`: resolution of the buckets
+        - `maxExponent`: largest power of two with own buckets
+    '''
+    def __init__(self, subBucketBits = 4, maxExponent = 40):
+        self.subBuckets = 1 << subBucketBits
+        self.subBucketBits = subBucketBits
+        # values below 2 * subBuckets have one bucket each
+        self.linearLimit = 2 * self.subBuckets
+        bucketCount = self.linearLimit + (maxExponent - subBucketBits) * self.subBuckets
+        self.counts = array('Q', bytes(8 * bucketCount))
+        self.lastIndex = bucketCount - 1
+        # value >> shift keeps subBucketBits + 1 significant bits
+        self.shiftBase = subBucketBits + 1
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def index(self, value):
+        if value < self.linearLimit:
+            return value
+        shift = value.bit_length() - self.shiftBase
+        # = linearLimit + (shift - 1) * subBuckets + (value >> shift) - subBuckets
+        index = (shift << self.subBucketBits) + (value >> shift)
+        return index if index < self.lastIndex else self.lastIndex
+
+    # highest value of a bucket
+    def upperBound(self, index):
+        if index < self.linearLimit:
+            return index
+        shift, subBucket = divmod(index - self.linearLimit, self.subBuckets)
+        shift += 1
+        return ((self.subBuckets + subBucket + 1) << shift) - 1
+
+    # hot path: index() is inlined
+    def record(self, value):
+        if value < self.linearLimit:
+            if value < 0:
+                value = 0
+            index = value
+        else:
+            shift = value.bit_length() - self.shiftBase
+            index = (shift << self.subBucketBits) + (value >> shift)
+            if index > self.lastIndex:
+                index = self.lastIndex
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # values of the given percentiles (0..100), in one pass over the buckets
+    def percentiles(self, *percents):
+        results = [0] * len(percents)
+        if self.count == 0:
+            return results
+        targets = sorted((max(1, math.ceil(percent / 100 * self.count)), position) for position, percent in enumerate(percents))
+        cumulative = 0
+        target = 0
+        for index, bucketCount in enumerate(self.counts):
+            if not bucketCount:
+                continue
+            cumulative += bucketCount
+            while target < len(targets) and cumulative >= targets[target][0]:
+                # (the last bucket has no upper bound, its values can be up to the max)
+                results[targets[target][1]] = self.max if index == self.lastIndex else min(self.upperBound(index), self.max)
+                target += 1
+            if target == len(targets):
+                break
+        return results
+
+    def summary(self):
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0,
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+            'max': self.max,
+        }
+
+
+class EwmaRate():
+    '''
+    Exponentially weighted moving average of a rate (events per second).
+    Updated with the absolute value of a counter, the weight of the last
+    interval depends on its length (time constant `tauSec`).
+    The first rate is the average over at least `seedSec` (None before), a status
+    published a few milliseconds after the start does not set the rate for the next minute.
+    '''
+    def __init__(self, tauSec, seedSec = 1):
+        self.tauNs = tauSec * NS_PER_SEC
+        self.seedNs = seedSec * NS_PER_SEC
+        self.rate = None
+        self.lastCount = None
+        self.lastNs = None
+
+    def update(self, count, nowNs):
+        if self.lastNs is not None and nowNs > self.lastNs:
+            elapsedNs = nowNs - self.lastNs
+            current = (count - self.lastCount) * NS_PER_SEC / elapsedNs
+            if self.rate is None:
+                # (the first interval goes on until it is long enough)
+                if elapsedNs < self.seedNs:
+                    return None
+                self.rate = current
+            else:
+                alpha = 1 - math.exp(-elapsedNs / self.tauNs)
+                self.rate += alpha * (current - self.rate)
+        self.lastCount = count
+        self.lastNs = nowNs
+        return self.rate
+
+
+class WorkerStats():
+    '''
+    Hot-path instrumentation of a background worker.
+        - `iteration`: duration of taskForIteration
+        - `periodic-job`: duration of taskForPeriodicJob
+        - `batch`: duration of taskForBatch (workers with a job queue)
+        - `housekeeping`: loop overhead of an iteration without the tasks and the slow-down wait
+          (every HOUSEKEEPING_SAMPLE-th iteration)
+        - iterations per second as EWMA over 10 s and 60 s
+    '''
+    def __init__(self):
+        self.histograms = {
+            'iteration': LatencyHistogram(),
+            'periodic-job': LatencyHistogram(),
+            'batch': LatencyHistogram(),
+            'housekeeping': LatencyHistogram(),
+        }
+        self.iteration = self.histograms['iteration']
+        self.periodicJob = self.histograms['periodic-job']
+        self.batch = self.histograms['batch']
+        self.housekeeping = self.histograms['housekeeping']
+        self.rate10s = EwmaRate(10)
+        self.rate60s = EwmaRate(60)
+        # time of the periodic job in the current iteration (not housekeeping)
+        self.periodicJobNs = 0
+
+    def updateRates(self, iterations, nowNs):
+        self.rate10s.update(iterations, nowNs)
+        self.rate60s.update(iterations, nowNs)
+
+    # all histograms and rates as plain dict (values in ns)
+    def summary(self, names = None):
+        summary = {name: histogram.summary() for name, histogram in self.histograms.items()
+                   if names is None or name in names}
+        summary['rate-10s'] = self.rate10s.rate
+        summary['rate-60s'] = self.rate60s.rate
+        return summary
+
+    # the part of the summary used in the status of a worker
+    def statusSummary(self):
+        return self.summary(names=('iteration', 'housekeeping'))
+
+
+# short form of a stats summary for the status of a worker
+def stats_status(summary):
+    if not summary:
+        return {}
+    iteration = summary['iteration']
+    return {
+        'rate-10s': None if summary['rate-10s'] is None else round(summary['rate-10s'], 2),
+        'rate-60s': None if summary['rate-60s'] is None else round(summary['rate-60s'], 2),
+        'iteration-p50-ms': round(iteration['p50'] / 1e6, 3),
+        'iteration-p99-ms': round(iteration['p99'] / 1e6, 3),
+        'iteration-max-ms': round(iteration['max'] / 1e6, 3),
+        'housekeeping-p99-us': round(summary['housekeeping']['p99'] / 1e3, 2),
+    }
@@ -0,0 +1,147 @@
+import fnmatch
+import queue
+import re
+from collections.abc import MutableMapping
+from enum import Enum
+
+# states of the workers in the table
+class WorkerState(str, Enum):
+   running = 'running'
+   restarting = 'restarting'
+
+
+# names matching a glob pattern (*, ?, [...]); a name without wildcards is compared directly
+def match_names(names, pattern):
+    if not has_wildcards(pattern):
+        return [name for name in names if name == pattern]
+    regex = re.compile(fnmatch.translate(pattern))
+    return [name for name in names if regex.match(name)]
+
+
+def has_wildcards(pattern):
+    return any(char in pattern for char in '*?[')
+
+
+class WorkerTable(MutableMapping):
+    '''
+    Running workers of the engine by name (a dict with indexes).
+        - pools: definition name -> instances (in start order), so the instances
+          of a worker name are found without scanning all workers
+        - states: one set of names per WorkerState
+        - completion queue: finished workers put themselves on it (exit callback),
+          reap() removes them, so the cleanup costs O(finished) and not O(workers)
+    The table is a mapping of name -> worker, existing code can use it like the dict it replaces.
+    Parameters:
+        - `definition_of`: callable(name) -> definition name of an instance
+    '''
+    def __init__(self, definition_of = None):
+        self.workers = {}
+        self.definition_of = definition_of if definition_of is not None else (lambda name: name)
+        # definition -> {instance: None} (ordered set)
+        self.pools = {}
+        self.states = {state.value: set() for state in WorkerState}
+        self.stateOf = {}
+        self.finished = queue.SimpleQueue()
+
+    def __getitem__(self, name):
+        return self.workers[name]
+
+    def __setitem__(self, name, process):
+        self.workers[name] = process
+        self.pools.setdefault(self.definition_of(name), {})[name] = None
+        self.set_state(name, WorkerState.running.value)
+
+    def __delitem__(self, name):
+        del self.workers[name]
+        definition = self.definition_of(name)
+        instances = self.pools.get(definition)
+        if instances is not None:
+            instances.pop(name, None)
+            if not instances:
+                del self.pools[definition]
+        state = self.stateOf.pop(name, None)
+        if state is not None:
+            self.states[state].discard(name)
+
+    def __iter__(self):
+        return iter(self.workers)
+
+    def __len__(self):
+        return len(self.workers)
+
+    def __contains__(self, name):
+        return name in self.workers
+
+    def get(self, name, default = None):
+        return self.workers.get(name, default)
+
+    def set_state(self, name, state):
+        previous = self.stateOf.get(name)
+        if previous == state:
+            return
+        if previous is not None:
+            self.states[previous].discard(name)
+        self.states[state].add(name)
+        self.stateOf[name] = state
+
+    def state_of(self, name):
+        return self.stateOf.get(name)
+
+    # names in a state (in no particular order)
+    def by_state(self, state):
+        return self.states[state]
+
+    # instances of a definition name (start order)
+    def instances_of(self, definition):
+        return list(self.pools.get(definition, ()))
+
+    # definition names with their instances
+    def get_pools(self):
+        return {definition: list(instances) for definition, instances in list(self.pools.items())}
+
+    # exit callback of the workers (runs in the thread of the ending worker)
+    def worker_finished(self, process):
+        self.finished.put(process)
+
+    def reap(self, keep = None):
+        '''
+        Remove the finished workers that are still in the table.
+        `keep(name)` returns True for finished workers that stay (e.g. a restart
+        is pending), they change to the state restarting and are checked again
+        on the next reap. Returns the names of the removed workers.
+        '''
+        removed = []
+        recheck = list(self.states[WorkerState.restarting.value])
+        while True:
+            try:
+                process = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            name = process.name
+            # replaced meanwhile (restarted or started again)
+            if self.workers.get(name) is not process:
+                continue
+            if keep is not None and keep(name):
+                self.set_state(name, WorkerState.restarting.value)
+                continue
+            del self[name]
+            removed.append(name)
+        # (a restarted worker is set again and is running)
+        for name in recheck:
+            if self.stateOf.get(name) == WorkerState.restarting.value and (keep is None or not keep(name)):
+                del self[name]
+                removed.append(name)
+        return removed
+
+    # names filtered by a glob pattern and a state (start order),
+    # a pattern without wildcards is a worker name or the definition of a pool
+    def select(self, pattern = None, state = None):
+        if pattern is not None and not has_wildcards(pattern):
+            names = [pattern] if pattern in self.workers else self.instances_of(pattern)
+        else:
+            names = self.workers
+        if state is not None:
+            names = [name for name in names if name in self.states[state]]
+        if pattern is None or not has_wildcards(pattern):
+            return list(names)
+        return match_names(names, pattern)